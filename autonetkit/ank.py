@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import itertools
+import re
+import string
 from collections import namedtuple
 import autonetkit
 
@@ -90,6 +92,18 @@ def set_node_default(nm_graph, nbunch=None, **kwargs):
             if key not in graph.node[node]:
                 graph.node[node][key] = val
 
+    # labels and indexes are cached: writes to the nx graph bypass
+    # NmNode.__setattr__
+    if any(_is_label_attr(nm_graph, key) for key in kwargs):
+        nm_graph._anm._invalidate_label_index()
+    for key in kwargs:
+        nm_graph._anm._invalidate_attr_index(attr=key)
+
+
+def _is_label_attr(nm_graph, key):
+    """If writing key may change node labels"""
+    return key == 'label' or key in nm_graph._anm.label_attrs
+
 # TODO: also add ability to copy multiple attributes
 
 # TODO: rename to copy_node_attr_from
@@ -164,6 +178,10 @@ def copy_attr_from(overlay_src, overlay_dst, src_attr, dst_attr=None,
             if node in graph_dst:
                 graph_dst.node[node][dst_attr] = val
 
+    if _is_label_attr(overlay_dst, dst_attr):
+        overlay_dst._anm._invalidate_label_index()
+    overlay_dst._anm._invalidate_attr_index(attr=dst_attr)
+
 
 def copy_int_attr_from(overlay_src, overlay_dst, src_attr, dst_attr=None,
                        nbunch=None, type=None, default=None):
@@ -359,22 +377,29 @@ def split(nm_graph, edges, retain=None, id_prepend=''):
         pass  # already a list
 
     graph = unwrap_graph(nm_graph)
+    directed = graph.is_directed()
+    multigraph = graph.is_multigraph()
+    anm = nm_graph._anm
+    overlay_id = nm_graph._overlay_id
     edges_to_add = []
     added_nodes = []
+    edges_to_remove = []
 
     # handle single edge
-    if edges in nm_graph.edges():
+    if isinstance(edges, NmEdge):
         edges = [edges] # place into list for iteration
 
-    edges = list(edges)
-
+    # work on the edge ids and NetworkX data, with a single insert and
+    # removal for all the edges
     for edge in edges:
-        src = edge.src
-        dst = edge.dst
+        src_id = edge.src_id
+        dst_id = edge.dst_id
+        src = NmNode(anm, overlay_id, src_id)
+        dst = NmNode(anm, overlay_id, dst_id)
 
         # Form ID for the new node
 
-        if graph.is_directed():
+        if directed:
             new_id = '%s%s_%s' % (id_prepend, src, dst)
         else:
 
@@ -384,26 +409,27 @@ def split(nm_graph, edges, retain=None, id_prepend=''):
             (node_a, node_b) = sorted([src, dst])
             new_id = '%s%s_%s' % (id_prepend, node_a, node_b)
 
-        if nm_graph.is_multigraph():
-            new_id = new_id + '_%s' % edge.ekey
+        if multigraph:
+            ekey = edge.ekey
+            new_id = new_id + '_%s' % ekey
+            data = graph.adj[src_id][dst_id][ekey]
+            edges_to_remove.append((src_id, dst_id, ekey))
+        else:
+            data = graph.adj[src_id][dst_id]
+            edges_to_remove.append((src_id, dst_id))
 
-        ports = edge.raw_interfaces
-        data = edge._data
+        ports = data.get('_ports')
         src_data = data.copy()
-        if src in ports:
-            src_int_id = ports[src.node_id]
-            src_data['_ports'] = {src.node_id: src_int_id}
+        if src_id in ports:
+            src_data['_ports'] = {src_id: ports[src_id]}
         dst_data = data.copy()
-        if dst in ports:
-            dst_int_id = ports[dst.node_id]
-            dst_data['_ports'] = {dst.node_id: dst_int_id}
+        if dst_id in ports:
+            dst_data['_ports'] = {dst_id: ports[dst_id]}
 
         # Note: don't retain ekey since adding to a new node
 
-        append = (src.node_id, new_id, src_data)
-        edges_to_add.append(append)
-        append = (dst.node_id, new_id, dst_data)
-        edges_to_add.append(append)
+        edges_to_add.append((src_id, new_id, src_data))
+        edges_to_add.append((dst_id, new_id, dst_data))
 
         added_nodes.append(new_id)
 
@@ -412,7 +438,7 @@ def split(nm_graph, edges, retain=None, id_prepend=''):
 
     # remove the pre-split edges
 
-    nm_graph.remove_edges_from(edges)
+    graph.remove_edges_from(edges_to_remove)
 
     return wrap_nodes(nm_graph, added_nodes)
 
@@ -461,60 +487,107 @@ def explode_nodes(nm_graph, nodes, retain=None):
     except AttributeError:
         pass  # already a list
 
+    graph = unwrap_graph(nm_graph)
     total_added_edges = []  # keep track to return
 
     if nodes in nm_graph:
         nodes = [nodes] # place into list for iteration
 
-    for node in nodes:
+    for node_id in unwrap_nodes(nodes):
+        # later nodes may be connected to the edges added for this node,
+        # so insert and remove node by node, in a single call each
+        edges = _node_edges(graph, node_id)
+        edges_to_add = []
+        for (index, edge_a) in enumerate(edges):
+            # each pair once, in the order of the pairs of node.edges()
+            for edge_b in edges[index + 1:]:
+                # edges are (dst, key, data): order as for NmEdge
+                (src_edge, dst_edge) = sorted([edge_a, edge_b],
+                                              key=lambda edge: edge[:2])
+
+                src = src_edge[0]  # src is the exploded node
+                dst = dst_edge[0]  # src is the exploded node
+
+                if src == dst:
+                    continue  # don't add self-loop
+
+                src_data = src_edge[2]
+                dst_data = dst_edge[2]
+                data = dict((key, src_data.get(key)) for key in retain)
+                data.update((key, dst_data.get(key)) for key in retain)
+
+                data['_ports'] = {}
+                try:
+                    data['_ports'][src] = src_data['_ports'][src]
+                except KeyError:
+                    pass  # not set
+                try:
+                    data['_ports'][dst] = dst_data['_ports'][dst]
+                except KeyError:
+                    pass  # not set
+
+                edges_to_add.append((src, dst, data))
+
+        if edges_to_add:
+            nm_graph.add_edges_from(edges_to_add)
+        total_added_edges += edges_to_add
+
+        nm_graph.remove_node(node_id)
+    return wrap_edges(nm_graph, total_added_edges)
 
-        edges = node.edges()
-        edge_pairs = [(e1, e2) for e1 in edges for e2 in edges if e1
-                      != e2]
-        added_pairs = set()
-        for edge_pair in edge_pairs:
-            (src_edge, dst_edge) = sorted(edge_pair)
-            if (src_edge, dst_edge) in added_pairs:
-                continue  # already added this link pair in other direction
-            else:
-                added_pairs.add((src_edge, dst_edge))
 
-            src = src_edge.dst  # src is the exploded node
-            dst = dst_edge.dst  # src is the exploded node
+def _node_edges(graph, node_id):
+    """Returns (dst, key, data) for the edges of node_id in graph, in the
+    order of NmNode.edges(). key is 0 if graph isn't a multigraph"""
 
-            if src == dst:
-                continue  # don't add self-loop
+    if graph.is_multigraph():
+        return [(dst, key, data)
+                for (dst, keydict) in graph.adj[node_id].items()
+                for (key, data) in keydict.items()]
+    return [(dst, 0, data) for (dst, data) in graph.adj[node_id].items()]
 
-            data = dict((key, src_edge._data.get(key)) for key in
-                        retain)
-            node_to_dst_data = dict((key, dst_edge._data.get(key))
-                                    for key in retain)
-            data.update(node_to_dst_data)
 
-            data['_ports'] = {}
-            try:
-                src_int_id = src_edge.raw_interfaces[src.node_id]
-            except KeyError:
-                pass  # not set
-            else:
-                data['_ports'][src.node_id] = src_int_id
+def hub_nodes(nm_graph, nodes):
+    """Compact alternative to explode_nodes: rather than connecting the
+    neighbors of each node in a full mesh, the node is kept as a multipoint
+    hub. NmNode neighbors(), edges() and neighbor_interfaces() of the
+    attached nodes report their peers through the hub, so a broadcast domain
+    of n nodes is stored as n edges rather than n(n-1)/2.
+    The edges to the hubs, and their interfaces, are marked as multipoint.
+    Returns the edges to the hubs.
 
-            try:
-                dst_int_id = dst_edge.raw_interfaces[dst.node_id]
-            except KeyError:
-                pass  # not set
-            else:
-                data['_ports'][dst.node_id] = dst_int_id
+    >>> anm = autonetkit.topos.house()
+    >>> g_phy = anm['phy']
+    >>> r2 = g_phy.node("r2")
+    >>> g_phy.node("r1").neighbors()
+    [r2, r3]
+    >>> hub_edges = hub_nodes(g_phy, r2)
+    >>> g_phy.node("r1").neighbors()
+    [r4, r3]
+    >>> g_phy.node("r4").edges(multipoint=True)
+    [(r4, r1), (r4, r3)]
+    >>> [edge.hub for edge in g_phy.node("r4").edges(multipoint=True)]
+    [r2, r2]
 
-            new_edge = (src.node_id, dst.node_id, data)
+    """
 
-            # TODO: use add_edge
+    if nodes in nm_graph:
+        nodes = [nodes] # place into list for iteration
 
-            nm_graph.add_edges_from([new_edge])
-            total_added_edges.append(new_edge)
+    node_ids = list(unwrap_nodes(nodes))
+    anm = nm_graph._anm
+    hub_edges = []
+    for node_id in node_ids:
+        node = NmNode(anm, nm_graph._overlay_id, node_id)
+        node.multipoint_hub = True
+        for edge in nm_graph.edges(node):
+            edge.multipoint = True
+            for interface in edge.interfaces():
+                interface.multipoint = True
+            hub_edges.append(edge)
 
-        nm_graph.remove_node(node)
-    return wrap_edges(nm_graph, total_added_edges)
+    anm._add_hubs(nm_graph._overlay_id, node_ids)
+    return hub_edges
 
 
 def label(nm_graph, nodes):
@@ -586,8 +659,7 @@ def aggregate_nodes(nm_graph, nodes, retain=None):
         component_nodes_list = nx.connected_components(subgraph)
     for component_nodes in component_nodes_list:
         if len(component_nodes) > 1:
-            component_nodes = [nm_graph.node(n)
-                               for n in component_nodes]
+            component = set(component_nodes)
 
             # TODO: could choose most connected, or most central?
             # TODO: refactor so use nodes_to_remove
@@ -597,28 +669,23 @@ def aggregate_nodes(nm_graph, nodes, retain=None):
             log.debug('Retaining %s, removing %s', base,
                       nodes_to_remove)
 
-            external_edges = []
-            for node in nodes_to_remove:
-                external_edges += [e for e in node.edges() if e.dst
-                                   not in component_nodes]
-                # all edges out of component
-
-            log.debug('External edges %s', external_edges)
+            # all edges out of component
             edges_to_add = []
-            for edge in external_edges:
-                dst = edge.dst
-                data = dict((key, edge._data.get(key)) for key in
-                            retain)
-                ports = edge.raw_interfaces
-                dst_int_id = ports[dst.node_id]
+            for node_id in nodes_to_remove:
+                for (dst, _, edge_data) in _node_edges(graph, node_id):
+                    if dst in component:
+                        continue
 
-                # TODO: bind to (and maybe add) port on the new switch?
+                    data = dict((key, edge_data.get(key)) for key in
+                                retain)
+                    dst_int_id = edge_data['_ports'][dst]
 
-                data['_ports'] = {dst.node_id: dst_int_id}
+                    # TODO: bind to (and maybe add) port on the new switch?
 
-                append = (base.node_id, dst.node_id, data)
-                edges_to_add.append(append)
+                    data['_ports'] = {dst: dst_int_id}
+                    edges_to_add.append((base, dst, data))
 
+            log.debug('External edges %s', edges_to_add)
             nm_graph.add_edges_from(edges_to_add)
             total_added_edges += edges_to_add
             nm_graph.remove_nodes_from(nodes_to_remove)
@@ -627,38 +694,91 @@ def aggregate_nodes(nm_graph, nodes, retain=None):
 
 
 def most_frequent(iterable):
-    """returns most frequent item in iterable"""
+    """returns most frequent item in iterable.
+    Ties go to the item that occurs first in iterable
 
-# from http://stackoverflow.com/q/1518522
+    >>> most_frequent([3, 1, 2, 1, 3])
+    3
 
-    gby = itertools.groupby
-    try:
-        return max(gby(sorted(iterable)), key=lambda (x, v):
-                   (len(list(v)), -iterable.index(x)))[0]
-    except ValueError, error:
-        log.warning('Unable to calculate most_frequent, %s', error)
+    """
+
+    counts = {}
+    items = []  # distinct items, in order of first occurrence
+    for item in iterable:
+        if item in counts:
+            counts[item] += 1
+        else:
+            counts[item] = 1
+            items.append(item)
+    return _most_frequent(items, counts)
+
+
+def _most_frequent(items, counts):
+    """Returns the first of items with the highest count in counts"""
+
+    if not items:
+        log.warning('Unable to calculate most_frequent, no items')
         return None
+    return max(items, key=counts.__getitem__)  # first of the maximum
+
+
+def _attribute_graph(graph, attribute_graph):
+    """Returns the NetworkX graph to read neighbor attributes from"""
+
+    if attribute_graph:
+        return unwrap_graph(attribute_graph)
+    return graph  # use input graph
+
+
+def _neigh_most_frequent(graph, attribute_graph, node_id, attribute,
+                         allow_none):
+    """neigh_most_frequent on NetworkX graphs, in a single pass over the
+    neighbors of node_id"""
+
+    node_data = attribute_graph.node
+    counts = {}
+    for neigh in graph.adj[node_id]:
+        value = node_data[neigh].get(attribute)
+        if value is not None or allow_none:
+            counts[value] = counts.get(value, 0) + 1
+
+    return _most_frequent(sorted(counts), counts)  # ties to the lowest
 
 
 def neigh_most_frequent(nm_graph, node, attribute,
                         attribute_graph=None, allow_none=False):
     """Used to explicitly force most frequent -
-    useful if integers such as ASN which would otherwise return mean"""
+    useful if integers such as ASN which would otherwise return mean
+
+    >>> anm = autonetkit.topos.house()
+    >>> neigh_most_frequent(anm['phy'], "r2", "asn")
+    1
+
+    """
 
     # TODO: rename to median?
 
     graph = unwrap_graph(nm_graph)
-    if attribute_graph:
-        attribute_graph = unwrap_graph(attribute_graph)
-    else:
-        attribute_graph = graph  # use input graph
-    node = unwrap_nodes(node)
-    values = [attribute_graph.node[n].get(attribute) for n in
-              graph.neighbors(node)]
-    values = sorted(values)
-    if not allow_none:
-        values = [v for v in values if v is not None]
-    return most_frequent(values)
+    return _neigh_most_frequent(graph, _attribute_graph(graph, attribute_graph),
+                                unwrap_nodes(node), attribute, allow_none)
+
+
+def neigh_most_frequent_batch(nm_graph, nodes, attribute,
+                              attribute_graph=None, allow_none=False):
+    """neigh_most_frequent for each of nodes, as a list in the same order
+
+    >>> anm = autonetkit.topos.house()
+    >>> g_phy = anm['phy']
+    >>> neigh_most_frequent_batch(g_phy, g_phy.nodes(), "asn")
+    [1, 1, 1, 1, 1]
+
+    """
+
+    graph = unwrap_graph(nm_graph)
+    attribute_graph = _attribute_graph(graph, attribute_graph)
+    return [_neigh_most_frequent(graph, attribute_graph, node_id, attribute,
+                                 allow_none)
+            for node_id in unwrap_nodes(nodes)]
 
 
 def neigh_average(nm_graph, node, attribute, attribute_graph=None):
@@ -670,23 +790,87 @@ def neigh_average(nm_graph, node, attribute, attribute_graph=None):
     """
 
     graph = unwrap_graph(nm_graph)
-    if attribute_graph:
-        attribute_graph = unwrap_graph(attribute_graph)
-    else:
-        attribute_graph = graph  # use input graph
-    node = unwrap_nodes(node)
-    values = [attribute_graph.node[n].get(attribute) for n in
-              graph.neighbors(node)]
-
-# TODO: use neigh_attr
+    node_data = _attribute_graph(graph, attribute_graph).node
+    values = [node_data[n].get(attribute)
+              for n in graph.adj[unwrap_nodes(node)]]
 
     try:
-        values = [float(val) for val in values]
-        return sum(values) / len(values)
+        return sum(float(val) for val in values) / len(values)
     except ValueError:
         return most_frequent(values)
 
 
+def neigh_graphics(nm_graph, nodes, co_ords_overlay, asn_overlay):
+    """Places each of nodes (eg the collision domains created by split)
+    at the average x and y of its neighbors in nm_graph, read from
+    co_ords_overlay, and sets its asn to the most frequent asn of its
+    neighbors in asn_overlay. The x, y and asn are set in the graphics
+    overlay, and the asn on the node.
+
+    As neigh_average and neigh_most_frequent, but for all nodes at once:
+    the neighbor attributes are read column by column from the NetworkX
+    graphs, rather than through a wrapper per node and attribute.
+
+    >>> anm = autonetkit.topos.house()
+    >>> g_phy = anm['phy']
+    >>> g_phy.update("r1", x=0, y=0)
+    >>> g_phy.update("r2", x=10, y=20)
+    >>> cds = split(g_phy, g_phy.edge("r1", "r2"), id_prepend="cd_")
+    >>> g_graphics = anm.add_overlay("graphics")
+    >>> neigh_graphics(g_phy, cds, g_phy, g_phy)
+    >>> [(cd, cd['graphics'].x, cd['graphics'].y, cd.asn) for cd in cds]
+    [(cd_r1_r2, 5.1, 10.1, 1)]
+
+    """
+
+    graph = unwrap_graph(nm_graph)
+    co_ords_graph = unwrap_graph(co_ords_overlay)
+    asn_graph = unwrap_graph(asn_overlay)
+    anm = nm_graph._anm
+    g_graphics = anm['graphics']
+    graphics_graph = unwrap_graph(g_graphics)
+    phy_graph = anm.overlay_nx_graphs['phy']
+
+    node_ids = unwrap_nodes(nodes)
+    neighbors = [list(graph.adj[node_id]) for node_id in node_ids]
+
+    def average(attribute):
+        node_data = co_ords_graph.node
+        return [sum(float(node_data[n].get(attribute)) for n in neighs)
+                / len(neighs) + 0.1  # temporary fix for gh-90
+                for neighs in neighbors]
+
+    xs = average('x')
+    ys = average('y')
+    asns = [_neigh_most_frequent(graph, asn_graph, node_id, 'asn', False)
+            for node_id in node_ids]  # arbitrary choice
+
+    added = False
+    for (node_id, x, y, asn) in zip(node_ids, xs, ys, asns):
+        if node_id not in graphics_graph:
+            graphics_graph.add_node(node_id)
+            added = True
+        graphics_data = graphics_graph.node[node_id]
+        graphics_data['x'] = x
+        graphics_data['y'] = y
+        graphics_data['asn'] = asn
+
+        # need to use asn in IP overlay for aggregating subnets
+        if node_id in phy_graph:
+            phy_graph.node[node_id]['asn'] = asn
+        graph.node[node_id]['asn'] = asn
+
+    if added:
+        g_graphics._invalidate_node_indexes()
+    anm._invalidate_attr_index(attr='x')
+    anm._invalidate_attr_index(attr='y')
+    anm._invalidate_attr_index(attr='asn')
+    if 'asn' in anm.label_attrs:
+        # labels memoized from the old asn, as NmNode.__setattr__
+        for node_id in node_ids:
+            anm._invalidate_node_label(node_id)
+
+
 def neigh_attr(nm_graph, node, attribute, attribute_graph=None):
     """TODO:
     tidy up parameters to take attribute_graph first, and
@@ -697,18 +881,11 @@ def neigh_attr(nm_graph, node, attribute, attribute_graph=None):
     """
 
     graph = unwrap_graph(nm_graph)
-    node = unwrap_nodes(node)
-    if attribute_graph:
-        attribute_graph = unwrap_graph(attribute_graph)
-    else:
-        attribute_graph = graph  # use input graph
+    node_data = _attribute_graph(graph, attribute_graph).node
 
     # Only look at nodes which exist in attribute_graph
-
-    neighs = (n for n in graph.neighbors(node))
-    valid_nodes = (n for n in neighs if n in attribute_graph)
-    return (attribute_graph.node[node].get(attribute) for node in
-            valid_nodes)
+    return (node_data[n].get(attribute)
+            for n in graph.adj[unwrap_nodes(node)] if n in node_data)
 
 
 def neigh_equal(nm_graph, node, attribute, attribute_graph=None):
@@ -716,7 +893,11 @@ def neigh_equal(nm_graph, node, attribute, attribute_graph=None):
     all have same attribute in attribute_graph"""
 
     neigh_attrs = neigh_attr(nm_graph, node, attribute, attribute_graph)
-    return len(set(neigh_attrs)) == 1
+    try:
+        first = next(neigh_attrs)
+    except StopIteration:
+        return False  # no neighbors
+    return all(value == first for value in neigh_attrs)
 
 
 def unique_attr(nm_graph, attribute):
@@ -734,6 +915,32 @@ def groupby(attribute, nodes):
     nodes = sorted(nodes, key=keyfunc)
     return itertools.groupby(nodes, key=keyfunc)
 
+_NON_DIGITS = re.compile('[^%s]' % string.digits)
+
+
+def sort_key(node):
+    """Key ordering nodes as NmNode.__lt__: by asn, then by the digits of
+    the label as a number, so r2 sorts before r10. Unlike __lt__, nodes
+    that compare equal have equal keys, so sorts can break ties
+
+    >>> g_phy = autonetkit.topos.house()['phy']
+    >>> [str(n) for n in sorted(g_phy, key=sort_key)]
+    ['r1', 'r2', 'r3', 'r4', 'r5']
+
+    """
+
+    label = node.label
+    if label is None:
+        label = node.node_id
+    try:
+        digits = _NON_DIGITS.sub('', label)
+    except TypeError:
+        return (node.asn, label)  # eg an int node_id
+    if digits:
+        return (node.asn, int(digits))
+    return (node.asn, digits)  # no digits
+
+
 def shortest_path(nm_graph, src, dst):
 
     # TODO: move to utils
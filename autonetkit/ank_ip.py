@@ -0,0 +1,194 @@
+"""Interned IP address and prefix values.
+
+IpAddress and IpNetwork are read-only netaddr IPAddress and IPNetwork
+subclasses, held as the int value and prefixlen as in netaddr. Equal values
+are interned: ip_address and ip_network return the existing value if it is
+still in use, so the allocators, design rules, DeviceModel and ank_json
+share one object per address or prefix rather than one per interface. The
+string form is formatted on first use, eg by a template, and kept.
+
+As they are shared, modifying a value in place raises TypeError: copy with
+netaddr.IPAddress() or netaddr.IPNetwork() to modify.
+
+>>> subnet = ip_network("10.0.0.0/30")
+>>> subnet is ip_network(167772160, 30)
+True
+>>> ip_address(167772161) in subnet
+True
+>>> subnet.prefixlen = 31
+Traceback (most recent call last):
+...
+TypeError: IpNetwork is read-only, copy with netaddr.IPNetwork() to modify
+
+"""
+
+import weakref
+
+import netaddr
+from netaddr.strategy import ipv4 as _ipv4
+from netaddr.strategy import ipv6 as _ipv6
+
+_modules = {4: _ipv4, 6: _ipv6}
+
+# (value, version) or (value, prefixlen, version) -> value, while in use
+_addresses = weakref.WeakValueDictionary()
+_networks = weakref.WeakValueDictionary()
+
+
+def _read_only(self, value):
+    raise TypeError("%s is read-only, copy with netaddr.%s() to modify"
+                    % (type(self).__name__, type(self).__bases__[0].__name__))
+
+
+class IpAddress(netaddr.IPAddress):
+
+    """Interned, read-only IPAddress, see ip_address"""
+
+    __slots__ = ('_text', '__weakref__')
+
+    value = property(lambda self: self._value, _read_only)
+
+    def __str__(self):
+        try:
+            return self._text
+        except AttributeError:
+            text = self._text = self._module.int_to_str(self._value)
+            return text
+
+    def __repr__(self):
+        return "IPAddress('%s')" % self
+
+    def __iadd__(self, num):
+        return self + num  # a new value, rather than in place
+
+    def __isub__(self, num):
+        return self - num
+
+    def __reduce__(self):
+        return (ip_address, (self._value, self._module.version))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class IpNetwork(netaddr.IPNetwork):
+
+    """Interned, read-only IPNetwork, see ip_network"""
+
+    __slots__ = ('_text',)  # IPNetwork is already weak referenceable
+
+    value = property(lambda self: self._value, _read_only)
+    prefixlen = property(lambda self: self._prefixlen, _read_only)
+
+    def __str__(self):
+        try:
+            return self._text
+        except AttributeError:
+            text = self._text = "%s/%s" % (
+                self._module.int_to_str(self._value), self._prefixlen)
+            return text
+
+    def __repr__(self):
+        return "IPNetwork('%s')" % self
+
+    def _copy(self):
+        return netaddr.IPNetwork(self)
+
+    def __iadd__(self, num):
+        network = self._copy()
+        network += num
+        return ip_network(network)
+
+    def __isub__(self, num):
+        network = self._copy()
+        network -= num
+        return ip_network(network)
+
+    def subnet(self, prefixlen, count=None, fmt=None):
+        return self._copy().subnet(prefixlen, count, fmt)
+
+    def supernet(self, prefixlen=0):
+        return self._copy().supernet(prefixlen)
+
+    def __reduce__(self):
+        return (ip_network, (self._value, self._prefixlen,
+                             self._module.version))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _version(value, version):
+    """version, or inferred from the size of value as netaddr does"""
+
+    if version:
+        return version
+    return 4 if value <= _ipv4.max_int else 6
+
+
+def ip_address(addr, version=None):
+    """Returns the interned IpAddress of addr: an int, a string or a netaddr
+    IPAddress. Raises netaddr.AddrFormatError as netaddr.IPAddress"""
+
+    if isinstance(addr, IpAddress):
+        return addr
+    if isinstance(addr, (int, long)):
+        version = _version(addr, version)
+        value = addr
+    else:
+        parsed = netaddr.IPAddress(addr, version)
+        (value, version) = (parsed.value, parsed.version)
+
+    key = (value, version)
+    result = _addresses.get(key)
+    if result is None:
+        result = object.__new__(IpAddress)
+        result._value = value
+        result._module = _modules[version]
+        _addresses[key] = result
+    return result
+
+
+def ip_network(addr, prefixlen=None, version=None):
+    """Returns the interned IpNetwork of addr: an int or IPAddress with
+    prefixlen, or a string, (int, prefixlen) tuple or netaddr IPNetwork.
+    Raises netaddr.AddrFormatError as netaddr.IPNetwork"""
+
+    if prefixlen is None:
+        if isinstance(addr, IpNetwork):
+            return addr
+        parsed = netaddr.IPNetwork(addr, version=version)
+        (value, prefixlen, version) = (parsed.value, parsed.prefixlen,
+                                       parsed.version)
+    elif isinstance(addr, netaddr.IPAddress):
+        (value, version) = (addr.value, addr.version)
+    else:
+        value = int(addr)
+        version = _version(value, version)
+
+    key = (value, prefixlen, version)
+    result = _networks.get(key)
+    if result is None:
+        result = object.__new__(IpNetwork)
+        result._value = value
+        result._prefixlen = prefixlen
+        result._module = _modules[version]
+        _networks[key] = result
+    return result
+
+
+def interned(value):
+    """Returns the interned value of a netaddr IPAddress or IPNetwork, or
+    value unchanged if it isn't one (eg None)"""
+
+    if isinstance(value, netaddr.IPNetwork):
+        return ip_network(value)
+    if isinstance(value, netaddr.IPAddress):
+        return ip_address(value)
+    return value
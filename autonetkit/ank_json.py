@@ -7,6 +7,7 @@ import logging
 import string
 
 import autonetkit.anm
+import autonetkit.ank_ip as ank_ip
 import autonetkit.log as log
 import autonetkit.nidb
 import autonetkit.plugins
@@ -65,6 +66,9 @@ class AnkEncoder(json.JSONEncoder):
             # TODO: filter this out in the to_json methods
             return ""
 
+        if isinstance(obj, autonetkit.anm.columnar.ColumnRow):
+            return dict(obj)
+
         return json.JSONEncoder.default(self, obj)
 
 
@@ -83,12 +87,12 @@ def string_to_netaddr(val):
         # could be an IP or network address
         if "/" in val:
             try:
-                retval = netaddr.IPNetwork(val)
+                retval = ank_ip.ip_network(val)
             except netaddr.core.AddrFormatError:
                 return  # unable to convert, leave as string
         else:
             try:
-                retval = netaddr.IPAddress(val)
+                retval = ank_ip.ip_address(val)
             except netaddr.core.AddrFormatError:
                 return  # unable to convert, leave as string
 
@@ -4,6 +4,8 @@ ank_logger_2 = logging.getLogger("ANK2")
 
 class AnkElement(object):
 
+    __slots__ = ()  # allow slotted subclasses, eg NmNode
+
     #TODO: put this into parent __init__?
     def init_logging(self, my_type):
         return
@@ -0,0 +1,191 @@
+class AttrIndex(object):
+
+    """Hash index of node_id by attribute value for one overlay attribute.
+    Lookups return candidate node_ids, and callers still apply the predicate.
+    This only filters out false positives: a node whose value changed
+    without updating the index is missing from the candidates, and so is
+    never matched. NmNode.__setattr__ keeps the index up to date. Writes
+    directly to the NetworkX graph must call anm._invalidate_attr_index
+    for the overlay or attribute afterwards.
+    """
+
+    __slots__ = ('_buckets', '_values')
+
+    def __init__(self, items):
+        """items are (node_id, value) pairs.
+        Raises TypeError if a value is unhashable"""
+
+        self._buckets = {}  # value -> set of node_ids
+        self._values = {}  # node_id -> value
+        for (node_id, value) in items:
+            self._add(node_id, value)
+
+    def _add(self, node_id, value):
+        try:
+            bucket = self._buckets[value]
+        except KeyError:
+            bucket = self._buckets[value] = set()
+        bucket.add(node_id)
+        self._values[node_id] = value
+
+    def lookup(self, value):
+        """Returns set of node_ids with value,
+        or None if value is unhashable (can't narrow)"""
+
+        try:
+            return self._buckets.get(value, frozenset())
+        except TypeError:
+            return None
+
+    def update(self, node_id, value):
+        """Moves node_id to the bucket for value.
+        Raises TypeError if value is unhashable"""
+
+        hash(value)  # check before modifying
+        try:
+            old_value = self._values[node_id]
+        except KeyError:
+            pass
+        else:
+            bucket = self._buckets[old_value]
+            bucket.discard(node_id)
+            if not bucket:
+                del self._buckets[old_value]
+
+        self._add(node_id, value)
+
+
+class InterfaceIndex(object):
+
+    """interface_ids of one node by category, and by (category, subcategory),
+    in _ports order. As for AttrIndex, callers still apply the predicate.
+    Only valid while built from the same _ports dicts with the same number
+    of interfaces, see is_current
+    """
+
+    __slots__ = ('_ports', '_n_ports', '_phy_ports', '_n_phy_ports',
+                 '_by_category', '_by_subcategory')
+
+    def __init__(self, ports, phy_ports, items):
+        """ports is the node's _ports, phy_ports the _ports of the node in
+        phy (that category reads through to), or None.
+        items are (interface_id, category, subcategory) in _ports order.
+        Raises TypeError if a value is unhashable"""
+
+        self._ports = ports
+        self._n_ports = len(ports)
+        self._phy_ports = phy_ports
+        self._n_phy_ports = len(phy_ports) if phy_ports is not None else 0
+        self._by_category = {}
+        self._by_subcategory = {}
+        for (interface_id, category, subcategory) in items:
+            self._by_category.setdefault(category, []).append(interface_id)
+            self._by_subcategory.setdefault((category, subcategory),
+                                            []).append(interface_id)
+
+    def is_current(self, ports, phy_ports):
+        """If index was built from ports and phy_ports as they are now.
+        Interfaces are added, or _ports replaced, rather than removed"""
+
+        if ports is not self._ports or len(ports) != self._n_ports:
+            return False
+        if phy_ports is not self._phy_ports:
+            return False
+        return phy_ports is None or len(phy_ports) == self._n_phy_ports
+
+    def lookup(self, category, *subcategory):
+        """Returns interface_ids with category (and subcategory if given),
+        or None if a value is unhashable (can't narrow)"""
+
+        try:
+            if subcategory:
+                return self._by_subcategory.get((category, subcategory[0]),
+                                                [])
+            return self._by_category.get(category, [])
+        except TypeError:
+            return None
+
+
+class PortEdgeIndex(object):
+
+    """Edges of one overlay graph by bound (node_id, interface_id), from
+    the _ports of each edge. Entries are checked against the graph on
+    lookup, so edges removed or rebound since don't need to be dropped:
+    only added edges and bindings need to be added, see add
+    """
+
+    __slots__ = ('graph', '_edges')
+
+    def __init__(self, graph):
+        self.graph = graph
+        self._edges = {}  # (node_id, interface_id) -> set of (src, dst, key)
+        if graph.is_multigraph():
+            for (src, dst, key, data) in graph.edges(keys=True, data=True):
+                self.add(src, dst, key, data.get('_ports'))
+        else:
+            for (src, dst, data) in graph.edges(data=True):
+                self.add(src, dst, 0, data.get('_ports'))
+
+    def add(self, src, dst, key, ports):
+        """Adds the bindings in ports of edge src, dst, key"""
+
+        if not ports:
+            return
+        if not self.graph.is_multigraph():
+            key = 0
+        for (node_id, interface_id) in ports.items():
+            try:
+                edges = self._edges[(node_id, interface_id)]
+            except KeyError:
+                edges = self._edges[(node_id, interface_id)] = set()
+            edges.add((src, dst, key))
+
+    def edges(self, node_id, interface_id):
+        """Returns (dst, key, ports) for the edges from node_id that are
+        bound to interface_id, in the order of graph.edges(node_id)"""
+
+        graph = self.graph
+        directed = graph.is_directed()
+        multigraph = graph.is_multigraph()
+        try:
+            candidates = self._edges[(node_id, interface_id)]
+        except (KeyError, TypeError):
+            return []
+
+        result = []
+        seen = set()
+        for edge in list(candidates):
+            (src, dst, key) = edge
+            if src != node_id:
+                if directed or dst != node_id:
+                    continue  # edge into node_id
+                dst = src
+            if (dst, key) in seen:
+                continue  # undirected edge added in both orientations
+
+            try:
+                data = graph.adj[node_id][dst]
+                if multigraph:
+                    data = data[key]
+            except KeyError:
+                candidates.discard(edge)  # removed
+                continue
+            ports = data.get('_ports')
+            if not ports or ports.get(node_id) != interface_id:
+                candidates.discard(edge)  # rebound
+                continue
+
+            seen.add((dst, key))
+            result.append((dst, key, ports))
+
+        if len(result) > 1:
+            if multigraph:
+                order = [(dst, key) for (_, dst, key)
+                         in graph.edges(node_id, keys=True)]
+            else:
+                order = [(dst, 0) for (_, dst) in graph.edges(node_id)]
+            position = dict((edge, index) for (index, edge)
+                            in enumerate(order))
+            result.sort(key=lambda item: position[item[:2]])
+
+        return result
@@ -6,7 +6,7 @@ import logging
 
 import autonetkit
 import autonetkit.log as log
-from autonetkit.anm.edge import NmEdge
+from autonetkit.anm.edge import NmEdge, NmMultipointEdge
 from autonetkit.anm.graph_data import NmGraphData
 from autonetkit.anm.interface import NmPort
 from autonetkit.anm.node import NmNode
@@ -198,25 +198,16 @@ class OverlayBase(AnkElement):
             # TODO: combine duplicated logic from above
             #TODO: test with directed graph
 
-            if self.is_multigraph():
-                # search edges from src to dst
-                for src, iter_dst, iter_key in self._graph.edges(src_id, keys=True):
-                    if iter_dst != dst_id:
-                        continue # to a different node
+            # only the edges bound to src_int, see PortEdgeIndex
+            index = self._anm._port_edge_index(self._overlay_id)
+            for (iter_dst, iter_key, ports) in index.edges(src_id, src_int):
+                if iter_dst != dst_id:
+                    continue # to a different node
 
-                    ports = self._graph[src][iter_dst][iter_key]["_ports"]
-                    if ports[src_id] == src_int and ports[dst_id] == dst_int:
+                if ports.get(dst_id) == dst_int:
+                    if self.is_multigraph():
                         return NmEdge(self._anm, self._overlay_id, src_id, dst_id, iter_key)
-
-            else:
-                #TODO: add test case for here
-                for src, iter_dst in self._graph.edges(src_id):
-                    if iter_dst != dst_id:
-                        continue # to a different node
-
-                    ports = self._graph[src][iter_dst]["_ports"]
-                    if ports[src_id] == src_int and ports[dst_id] == dst_int:
-                        return NmEdge(self._anm, self._overlay_id, src_id, dst_id)
+                    return NmEdge(self._anm, self._overlay_id, src_id, dst_id)
 
 
 
@@ -230,7 +221,7 @@ class OverlayBase(AnkElement):
 
     def node(self, key):
         """Returns node based on name
-        This is currently O(N). Could use a lookup table
+        Labels are resolved through a cached lookup table, see _label_index
 
         Example:
 
@@ -258,13 +249,58 @@ class OverlayBase(AnkElement):
             # doesn't have node_id, likely a label string, search based on this
             # label
 
-            for node in self:
-                if str(node) == key:
-                    return node
+            node = self._node_from_label(key)
+            if node is not None:
+                return node
+
+            # index may be stale, eg label set directly on the nx graph
+            self._label_indexes.pop(self._overlay_id, None)
+            node = self._node_from_label(key)
+            if node is not None:
+                return node
+
             # TODO: change warning to an exception
             log.warning('Unable to find node %s in %s ' % (key, self))
             return None
 
+    @property
+    def _label_indexes(self):
+        """Storage for label lookup tables, keyed by overlay_id.
+        Kept on the anm so shared across the (short-lived) overlay accessors
+        """
+
+        return self._anm._label_indexes
+
+    def _label_index(self):
+        """Returns label -> node_id lookup table for this overlay.
+        Built on first use. If several nodes share a label, the first in
+        iteration order is kept
+        """
+
+        try:
+            return self._label_indexes[self._overlay_id]
+        except KeyError:
+            pass
+
+        index = {}
+        for node_id in self._graph:
+            label = str(NmNode(self._anm, self._overlay_id, node_id))
+            index.setdefault(label, node_id)
+
+        self._label_indexes[self._overlay_id] = index
+        return index
+
+    def _node_from_label(self, key):
+        """Returns node from the label index, if the entry is still valid"""
+
+        node_id = self._label_index().get(key)
+        if node_id is None or node_id not in self._graph:
+            return None
+
+        node = NmNode(self._anm, self._overlay_id, node_id)
+        if str(node) == key:
+            return node
+
     def overlay(self, key):
         """Get to other overlay graphs in functions"""
 
@@ -348,13 +384,72 @@ class OverlayBase(AnkElement):
 
         """
 
+        return self._nodes(None, args, kwargs)
+
+    def _nodes(self, node_ids, args, kwargs):
+        """nodes(*args, **kwargs), restricted to node_ids if not None.
+        Indexed attributes in kwargs narrow the nodes visited,
+        see NetworkModel.index_node_attrs"""
+
+        candidates = self._index_candidates(kwargs)
+        if node_ids is not None:
+            if candidates is None:
+                candidates = node_ids
+            else:
+                candidates = candidates & node_ids
+
+        if candidates is None:
+            nbunch = self._graph
+        else:
+            positions = self._anm._node_position(self._overlay_id)
+            nbunch = sorted((n for n in candidates if n in self._graph),
+                            key=positions.get)
+
         result = list(NmNode(self._anm, self._overlay_id, node)
-                      for node in self._graph)
+                      for node in nbunch)
 
         if len(args) or len(kwargs):
             result = self.filter(result, *args, **kwargs)
         return result
 
+    def _attr_index(self, attr):
+        """Returns AttrIndex for attr in this overlay, or None"""
+
+        return self._anm._attr_index(self._overlay_id, attr)
+
+    def _index_candidates(self, kwargs):
+        """Returns set of node_ids which may match the indexed attributes in
+        kwargs, or None if none are indexed"""
+
+        matches = []
+        for (key, val) in kwargs.items():
+            index = self._attr_index(key)
+            if index is not None:
+                node_ids = index.lookup(val)
+                if node_ids is not None:
+                    matches.append(node_ids)
+
+        if not len(matches):
+            return None
+
+        matches.sort(key=len)
+        return set(matches[0]).intersection(*matches[1:])
+
+    def _device_type_nodes(self, device_types, args, kwargs):
+        """nodes(*args, **kwargs), narrowed to nodes which may be one of
+        device_types in this overlay or in phy, see NmNode.is_router"""
+
+        index = self._attr_index('device_type')
+        phy_index = self._anm._attr_index('phy', 'device_type')
+        if index is None or phy_index is None:
+            return self._nodes(None, args, kwargs)
+
+        node_ids = set()
+        for device_type in device_types:
+            node_ids.update(index.lookup(device_type))
+            node_ids.update(phy_index.lookup(device_type))
+        return self._nodes(node_ids, args, kwargs)
+
     def routers(self, *args, **kwargs):
         """Shortcut for nodes(), sets device_type to be router
 
@@ -364,7 +459,7 @@ class OverlayBase(AnkElement):
 
         """
 
-        result = self.nodes(*args, **kwargs)
+        result = self._device_type_nodes(('router',), args, kwargs)
         return [r for r in result if r.is_router()]
 
     def switches(self, *args, **kwargs):
@@ -376,7 +471,7 @@ class OverlayBase(AnkElement):
 
         """
 
-        result = self.nodes(*args, **kwargs)
+        result = self._device_type_nodes(('switch',), args, kwargs)
         return [r for r in result if r.is_switch()]
 
     def servers(self, *args, **kwargs):
@@ -388,7 +483,7 @@ class OverlayBase(AnkElement):
 
         """
 
-        result = self.nodes(*args, **kwargs)
+        result = self._device_type_nodes(('server',), args, kwargs)
         return [r for r in result if r.is_server()]
 
     def l3devices(self, *args, **kwargs):
@@ -400,7 +495,7 @@ class OverlayBase(AnkElement):
 
         """
 
-        result = self.nodes(*args, **kwargs)
+        result = self._device_type_nodes(('router', 'server'), args, kwargs)
         return [r for r in result if r.is_l3device()]
 
     def device(self, key):
@@ -441,7 +536,7 @@ class OverlayBase(AnkElement):
         """"""
 
         if nbunch is None:
-            nbunch = self.nodes()
+            return self.nodes(*args, **kwargs)
 
         def filter_func(node):
             """Filter based on args and kwargs"""
@@ -485,6 +580,19 @@ class OverlayBase(AnkElement):
                 and all(getattr(edge, key) == val for (key, val) in
                         kwargs.items())
 
+        hubs = self._anm._hub_ids(self._overlay_id)
+        if hubs:
+            # edges through multipoint hubs, as NmNode.edges()
+            result = self._multipoint_edges(src_nbunch, hubs)
+            if dst_nbunch:
+                try:
+                    dst_nbunch = set([dst_nbunch.node_id])
+                except AttributeError:
+                    dst_nbunch = set(n.node_id for n in dst_nbunch)
+                result = [edge for edge in result
+                          if edge.dst_id in dst_nbunch]
+            return [edge for edge in result if filter_func(edge)]
+
         if self.is_multigraph():
             valid_edges = list((src, dst, key) for (src, dst, key) in
                                self._graph.edges(src_nbunch, keys=True))
@@ -515,3 +623,41 @@ class OverlayBase(AnkElement):
 
         return list(result)
 
+    def _multipoint_edges(self, src_nbunch, hubs):
+        """Edges of the nodes src_nbunch (node ids, or all nodes if None),
+        where the edges to the multipoint hubs (see ank.hub_nodes) are
+        replaced by an NmMultipointEdge to each other node on the hub.
+        Each undirected edge is returned once, as for NetworkX edges()"""
+
+        graph = self._graph
+        anm = self._anm
+        overlay_id = self._overlay_id
+        if src_nbunch is None:
+            node_ids = [node_id for node_id in graph
+                        if not (node_id in hubs
+                                and graph.node[node_id].get('multipoint_hub'))]
+        else:
+            try:
+                single = src_nbunch in graph
+            except TypeError:
+                single = False  # unhashable, eg a list
+            if single:
+                src_nbunch = [src_nbunch]
+            node_ids = [node_id for node_id in src_nbunch if node_id in graph]
+
+        result = []
+        seen = set()
+        for node_id in node_ids:
+            node = NmNode(anm, overlay_id, node_id)
+            for (dst, ekey, hub, dst_ekey) in node._multipoint_peers(hubs):
+                if dst in seen:
+                    continue  # returned from dst
+                if hub is None:
+                    result.append(NmEdge(anm, overlay_id, node_id, dst, ekey))
+                else:
+                    result.append(NmMultipointEdge(anm, overlay_id, node_id,
+                                                   dst, hub, ekey, dst_ekey))
+            if not graph.is_directed():
+                seen.add(node_id)
+        return result
+
@@ -0,0 +1,504 @@
+"""Columnar attribute storage for overlay graphs.
+
+Rather than a dict per node (and per interface in _ports), attributes are
+held in a list per attribute name, indexed by a dense integer row allocated
+to each node (or interface). The graph.node[node_id] and
+graph.node[node_id]['_ports'][interface_id] values are lightweight views
+onto these columns, so code using the NetworkX or NmNode/NmPort APIs is
+unchanged. As the views are Mappings rather than dicts, use dict(view) to
+serialise with the plain json module (AnkEncoder handles them).
+
+Use with NetworkModel(storage="columnar") or
+add_overlay(..., storage="columnar"). Builds use the overlay_storage
+setting in [General].
+"""
+
+import collections
+import copy
+import sys
+
+import autonetkit
+import autonetkit.log as log
+import networkx as nx
+
+
+class _Missing(object):
+
+    """Marks an unset cell. Kept as a single instance through copy/pickle"""
+
+    __slots__ = ()
+
+    def __reduce__(self):
+        return '_MISSING'
+
+    def __repr__(self):
+        return '_MISSING'
+
+_MISSING = _Missing()
+
+
+class Columns(object):
+
+    """Attribute columns, indexed by row"""
+
+    def __init__(self):
+        self.columns = {}  # attribute -> list of values by row
+        self.n_rows = 0
+        self.free_rows = []  # released rows, reused by allocate
+
+    def allocate(self):
+        """Returns a new row, reusing a released row if any"""
+
+        if self.free_rows:
+            return self.free_rows.pop()
+        row = self.n_rows
+        self.n_rows += 1
+        return row
+
+    def release(self, row):
+        """Clears row for reuse. The view of the row must be detached
+        first, see ColumnRow._detach"""
+
+        for column in self.columns.values():
+            if row < len(column):
+                column[row] = _MISSING
+        self.free_rows.append(row)
+
+    def get(self, row, key):
+        """Returns value, or _MISSING if not set"""
+
+        try:
+            return self.columns[key][row]
+        except (KeyError, IndexError):
+            return _MISSING
+
+    def set(self, row, key, value):
+        try:
+            column = self.columns[key]
+        except KeyError:
+            column = self.columns[key] = []
+        if row >= len(column):
+            column.extend([_MISSING] * (row + 1 - len(column)))
+        column[row] = value
+
+    def keys(self, row):
+        return [key for (key, column) in self.columns.items()
+                if row < len(column) and column[row] is not _MISSING]
+
+    def size(self):
+        """Bytes used by the column containers (not the values)"""
+
+        return (sys.getsizeof(self.columns)
+                + sum(sys.getsizeof(column)
+                      for column in self.columns.values()))
+
+
+class ColumnRow(collections.MutableMapping):
+
+    """Dict-like view of one row of Columns"""
+
+    __slots__ = ('_columns', '_row')
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    def _detach(self):
+        """Points this view at an empty row of its own, so a view held
+        after its node or interface is removed reads as empty rather than
+        as the next user of the row. Returns the row to release"""
+
+        row = self._row
+        self._columns = Columns()
+        self._row = self._columns.allocate()
+        return row
+
+    def __getitem__(self, key):
+        value = self._columns.get(self._row, key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._columns.get(self._row, key)
+        if value is _MISSING:
+            return default
+        return value
+
+    def __contains__(self, key):
+        return self._columns.get(self._row, key) is not _MISSING
+
+    def __setitem__(self, key, value):
+        self._columns.set(self._row, key, value)
+
+    def __delitem__(self, key):
+        if self._columns.get(self._row, key) is _MISSING:
+            raise KeyError(key)
+        self._columns.columns[key][self._row] = _MISSING
+
+    def __iter__(self):
+        return iter(self._columns.keys(self._row))
+
+    def __len__(self):
+        return len(self._columns.keys(self._row))
+
+    def clear(self):
+        for key in self._columns.keys(self._row):
+            del self[key]
+
+    def copy(self):
+        """Returns a plain dict, as for a NetworkX node dict"""
+
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class PortRow(ColumnRow):
+
+    """Attributes of an interface"""
+
+    __slots__ = ()
+
+
+class NodeRow(ColumnRow):
+
+    """Attributes of a node. _ports is held as a PortMap.
+
+    NmNode.raw_interfaces sets _ports and raw_interfaces to the same dict,
+    so later changes through either show in both. As _ports is converted
+    to a PortMap, raw_interfaces is set to that PortMap when it holds the
+    same interfaces, to keep the two in step as with dicts.
+    """
+
+    __slots__ = ('_store',)
+
+    def __init__(self, store, row):
+        super(NodeRow, self).__init__(store.columns, row)
+        self._store = store
+
+    def _release_ports(self, ports):
+        """Releases the rows of PortMap ports. If raw_interfaces refers to
+        ports, it keeps a copy, as it would keep the dict"""
+
+        if self._columns.get(self._row, 'raw_interfaces') is ports:
+            self._columns.set(self._row, 'raw_interfaces', ports.to_dict())
+        ports.clear()
+
+    def __setitem__(self, key, value):
+        if key == '_ports':
+            current = self._columns.get(self._row, key)
+            if current is value:
+                return
+            if isinstance(value, dict):
+                value = PortMap(self._store.port_columns, value)
+            if isinstance(current, PortMap):
+                self._release_ports(current)
+            raw_interfaces = self._columns.get(self._row, 'raw_interfaces')
+            if isinstance(raw_interfaces, dict) and raw_interfaces == value:
+                self._columns.set(self._row, 'raw_interfaces', value)
+        elif key == 'raw_interfaces' and isinstance(value, dict):
+            ports = self._columns.get(self._row, '_ports')
+            if isinstance(ports, PortMap) and value == ports:
+                value = ports
+
+        self._columns.set(self._row, key, value)
+
+    def __delitem__(self, key):
+        if key == '_ports':
+            current = self._columns.get(self._row, key)
+            if isinstance(current, PortMap):
+                self._release_ports(current)
+        super(NodeRow, self).__delitem__(key)
+
+
+class _RowMap(dict):
+
+    """dict of key -> ColumnRow. Overrides the mutating methods to allocate
+    and release rows, so the dict itself only ever holds its own row views.
+    Data set from other rows is copied in. Copies are plain dicts"""
+
+    __slots__ = ()
+
+    def _new_row(self):
+        raise NotImplementedError
+
+    def _owns(self, row):
+        raise NotImplementedError
+
+    def _release(self, row):
+        raise NotImplementedError
+
+    def __setitem__(self, key, data):
+        try:
+            row = dict.__getitem__(self, key)
+        except KeyError:
+            pass
+        else:
+            if data is row:
+                return
+            data = dict(data)  # in case data refers to row
+            if self._owns(row):
+                self._release(row)
+
+        row = self._new_row()
+        dict.__setitem__(self, key, row)
+        for (attr, value) in data.items():
+            row[attr] = value
+
+    def __delitem__(self, key):
+        row = dict.pop(self, key)
+        if self._owns(row):
+            self._release(row)
+
+    def pop(self, key, *default):
+        try:
+            row = dict.__getitem__(self, key)
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        data = dict(row)
+        del self[key]
+        return data
+
+    def popitem(self):
+        key = next(iter(self))
+        return (key, self.pop(key))
+
+    def clear(self):
+        for key in list(self):
+            del self[key]
+
+    def update(self, *args, **kwargs):
+        # insert in the order given, without an intermediate dict, so the
+        # iteration order matches a dict built the same way
+        for other in args:
+            if hasattr(other, 'items'):
+                other = other.items()
+            for (key, data) in other:
+                self[key] = data
+        for (key, data) in kwargs.items():
+            self[key] = data
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default if default is not None else {}
+        return self[key]
+
+    def to_dict(self):
+        """Returns plain dict of dicts"""
+
+        return dict((key, dict(row)) for (key, row) in self.items())
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        # insert in iteration order, as copy.deepcopy of a dict, so the
+        # copy iterates in the same order as a copy of the dict backend
+        result = self._empty()
+        memo[id(self)] = result
+        for (key, row) in self.items():
+            result[key] = copy.deepcopy(row, memo)
+        return result
+
+    def _empty(self):
+        return {}
+
+    def __reduce__(self):
+        return (dict, (self.to_dict(),))
+
+
+class PortMap(_RowMap):
+
+    """_ports of a node: interface_id -> PortRow"""
+
+    __slots__ = ('_columns',)
+
+    def __init__(self, columns, data=None):
+        dict.__init__(self)
+        self._columns = columns
+        if data:
+            self.update(data)
+
+    def _new_row(self):
+        return PortRow(self._columns, self._columns.allocate())
+
+    def _owns(self, row):
+        return isinstance(row, PortRow) and row._columns is self._columns
+
+    def _release(self, row):
+        self._columns.release(row._detach())
+
+
+class NodeStore(_RowMap):
+
+    """graph.node for columnar graphs: node_id -> NodeRow"""
+
+    __slots__ = ('columns', 'port_columns')
+
+    def __init__(self, data=None):
+        dict.__init__(self)
+        self.columns = Columns()
+        self.port_columns = Columns()
+        if data:
+            self.update(data)
+
+    def _empty(self):
+        return NodeStore()
+
+    def __reduce__(self):
+        return (NodeStore, (self.to_dict(),))
+
+    def _new_row(self):
+        return NodeRow(self, self.columns.allocate())
+
+    def _owns(self, row):
+        return isinstance(row, NodeRow) and row._store is self
+
+    def _release(self, row):
+        ports = row.get('_ports')
+        if isinstance(ports, PortMap):
+            ports.clear()
+        self.columns.release(row._detach())
+        if not len(self):
+            # no live rows: drop the released cells
+            self.columns = Columns()
+            self.port_columns = Columns()
+
+    def size(self):
+        """Bytes used by the storage containers (not the values)"""
+
+        result = (dict.__sizeof__(self) + self.columns.size()
+                  + self.port_columns.size())
+        for row in self.values():
+            result += sys.getsizeof(row)
+            ports = row.get('_ports')
+            if isinstance(ports, PortMap):
+                result += dict.__sizeof__(ports)
+                result += sum(sys.getsizeof(port) for port in ports.values())
+        return result
+
+
+class ColumnarGraphMixin(object):
+
+    """Replaces the NetworkX node dict with a NodeStore"""
+
+    def __init__(self, data=None, **attr):
+        super(ColumnarGraphMixin, self).__init__(data, **attr)
+        if isinstance(getattr(data, 'node', None), dict):
+            self.node = NodeStore(data.node)  # same order, see with_storage
+        else:
+            self.node = NodeStore(self.node)
+
+
+class ColumnarGraph(ColumnarGraphMixin, nx.Graph):
+    pass
+
+
+class ColumnarDiGraph(ColumnarGraphMixin, nx.DiGraph):
+    pass
+
+
+class ColumnarMultiGraph(ColumnarGraphMixin, nx.MultiGraph):
+    pass
+
+
+class ColumnarMultiDiGraph(ColumnarGraphMixin, nx.MultiDiGraph):
+    pass
+
+
+COLUMNAR_CLASSES = {
+    nx.Graph: ColumnarGraph,
+    nx.DiGraph: ColumnarDiGraph,
+    nx.MultiGraph: ColumnarMultiGraph,
+    nx.MultiDiGraph: ColumnarMultiDiGraph,
+}
+
+
+def with_storage(graph, storage, source=None):
+    """Returns graph using storage backend: "dict" or "columnar".
+    source is the graph that graph was copied from, if any.
+
+    Python dict order depends on insertion history, and the output (eg
+    allocation order) on iteration order: so the graph is converted in
+    place, and node data is inserted in the same order as the copy from
+    source, to iterate in the same order as the dict backend.
+    """
+
+    if storage == "dict":
+        return graph
+    if storage == "columnar":
+        if not isinstance(graph.node, NodeStore):
+            if source is None:
+                source = graph
+            graph.__class__ = COLUMNAR_CLASSES[type(graph)]
+            graph.node = NodeStore(source.node)
+        return graph
+
+    raise ValueError("Unknown overlay storage %s" % storage)
+
+
+def dict_storage_size(graph):
+    """Bytes the node and interface attributes of graph use (or would use)
+    as NetworkX dicts. Counts the containers, not the values"""
+
+    result = sys.getsizeof(dict(graph.node))
+    for data in graph.node.values():
+        result += sys.getsizeof(dict(data))
+        ports = data.get('_ports')
+        if isinstance(ports, dict):
+            result += sys.getsizeof(dict(ports))
+            result += sum(sys.getsizeof(dict(port_data))
+                          for port_data in ports.values())
+    return result
+
+
+def storage_size(graph):
+    """Bytes used by the node and interface attribute storage of graph"""
+
+    if isinstance(graph.node, NodeStore):
+        return graph.node.size()
+    return dict_storage_size(graph)
+
+
+def storage_report(anm):
+    """Logs and returns the attribute storage size of each overlay, against
+    the size the same attributes would use in the dict backend
+
+    >>> anm = autonetkit.topos.house()
+    >>> g_ospf = anm.add_overlay("ospf", anm['phy'], storage="columnar")
+    >>> report = storage_report(anm)
+    >>> report['ospf']['storage']
+    'columnar'
+    >>> report['ospf']['bytes'] < report['ospf']['dict_bytes']
+    True
+
+    """
+
+    report = {}
+    for (overlay_id, graph) in sorted(anm.overlay_nx_graphs.items()):
+        columnar = isinstance(graph.node, NodeStore)
+        size = storage_size(graph)
+        dict_size = dict_storage_size(graph)
+        report[overlay_id] = {
+            'storage': 'columnar' if columnar else 'dict',
+            'bytes': size,
+            'dict_bytes': dict_size,
+        }
+        if columnar and dict_size:
+            log.info('Overlay %s: %s bytes columnar, %s bytes as dicts '
+                     '(%.0f%% saving)' % (overlay_id, size, dict_size,
+                                          100.0 * (dict_size - size) / dict_size))
+    return report
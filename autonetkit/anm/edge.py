@@ -8,26 +8,47 @@ from autonetkit.anm.node import NmNode
 from autonetkit.log import CustomAdapter
 
 from autonetkit.anm.ank_element import AnkElement
+from autonetkit.anm.shared_data import SharedDict
 
 @total_ordering
 class NmEdge(AnkElement):
 
-    """API to access link in network"""
+    """API to access link in network
 
-    def __init__(self, anm, overlay_id, src_id, dst_id, ekey=0):
+    Instances are interned per (overlay_id, src_id, dst_id, ekey)
+    in the anm, see NmNode"""
+
+    __slots__ = ('anm', 'overlay_id', 'src_id', 'dst_id', 'ekey',
+                 '__weakref__')
+    log = log
+
+    def __new__(cls, anm, overlay_id, src_id, dst_id, ekey=0):
+        # store the ids, not the node objects
+        if isinstance(src_id, NmNode):
+            src_id = src_id.node_id
+        if isinstance(dst_id, NmNode):
+            dst_id = dst_id.node_id
 
+        key = (overlay_id, src_id, dst_id, ekey)
+        self = anm._edge_cache.get(key)
+        if self is not None:
+            return self
+
+        self = object.__new__(cls)
         object.__setattr__(self, 'anm', anm)
         object.__setattr__(self, 'overlay_id', overlay_id)
         object.__setattr__(self, 'src_id', src_id)
         object.__setattr__(self, 'dst_id', dst_id)
         object.__setattr__(self, 'ekey', ekey)  # for multigraphs
-        #logger = logging.getLogger("ANK")
-        #logstring = "Interface: %s" % str(self)
-        #logger = CustomAdapter(logger, {'item': logstring})
-        logger = log
-        object.__setattr__(self, 'log', logger)
-        self.init_logging("edge")
+        anm._edge_cache[key] = self
+        return self
+
+    def __init__(self, anm, overlay_id, src_id, dst_id, ekey=0):
+        pass  # set in __new__, as instances are shared
 
+    def __reduce__(self):
+        return (NmEdge, (self.anm, self.overlay_id, self.src_id,
+                         self.dst_id, self.ekey))
 
     def __key(self):
         """Note: key doesn't include overlay_id to allow fast cross-layer comparisons"""
@@ -279,7 +300,15 @@ class NmEdge(AnkElement):
     def bind_interface(self, node, interface):
         """Bind this edge to specified index"""
 
-        self._ports[node.id] = interface
+        ports = self._ports
+        if isinstance(ports, SharedDict):
+            # copy on write, see NmGraph.add_edges_from
+            ports = dict(ports)
+            self._ports = ports
+        ports[node.id] = interface
+        self.anm._update_port_edge_index(self.overlay_id, self.src_id,
+                                         self.dst_id, self.ekey,
+                                         {node.id: interface})
 
     def interfaces(self):
         """
@@ -346,3 +375,95 @@ class NmEdge(AnkElement):
             object.__setattr__(self, 'raw_interfaces', val)
 
         self._data[key] = val
+        if key == '_ports':
+            self.anm._update_port_edge_index(self.overlay_id, self.src_id,
+                                             self.dst_id, self.ekey, val)
+
+
+class NmMultipointEdge(NmEdge):
+
+    """Edge between two nodes attached to the same multipoint hub, see
+    ank.hub_nodes. Not stored in the overlay: formed from the edges of src
+    and dst to the hub, so a broadcast domain of n nodes is stored as n
+    edges rather than n(n-1)/2. Attributes are read from and set on the
+    edge from src to the hub. Returned by NmNode.edges()"""
+
+    __slots__ = ('hub_id', 'src_ekey', 'dst_ekey')
+
+    def __new__(cls, anm, overlay_id, src_id, dst_id, hub_id, src_ekey=0,
+                dst_ekey=0):
+        # not interned: the instances are formed on each query
+        self = object.__new__(cls)
+        object.__setattr__(self, 'anm', anm)
+        object.__setattr__(self, 'overlay_id', overlay_id)
+        object.__setattr__(self, 'src_id', src_id)
+        object.__setattr__(self, 'dst_id', dst_id)
+        object.__setattr__(self, 'ekey', src_ekey)
+        object.__setattr__(self, 'hub_id', hub_id)
+        object.__setattr__(self, 'src_ekey', src_ekey)
+        object.__setattr__(self, 'dst_ekey', dst_ekey)
+        return self
+
+    def __init__(self, *args, **kwargs):
+        pass  # set in __new__
+
+    def __reduce__(self):
+        return (NmMultipointEdge, (self.anm, self.overlay_id, self.src_id,
+                                   self.dst_id, self.hub_id, self.src_ekey,
+                                   self.dst_ekey))
+
+    def _hub_edge_data(self, node_id, ekey):
+        """Data of the edge from node_id to the hub"""
+
+        graph = self._graph
+        if graph.is_multigraph():
+            return graph[node_id][self.hub_id][ekey]
+        return graph[node_id][self.hub_id]
+
+    @property
+    def _data(self):
+        return self._hub_edge_data(self.src_id, self.src_ekey)
+
+    @property
+    def _ports(self):
+        """Interfaces bound to src and dst, on their edges to the hub"""
+
+        ports = {}
+        for (node_id, ekey) in [(self.src_id, self.src_ekey),
+                                (self.dst_id, self.dst_ekey)]:
+            hub_ports = self._hub_edge_data(node_id, ekey).get('_ports', {})
+            if node_id in hub_ports:
+                ports[node_id] = hub_ports[node_id]
+        return ports
+
+    @property
+    def hub(self):
+        """The multipoint hub node this edge is formed through"""
+
+        return NmNode(self.anm, self.overlay_id, self.hub_id)
+
+    def __nonzero__(self):
+        graph = self._graph
+        if graph.is_multigraph():
+            return (graph.has_edge(self.src_id, self.hub_id, self.src_ekey)
+                    and graph.has_edge(self.dst_id, self.hub_id,
+                                       self.dst_ekey))
+        return (graph.has_edge(self.src_id, self.hub_id)
+                and graph.has_edge(self.dst_id, self.hub_id))
+
+    def is_parallel(self):
+        return False
+
+    def bind_interface(self, node, interface):
+        """Bind the edge of node to the hub to interface"""
+
+        ekey = self.src_ekey if node.id == self.src_id else self.dst_ekey
+        if self._graph.is_multigraph():
+            edge = NmEdge(self.anm, self.overlay_id, node.id, self.hub_id,
+                          ekey)
+        else:
+            edge = NmEdge(self.anm, self.overlay_id, node.id, self.hub_id)
+        edge.bind_interface(node, interface)
+
+    def dump(self):
+        return str(self._data)
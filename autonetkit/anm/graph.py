@@ -1,9 +1,10 @@
 import autonetkit.log as log
 from autonetkit.ank_utils import unwrap_edges, unwrap_nodes
 from autonetkit.anm.base import OverlayBase
-from autonetkit.anm.edge import NmEdge
+from autonetkit.anm.edge import NmEdge, NmMultipointEdge
 from autonetkit.anm.interface import NmPort
 from autonetkit.anm.node import NmNode
+from autonetkit.anm.shared_data import SharedDict
 import autonetkit
 
 
@@ -31,6 +32,17 @@ class NmGraph(OverlayBase):
         """"""
 
         self._anm.overlay_nx_graphs[self._overlay_id] = graph
+        self._invalidate_node_indexes()
+
+    def _invalidate_node_indexes(self):
+        """Call when nodes added or removed.
+        Labels (and asn, device_type) in all overlays are read from phy,
+        so phy changes affect all"""
+
+        if self._overlay_id == "phy":
+            self._anm._invalidate_node_indexes()
+        else:
+            self._anm._invalidate_node_indexes(self._overlay_id)
 
     # these work similar to their nx counterparts: just need to strip the
     # node_id
@@ -87,6 +99,7 @@ class NmGraph(OverlayBase):
                 pass  # use nbunch directly as the node IDs
 
         self._graph.add_nodes_from(nbunch, **kwargs)
+        self._invalidate_node_indexes()
         for node in self._graph.nodes():
             node_data = self._graph.node[node]
             if "label" not in node_data:
@@ -154,6 +167,7 @@ class NmGraph(OverlayBase):
             return
 
         phy_graph = self._anm.overlay_nx_graphs['phy']
+        interface_data = SharedDict(description=None, category='physical')
         for node_id in nbunch:
             try:
                 phy_interfaces = phy_graph.node[node_id]['_ports']
@@ -163,13 +177,11 @@ class NmGraph(OverlayBase):
                 self._graph.node[node_id]['_ports'] = {
                     0: {'description': 'loopback', 'category': 'loopback'}}
             else:
-                interface_data = {'description': None,
-                                  'category': 'physical'}
-                # need to do dict() to copy, otherwise all point to same memory
-                # location -> clobber
+                # shared by all the interfaces, read-only: a private copy is
+                # made on first write, see NmPort.__setattr__
                 # TODO: update this to also get subinterfaces?
                 # TODO: should description and category auto fall through?
-                data = dict((key, dict(interface_data)) for key in
+                data = dict((key, interface_data) for key in
                             phy_interfaces)
                 self._graph.node[node_id]['_ports'] = data
 
@@ -239,6 +251,7 @@ class NmGraph(OverlayBase):
             pass  # don't need to unwrap
 
         self._graph.remove_nodes_from(nbunch)
+        self._invalidate_node_indexes()
 
     def remove_node(self, node_id):
         """Removes a node from the overlay"""
@@ -246,6 +259,7 @@ class NmGraph(OverlayBase):
             node_id = node_id.node_id
 
         self._graph.remove_node(node_id)
+        self._invalidate_node_indexes()
 
     def add_edge(self, src, dst, retain=None, **kwargs):
         """Adds an edge to the overlay"""
@@ -306,6 +320,18 @@ class NmGraph(OverlayBase):
         except AttributeError:
             pass  # already a list
 
+        # classify the input once: homogeneous batches skip the per-edge
+        # type checks, and are added to NetworkX in a single call
+        ebunch = list(ebunch)
+        if ebunch and all(isinstance(in_edge, NmEdge) for in_edge in ebunch):
+            return self._add_nm_edges_from(ebunch, bidirectional, retain,
+                                           warn, kwargs)
+        if ebunch and not self.is_multigraph() and all(
+                type(in_edge) is tuple and len(in_edge) == 3
+                and isinstance(in_edge[2], dict) for in_edge in ebunch):
+            return self._add_data_edges_from(ebunch, bidirectional, warn,
+                                             kwargs)
+
         if self.is_multigraph():
             #used_keys = self._graph.adj[u][v]
             from collections import defaultdict
@@ -336,10 +362,8 @@ class NmGraph(OverlayBase):
 
                 # and copy retain data
                 data = dict((key, edge.get(key)) for key in retain)
-                ports = {k: v for k, v in edge.raw_interfaces.items()
-                         if k in self._graph}  # only if exists in this overlay
                 # TODO: debug log if skipping a binding?
-                data['_ports'] = ports
+                data['_ports'] = self._edge_ports(edge)
 
                 # this is the only case where copy across data
                 # but want to copy attributes for all cases
@@ -452,12 +476,100 @@ class NmGraph(OverlayBase):
             self._graph.add_edges_from(edges_to_add)
             all_edges += edges_to_add
 
+        return self._added_edges(all_edges)
+
+    def _edge_ports(self, edge):
+        """Returns the interface bindings of NmEdge edge to copy to this
+        overlay. If all its nodes are in this overlay, the bindings are
+        shared with edge as a SharedDict, copied on write (see
+        NmEdge.bind_interface). Otherwise a dict of the bindings of the
+        nodes in this overlay"""
+
+        graph = self._graph
+        ports = edge.raw_interfaces
+        if isinstance(edge, NmMultipointEdge):
+            # formed from the edges to the hub: no stored bindings to share
+            return dict((k, v) for (k, v) in ports.items() if k in graph)
+        if all(k in graph for k in ports):
+            if not isinstance(ports, SharedDict):
+                ports = SharedDict(ports)
+                edge._ports = ports
+            return ports
+
+        return {k: v for k, v in ports.items()
+                if k in graph}  # only if exists in this overlay
+
+    def _add_nm_edges_from(self, ebunch, bidirectional, retain, warn,
+                           kwargs):
+        """add_edges_from for an ebunch of NmEdges"""
+
+        graph = self._graph
+        multigraph = graph.is_multigraph()
+        all_edges = []
+        for edge in ebunch:
+            src = edge.src_id
+            dst = edge.dst_id
+            if not(src in graph and dst in graph):
+                if warn:
+                    self.log.debug("Not adding edge %s, src/dst not in overlay",
+                                   edge)
+                continue
+
+            # copy retain data, and interface bindings
+            data = dict((key, edge.get(key)) for key in retain)
+            data['_ports'] = self._edge_ports(edge)
+            data.update(**kwargs)
+
+            if multigraph:
+                all_edges.append((src, dst, edge.ekey, dict(data)))
+                if bidirectional:
+                    all_edges.append((dst, src, edge.ekey, dict(data)))
+            else:
+                all_edges.append((src, dst, dict(data)))
+                if bidirectional:
+                    all_edges.append((dst, src, dict(data)))
+
+        graph.add_edges_from(all_edges)
+        return self._added_edges(all_edges)
+
+    def _add_data_edges_from(self, ebunch, bidirectional, warn, kwargs):
+        """add_edges_from for an ebunch of (src, dst, data) tuples,
+        for graphs that aren't multigraphs"""
+
+        graph = self._graph
+        all_edges = []
+        for in_edge in ebunch:
+            (src, dst, data) = in_edge
+            if not(src in self and dst in self):
+                if warn:
+                    log.warning("Unsupported edge %s" % str(in_edge))
+                    self.log.debug("Not adding edge %s, src/dst not in overlay",
+                                   in_edge)
+                continue
+
+            data.update(**kwargs)
+            all_edges.append((src, dst, dict(data)))
+            if bidirectional:
+                all_edges.append((dst, src, dict(data)))
+
+        graph.add_edges_from(all_edges)
+        return self._added_edges(all_edges)
+
+    def _added_edges(self, all_edges):
+        """Indexes and returns NmEdges for edges added by add_edges_from"""
+
         if self.is_multigraph():
+            for (src, dst, ekey, data) in all_edges:
+                self.anm._update_port_edge_index(self._overlay_id, src, dst,
+                                                 ekey, data.get('_ports'))
             return [
             NmEdge(self.anm, self._overlay_id, src, dst, ekey) if ekey
             else NmEdge(self.anm, self._overlay_id, src, dst) # default no ekey set
             for src, dst, ekey, _ in all_edges]
         else:
+            for (src, dst, data) in all_edges:
+                self.anm._update_port_edge_index(self._overlay_id, src, dst,
+                                                 0, data.get('_ports'))
             return [NmEdge(self.anm, self._overlay_id, src, dst)
             for src, dst, _ in all_edges]
 
@@ -3,22 +3,38 @@ import logging
 import autonetkit.log as log
 from autonetkit.log import CustomAdapter
 from autonetkit.anm.ank_element import AnkElement
+from autonetkit.anm.shared_data import SharedDict
 
 
 class NmPort(AnkElement):
 
-    def __init__(self, anm, overlay_id, node_id, interface_id):
+    """Instances are interned per (overlay_id, node_id, interface_id)
+    in the anm, see NmNode"""
+
+    __slots__ = ('anm', 'overlay_id', 'node_id', 'interface_id',
+                 '__weakref__')
+    log = log
+
+    def __new__(cls, anm, overlay_id, node_id, interface_id):
+        key = (overlay_id, node_id, interface_id)
+        self = anm._port_cache.get(key)
+        if self is not None:
+            return self
+
+        self = object.__new__(cls)
         object.__setattr__(self, 'anm', anm)
         object.__setattr__(self, 'overlay_id', overlay_id)
         object.__setattr__(self, 'node_id', node_id)
         object.__setattr__(self, 'interface_id', interface_id)
-        #logger = logging.getLogger("ANK")
-        #logstring = "Interface: %s" % str(self)
-        #logger = CustomAdapter(logger, {'item': logstring})
-        logger = log
-        object.__setattr__(self, 'log', logger)
-        self.init_logging("port")
+        anm._port_cache[key] = self
+        return self
+
+    def __init__(self, anm, overlay_id, node_id, interface_id):
+        pass  # set in __new__, as instances are shared
 
+    def __reduce__(self):
+        return (NmPort, (self.anm, self.overlay_id, self.node_id,
+                         self.interface_id))
 
     def __key(self):
         """Note: key doesn't include overlay_id to allow fast cross-layer comparisons"""
@@ -260,7 +276,14 @@ class NmPort(AnkElement):
         """Sets interface property"""
 
         try:
-            self._interface[key] = val
+            interface = self._interface
+            if isinstance(interface, SharedDict):
+                # copy on write, see OverlayBase._copy_interfaces
+                interface = dict(interface)
+                self.node.raw_interfaces[self.interface_id] = interface
+            interface[key] = val
+            if key in ('category', 'subcategory'):
+                self.anm._invalidate_interface_index(self.node_id)
         except KeyError, e:
             log.warning(e)
 
@@ -277,11 +300,13 @@ class NmPort(AnkElement):
         This is the convention for binding an edge to an interface"""
 
         # edges have _interfaces stored as a dict of {node_id: interface_id, }
+        # looked up by (node_id, interface_id), see PortEdgeIndex
 
-        valid_edges = [e for e in self.node.edges() if self.node_id
-                       in e.raw_interfaces and e.raw_interfaces[self.node_id]
-                       == self.interface_id]
-        return list(valid_edges)
+        from autonetkit.anm.edge import NmEdge
+        index = self.anm._port_edge_index(self.overlay_id)
+        return [NmEdge(self.anm, self.overlay_id, self.node_id, dst, key)
+                for (dst, key, _) in index.edges(self.node_id,
+                                                 self.interface_id)]
 
     def neighbors(self):
         """Returns interfaces on nodes that are linked to this interface
@@ -1,10 +1,16 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import time
+import weakref
 
+import autonetkit
 import autonetkit.log as log
 import networkx as nx
 from autonetkit.anm.graph import NmGraph
+from autonetkit.anm.node import NmNode
+from autonetkit.anm.interface import NmPort
+from autonetkit.anm.attr_index import AttrIndex, InterfaceIndex, PortEdgeIndex
+from autonetkit.anm import columnar
 from autonetkit.anm.ank_element import AnkElement
 
 
@@ -12,11 +18,29 @@ class NetworkModel(AnkElement):
 
     """"""
 
-    def __init__(self, all_multigraph=False):
-        """"""
+    def __init__(self, all_multigraph=False, storage="dict"):
+        """storage is the default overlay storage backend, see add_overlay"""
 
         self.all_multigraph = all_multigraph
+        self.storage = storage
         self._overlays = {}
+        self._label_indexes = {}  # overlay_id -> {label: node_id}
+        self._node_labels = {}  # node_id -> label, see _build_node_label
+        self._indexed_node_attrs = set()  # opt-in, see index_node_attrs
+        self._attr_indexes = {}  # (overlay_id, attr) -> AttrIndex
+        self._node_positions = {}  # overlay_id -> {node_id: position}
+        # node_id -> {overlay_id: InterfaceIndex}, see _interface_index
+        self._interface_indexes = {}
+        self._port_edge_indexes = {}  # overlay_id -> PortEdgeIndex
+        self._producers = {}  # overlay_id -> func(anm), see add_producer
+        self._producer_checks = {}  # overlay_id -> used(anm), optional
+        # overlay_id -> set of multipoint hub node ids, see ank.hub_nodes
+        self._hubs = {}
+        # interned NmNode, NmPort, NmEdge wrappers, keyed by overlay_id +
+        # ids: entries are dropped once the wrapper is no longer referenced
+        self._node_cache = weakref.WeakValueDictionary()
+        self._port_cache = weakref.WeakValueDictionary()
+        self._edge_cache = weakref.WeakValueDictionary()
         self.add_overlay('input')
         self.add_overlay('phy')
         self.add_overlay('graphics')
@@ -46,10 +70,80 @@ class NetworkModel(AnkElement):
         return self._overlays
 
     def has_overlay(self, overlay_id):
-        """"""
-
+        """If overlay_id exists, building it if pending. A pending overlay
+        whose producer reports it unused is left unbuilt, and is reported
+        as absent, see add_producer"""
+
+        if overlay_id not in self._overlays:
+            used = self._producer_checks.get(overlay_id)
+            if (used is not None and overlay_id in self._producers
+                    and not used(self)):
+                return False
+            self._produce(overlay_id)
         return overlay_id in self._overlays
 
+    def add_producer(self, overlay_ids, func, used=None):
+        """Registers func(anm) to build the overlays overlay_ids on demand:
+        func is called the first time one of them is requested, through
+        anm[overlay_id], overlay(), has_overlay() or node[overlay_id].
+        overlays() and iteration only cover the overlays built so far.
+
+        used(anm) is an optional cheap check of whether the overlays would
+        have any content, eg if any router runs the protocol. If it returns
+        False, has_overlay() returns False without running func, so code
+        that checks has_overlay() first doesn't build unused overlays.
+        anm[overlay_id] still builds the overlay.
+
+        >>> anm = autonetkit.topos.house()
+        >>> anm.add_producer(["ospf"], lambda anm: anm.add_overlay("ospf"))
+        >>> "ospf" in anm.overlays()
+        False
+        >>> anm.has_overlay("ospf")
+        True
+        >>> anm.add_producer(["isis"], lambda anm: anm.add_overlay("isis"),
+        ...                  used=lambda anm: False)
+        >>> anm.has_overlay("isis")
+        False
+        >>> anm.pending_overlays()
+        ['isis']
+
+        """
+
+        for overlay_id in overlay_ids:
+            self._producers[overlay_id] = func
+            if used is None:
+                self._producer_checks.pop(overlay_id, None)
+            else:
+                self._producer_checks[overlay_id] = used
+
+    def pending_overlays(self):
+        """Overlays with a producer registered that haven't been built"""
+
+        return [overlay_id for overlay_id in self._producers
+                if overlay_id not in self._overlays]
+
+    def produce_overlays(self):
+        """Builds all pending overlays, eg to save the complete model"""
+
+        for overlay_id in sorted(self.pending_overlays()):
+            self._produce(overlay_id)
+
+    def _produce(self, overlay_id):
+        """Runs the producer of overlay_id, if one is pending"""
+
+        try:
+            func = self._producers[overlay_id]
+        except KeyError:
+            return
+
+        # a producer runs once, for all of its overlays
+        for key in [key for (key, value) in self._producers.items()
+                    if value is func]:
+            del self._producers[key]
+            self._producer_checks.pop(key, None)
+        log.debug("Producing overlay %s" % overlay_id)
+        func(self)
+
     def dump(self):
         import autonetkit.ank_json as ank_json
         data = ank_json.jsonify_anm(self)
@@ -67,6 +161,7 @@ class NetworkModel(AnkElement):
         import autonetkit.ank_json as ank_json
         import os
         import gzip
+        self.produce_overlays()  # archive the complete model
         archive_dir = os.path.join('versions', 'anm')
         if not os.path.isdir(archive_dir):
             os.makedirs(archive_dir)
@@ -113,6 +208,7 @@ class NetworkModel(AnkElement):
                 self._overlays[overlay_id] = \
                     ank_json.ank_json_loads(graph_data)
 
+        self._invalidate_node_indexes()
         ank_json.rebind_interfaces(self)
 
     def restore_from_json(self, in_data):
@@ -124,6 +220,7 @@ class NetworkModel(AnkElement):
             self._overlays[overlay_id] = \
                 ank_json.ank_json_loads(graph_data)
 
+            self._invalidate_node_indexes()
             ank_json.rebind_interfaces(self)
 
     @property
@@ -156,12 +253,16 @@ class NetworkModel(AnkElement):
         return overlay
 
     def add_overlay(self, name, nodes=None, graph=None,
-                    directed=False, multi_edge=False, retain=None):
-        """Adds overlay graph of name name"""
+                    directed=False, multi_edge=False, retain=None,
+                    storage=None):
+        """Adds overlay graph of name name
+        storage is "dict" (NetworkX default) or "columnar" (see
+        autonetkit.anm.columnar), defaults to the NetworkModel storage"""
         # TODO: refactor this logic
         log.debug("Adding overlay %s" % name)
 
         multi_edge = multi_edge or self.all_multigraph
+        storage = storage or self.storage
 
         if graph:
             if not directed and graph.is_directed():
@@ -188,7 +289,13 @@ class NetworkModel(AnkElement):
             else:
                 new_graph = nx.Graph()
 
+        new_graph = columnar.with_storage(new_graph, storage, graph)
         self._overlays[name] = new_graph
+        self._hubs.pop(name, None)
+        if name == 'phy':
+            self._invalidate_node_indexes()  # other overlays read from phy
+        else:
+            self._invalidate_node_indexes(name)
         overlay = NmGraph(self, name)
 
         if nodes:
@@ -197,6 +304,29 @@ class NetworkModel(AnkElement):
 
         return overlay
 
+    def _add_hubs(self, overlay_id, node_ids):
+        """Records node_ids as multipoint hubs in overlay_id, see
+        ank.hub_nodes"""
+
+        self._hubs.setdefault(overlay_id, set()).update(node_ids)
+
+    def _hub_ids(self, overlay_id):
+        """Returns the ids of the multipoint hubs in overlay_id, or None.
+        May include removed nodes: check the multipoint_hub attribute"""
+
+        return self._hubs.get(overlay_id)
+
+    def _replace_overlay(self, name, graph):
+        """Sets the NetworkX graph of overlay name directly, eg for an
+        overlay built in another process. Unlike add_overlay, graph isn't
+        copied or converted"""
+
+        self._overlays[name] = graph
+        if name == 'phy':
+            self._invalidate_node_indexes()
+        else:
+            self._invalidate_node_indexes(name)
+
     def __iter__(self):
         return iter(NmGraph(self, name) for name in self.overlays())
 
@@ -214,12 +344,14 @@ class NetworkModel(AnkElement):
     def __getitem__(self, key):
         """"""
 
+        if key not in self._overlays:
+            self._produce(key)
         return NmGraph(self, key)
 
     def overlay(self, key):
         """"""
 
-        return NmGraph(self, key)
+        return self[key]
 
     def node_label(self, node):
         """Returns node label from physical graph"""
@@ -231,24 +363,21 @@ class NetworkModel(AnkElement):
         """"""
 
         def custom_label(node):
-            """
-            #TODO:  rewrite this logic/retire this function
-            retval = []
-            if node in self['phy']:
-                for key in self.label_attrs:
-                    val = self._overlays['phy'].node[node.node_id].get(key)
-                    if val is not None:
-                        retval.append(val)
-
-            if len(retval):
-                return self.label_seperator.join(retval)
-            """
-
-
-            return self.label_seperator.join(str(self._overlays['phy'
-                                                                ].node[node.node_id].get(val)) for val in
-                                             self.label_attrs
-                                             if self._overlays['phy'].node[node.node_id].get(val) is not None)
+            """Labels are memoized per node_id in _node_labels,
+            see _invalidate_label_index"""
+            node_id = node.node_id
+            try:
+                return self._node_labels[node_id]
+            except KeyError:
+                pass  # not yet computed
+
+            # KeyError if not in phy: caller falls back to overlay label
+            data = self._overlays['phy'].node[node_id]
+            label = self.label_seperator.join(str(data[val])
+                                              for val in self.label_attrs
+                                              if data.get(val) is not None)
+            self._node_labels[node_id] = label
+            return label
 
         self.node_label = custom_label
 
@@ -263,3 +392,176 @@ class NetworkModel(AnkElement):
 
         self.label_seperator = seperator
         self.label_attrs = label_attrs
+        self._invalidate_label_index()  # all labels are derived from these
+
+    def _invalidate_label_index(self, overlay_id=None):
+        """Drops the cached label -> node_id lookup for overlay_id,
+        or for all overlays (and the memoized labels) if not specified"""
+
+        if overlay_id is None:
+            self._label_indexes.clear()
+            self._node_labels.clear()
+        else:
+            self._label_indexes.pop(overlay_id, None)
+
+    def _invalidate_node_indexes(self, overlay_id=None):
+        """Call when nodes are added to or removed from overlay_id"""
+
+        self._invalidate_label_index(overlay_id)
+        self._invalidate_attr_index(overlay_id)
+
+    def _invalidate_node_label(self, node_id):
+        """Call when a label attribute of node_id changes"""
+
+        self._node_labels.pop(node_id, None)
+        self._label_indexes.clear()
+
+    def index_node_attrs(self, *attrs):
+        """Maintain hash indexes on node attributes attrs, in all overlays.
+        Used by nodes(), filter(), routers() etc to only visit the nodes that
+        can match. Indexes are built on first use, and kept up to date by
+        NmNode.__setattr__.
+
+        >>> anm = autonetkit.topos.multi_as()
+        >>> anm.index_node_attrs("asn", "device_type")
+        >>> anm["phy"].nodes(asn=3)
+        [r7, r8, r9, r10]
+
+        Writes directly to the NetworkX graph bypass the index: call
+        _invalidate_attr_index afterwards, as in ank.copy_attr_from.
+        """
+
+        self._indexed_node_attrs.update(attrs)
+
+    def _attr_index(self, overlay_id, attr):
+        """Returns AttrIndex for attr in overlay_id, building on first use.
+        None if attr not indexed, or values unhashable"""
+
+        key = (overlay_id, attr)
+        try:
+            return self._attr_indexes[key]
+        except KeyError:
+            pass
+
+        if attr not in self._indexed_node_attrs:
+            return None
+
+        # index the value as read through NmNode, eg asn falls back to phy
+        items = ((node_id, getattr(NmNode(self, overlay_id, node_id), attr))
+                 for node_id in self._overlays[overlay_id])
+        try:
+            index = AttrIndex(items)
+        except TypeError:
+            index = None  # unhashable values, eg lists
+
+        self._attr_indexes[key] = index
+        return index
+
+    def _node_position(self, overlay_id):
+        """Returns {node_id: position} in iteration order of overlay_id,
+        to return index lookups in the same order as nodes()"""
+
+        try:
+            return self._node_positions[overlay_id]
+        except KeyError:
+            positions = dict((node_id, position) for (position, node_id)
+                             in enumerate(self._overlays[overlay_id]))
+            self._node_positions[overlay_id] = positions
+            return positions
+
+    def _update_attr_index(self, overlay_id, node_id, attr, value):
+        """Call when attr of node_id is set to value in overlay_id"""
+
+        if attr in ('asn', 'device_type', 'device_subtype') and \
+                (overlay_id == 'phy' or attr == 'asn'):
+            # read through from phy by the other overlays (and asn is
+            # written to phy), see NmNode.asn and NmNode.__getattr__
+            for key in [key for key in self._attr_indexes
+                        if key[1] == attr and key[0] != overlay_id]:
+                del self._attr_indexes[key]
+
+        key = (overlay_id, attr)
+        index = self._attr_indexes.get(key)
+        if index is not None:
+            try:
+                index.update(node_id, value)
+            except TypeError:
+                del self._attr_indexes[key]  # rebuilt on next use
+
+    def _interface_index(self, overlay_id, node_id):
+        """Returns InterfaceIndex for node_id in overlay_id, building on
+        first use or if the interfaces have changed since. None if the
+        category values can't be indexed"""
+
+        graph = self._overlays[overlay_id]
+        try:
+            ports = graph.node[node_id]['_ports']
+        except KeyError:
+            return None
+        phy_ports = None
+        if overlay_id != 'phy':
+            # category reads through to phy, see NmPort.category
+            try:
+                phy_ports = self._overlays['phy'].node[node_id]['_ports']
+            except KeyError:
+                pass
+
+        indexes = self._interface_indexes.setdefault(node_id, {})
+        index = indexes.get(overlay_id)
+        if index is not None and index.is_current(ports, phy_ports):
+            return index
+
+        try:
+            items = [(interface_id, port.category, port.subcategory)
+                     for (interface_id, port) in
+                     ((interface_id, NmPort(self, overlay_id, node_id,
+                                            interface_id))
+                      for interface_id in ports)]
+            index = InterfaceIndex(ports, phy_ports, items)
+        except (AttributeError, TypeError):
+            index = None  # eg unhashable or inaccessible values
+
+        indexes[overlay_id] = index
+        return index
+
+    def _invalidate_interface_index(self, node_id):
+        """Call when the category or subcategory of an interface of node_id
+        changes. Drops the index in all overlays, as they read through to
+        phy"""
+
+        self._interface_indexes.pop(node_id, None)
+
+    def _port_edge_index(self, overlay_id):
+        """Returns PortEdgeIndex for overlay_id, building on first use
+        (or if the overlay has been replaced)"""
+
+        graph = self._overlays[overlay_id]
+        index = self._port_edge_indexes.get(overlay_id)
+        if index is None or index.graph is not graph:
+            index = PortEdgeIndex(graph)
+            self._port_edge_indexes[overlay_id] = index
+        return index
+
+    def _update_port_edge_index(self, overlay_id, src_id, dst_id, ekey,
+                                ports):
+        """Call when edges are added, or their interfaces bound, in
+        overlay_id"""
+
+        index = self._port_edge_indexes.get(overlay_id)
+        if index is not None:
+            index.add(src_id, dst_id, ekey, ports)
+
+    def _invalidate_attr_index(self, overlay_id=None, attr=None):
+        """Drops the attribute indexes for overlay_id and/or attr,
+        or all if neither is specified"""
+
+        if overlay_id is None and attr is None:
+            self._attr_indexes.clear()
+            self._node_positions.clear()
+            return
+
+        for key in [key for key in self._attr_indexes
+                    if overlay_id in (None, key[0]) and attr in (None, key[1])]:
+            del self._attr_indexes[key]
+        if attr is None:
+            self._node_positions.pop(overlay_id, None)
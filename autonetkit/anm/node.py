@@ -13,22 +13,37 @@ from autonetkit.anm.ank_element import AnkElement
 @total_ordering
 class NmNode(AnkElement):
 
-    """NmNode"""
+    """NmNode
 
-    def __init__(self, anm, overlay_id, node_id):
+    Instances are interned per (overlay_id, node_id) in the anm, so repeated
+    access returns the same object while it is still referenced.
+    """
 
-        # Set using this method to bypass __setattr__
+    __slots__ = ('anm', 'overlay_id', 'node_id', '__weakref__')
+    log = log
+
+    def __new__(cls, anm, overlay_id, node_id):
+        if isinstance(node_id, NmNode):
+            node_id = node_id.node_id
+
+        key = (overlay_id, node_id)
+        self = anm._node_cache.get(key)
+        if self is not None:
+            return self
 
+        self = object.__new__(cls)
+        # Set using this method to bypass __setattr__
         object.__setattr__(self, 'anm', anm)
         object.__setattr__(self, 'overlay_id', overlay_id)
-# should be able to use _graph from here as anm and overlay_id are defined
         object.__setattr__(self, 'node_id', node_id)
-        #logger = logging.getLogger("ANK")
-        #logstring = "Node: %s" % str(self)
-        #logger = CustomAdapter(logger, {'item': logstring})
-        logger = log
-        object.__setattr__(self, 'log', logger)
-        self.init_logging("node")
+        anm._node_cache[key] = self
+        return self
+
+    def __init__(self, anm, overlay_id, node_id):
+        pass  # set in __new__, as instances are shared
+
+    def __reduce__(self):
+        return (NmNode, (self.anm, self.overlay_id, self.node_id))
 
     def __hash__(self):
         """"""
@@ -130,7 +145,10 @@ class NmNode(AnkElement):
         # TODO: initialise id for loopback zero?
         # TODO: Set category for loopback zero to be "loopback"
 
-        return (i for i in self.interfaces('is_loopback_zero')).next()
+        # by convention loopback zero is interface 0, see NmPort.category
+        if 0 in self._interface_ids():
+            return NmPort(self.anm, self.overlay_id, self.node_id, 0)
+        raise StopIteration  # as for an empty interfaces('is_loopback_zero')
 
     def physical_interfaces(self, *args, **kwargs):
         """"""
@@ -309,10 +327,23 @@ class NmNode(AnkElement):
                 and all(getattr(interface, key) == val for (key,
                                                             val) in kwargs.items())
 
+        interface_ids = None
+        if 'category' in kwargs:
+            # only visit the interfaces that can match
+            index = self.anm._interface_index(self.overlay_id, self.node_id)
+            if index is not None:
+                if 'subcategory' in kwargs:
+                    interface_ids = index.lookup(kwargs['category'],
+                                                 kwargs['subcategory'])
+                else:
+                    interface_ids = index.lookup(kwargs['category'])
+        if interface_ids is None:
+            interface_ids = self._interface_ids()
+
         all_interfaces = iter(NmPort(self.anm,
                                      self.overlay_id, self.node_id,
                                      interface_id) for interface_id in
-                              self._interface_ids())
+                              interface_ids)
 
         retval = [i for i in all_interfaces if filter_func(i)]
         return retval
@@ -496,6 +527,8 @@ class NmNode(AnkElement):
     def __getitem__(self, key):
         """Get item key"""
 
+        if key not in self.anm._overlays:
+            self.anm._produce(key)  # built on demand, see add_producer
         return NmNode(self.anm, key, self.node_id)
 
     @property
@@ -613,11 +646,48 @@ class NmNode(AnkElement):
 
         """
 
+        hubs = self.anm._hub_ids(self.overlay_id)
+        if hubs:
+            node_ids = []
+            seen = set()
+            for (node_id, _, _, _) in self._multipoint_peers(hubs):
+                if node_id not in seen:
+                    seen.add(node_id)
+                    node_ids.append(node_id)
+        else:
+            node_ids = self._graph.neighbors(self.node_id)
+
         neighs = list(NmNode(self.anm, self.overlay_id, node)
-                      for node in self._graph.neighbors(self.node_id))
+                      for node in node_ids)
 
         return self._overlay.filter(neighs, *args, **kwargs)
 
+    def _multipoint_peers(self, hubs):
+        """Returns (dst_id, ekey, hub_id, dst_ekey) for the edges of this
+        node, where edges to a multipoint hub (see ank.hub_nodes) are
+        replaced by the other nodes attached to the hub, with hub_id set.
+        hub_id and dst_ekey are None for the other edges"""
+
+        graph = self._graph
+        multigraph = graph.is_multigraph()
+        node_id = self.node_id
+
+        def node_edges(node_id):
+            if multigraph:
+                return [(dst, key) for (dst, keydict)
+                        in graph.adj[node_id].items() for key in keydict]
+            return [(dst, 0) for dst in graph.adj[node_id]]
+
+        result = []
+        for (dst, ekey) in node_edges(node_id):
+            if dst in hubs and graph.node[dst].get('multipoint_hub'):
+                result += [(peer, ekey, dst, peer_ekey)
+                           for (peer, peer_ekey) in node_edges(dst)
+                           if peer != node_id]
+            else:
+                result.append((dst, ekey, None, None))
+        return result
+
     def neighbor_interfaces(self, *args, **kwargs):
         """
 
@@ -670,7 +740,26 @@ class NmNode(AnkElement):
 
         """
 
-        return list(self._overlay.edges(self, *args, **kwargs))
+        hubs = self.anm._hub_ids(self.overlay_id)
+        if not hubs:
+            return list(self._overlay.edges(self, *args, **kwargs))
+
+        # edges through multipoint hubs, see ank.hub_nodes
+        from autonetkit.anm.edge import NmEdge, NmMultipointEdge
+        edges = []
+        for (dst, ekey, hub, dst_ekey) in self._multipoint_peers(hubs):
+            if hub is None:
+                edges.append(NmEdge(self.anm, self.overlay_id, self.node_id,
+                                    dst, ekey))
+            else:
+                edges.append(NmMultipointEdge(self.anm, self.overlay_id,
+                                              self.node_id, dst, hub, ekey,
+                                              dst_ekey))
+
+        return [edge for edge in edges
+                if all(getattr(edge, key) for key in args)
+                and all(getattr(edge, key) == val
+                        for (key, val) in kwargs.items())]
 
     def __str__(self):
         return str(self.__repr__())
@@ -749,11 +838,19 @@ class NmNode(AnkElement):
         if key == 'raw_interfaces':
             object.__setattr__(self, 'raw_interfaces', val)
 
+        if key == 'label' or key in self.anm.label_attrs:
+            self.anm._invalidate_node_label(self.node_id)
+
         try:
             self._graph.node[self.node_id][key] = val
         except KeyError:
             self._graph.add_node(self.node_id)
+            self._overlay._invalidate_node_indexes()
             self.set(key, val)
+        else:
+            if key in self.anm._indexed_node_attrs:
+                self.anm._update_attr_index(self.overlay_id, self.node_id,
+                                            key, val)
 
     def set(self, key, val):
         """For consistency, node.set(key, value) is neater
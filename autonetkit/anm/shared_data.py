@@ -0,0 +1,40 @@
+import copy
+
+
+class SharedDict(dict):
+
+    """Read-only dict, shared between overlays (or interfaces) instead of
+    copying. Writers replace it with a private dict(...) copy first,
+    see NmPort.__setattr__ and NmEdge.bind_interface.
+    Mutating it directly raises TypeError, rather than clobbering the data
+    for every holder. Copies are plain dicts.
+
+    >>> data = SharedDict(category="physical")
+    >>> data["category"]
+    'physical'
+    >>> data["category"] = "loopback"
+    Traceback (most recent call last):
+    ...
+    TypeError: SharedDict is read-only, copy with dict() to modify
+
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("SharedDict is read-only, copy with dict() to modify")
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
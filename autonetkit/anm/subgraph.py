@@ -12,6 +12,18 @@ class OverlaySubgraph(OverlayBase):
         object.__setattr__(self, '_subgraph_name', name)
         super(OverlaySubgraph, self).__init__(anm, overlay_id)
         self._graph = graph
+        self._subgraph_label_indexes = {}
 
     def __repr__(self):
         return self._subgraph_name or 'subgraph'
+
+    @property
+    def _label_indexes(self):
+        """Subgraph nodes differ from the overlay: don't share its lookup"""
+
+        return self._subgraph_label_indexes
+
+    def _attr_index(self, attr):
+        """Attribute indexes are for the whole overlay: not used here"""
+
+        return None
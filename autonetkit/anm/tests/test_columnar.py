@@ -0,0 +1,92 @@
+import copy
+import pickle
+
+from autonetkit.topologies import house
+from autonetkit.anm import columnar
+
+
+def test_attributes():
+    anm = house()
+    g_phy = anm['phy']
+    g_ospf = anm.add_overlay("ospf", g_phy.nodes(), retain="asn",
+                             storage="columnar")
+    assert(isinstance(g_ospf._graph.node, columnar.NodeStore))
+    assert(sorted(g_ospf._graph.node) == sorted(g_phy._graph.node))
+
+    r1 = g_ospf.node("r1")
+    assert(r1.asn == 1)
+    assert(r1.area is None)
+    r1.area = 0
+    assert(r1.area == 0)
+    assert("area" in g_ospf._graph.node["r1"])
+    assert(g_ospf.node("r2").area is None)
+    assert(g_ospf.nodes(area=0) == [r1])
+
+    # interfaces
+    assert(len(r1.interfaces()) == len(g_phy.node("r1").interfaces()))
+    eth0 = r1.interface("eth0")
+    eth0.cost = 10
+    assert(eth0.cost == 10)
+    assert(r1.interface("eth0").cost == 10)
+    assert(r1.loopback_zero.is_loopback_zero)
+    new_interface = r1.add_loopback(description="lo1")
+    assert(new_interface.description == "lo1")
+
+    # removing frees the rows, for reuse
+    store = g_ospf._graph.node
+    n_rows = (store.columns.n_rows, store.port_columns.n_rows)
+    data = store["r1"]
+    g_ospf.remove_node("r1")
+    assert("r1" not in g_ospf._graph.node)
+    assert(g_ospf.node("r2").asn == 1)
+    assert(len(data) == 0)  # a view held after removal reads as empty
+    g_ospf.add_nodes_from([g_phy.node("r1")], retain="asn")
+    assert((store.columns.n_rows, store.port_columns.n_rows) == n_rows)
+    assert(len(data) == 0)
+    assert(g_ospf.node("r1").asn == 1)
+
+
+def test_raw_interfaces():
+    anm = house()
+    g_test = anm.add_overlay("test", anm['phy'].nodes(), storage="columnar")
+    r1 = g_test.node("r1")
+    r1.raw_interfaces = {0: {'category': 'loopback'}}
+    r1._ports[1] = {"category": "physical"}
+    data = g_test._graph.node["r1"]
+    # the same interfaces, as for the dict backend
+    assert(data["raw_interfaces"] is data["_ports"])
+    assert(sorted(data["raw_interfaces"]) == [0, 1])
+
+    data = copy.deepcopy(g_test._graph.node)["r1"]
+    assert(data["raw_interfaces"] is data["_ports"])
+
+
+def test_copy():
+    anm = house()
+    g_ospf = anm.add_overlay("ospf", anm['phy'].nodes(), retain="asn",
+                             storage="columnar")
+    graph = g_ospf._graph
+
+    data = copy.deepcopy(graph.node)
+    assert(isinstance(data, columnar.NodeStore))
+    assert(dict(data["r1"]) == dict(graph.node["r1"]))
+    data["r1"]["asn"] = 5
+    assert(graph.node["r1"]["asn"] == 1)
+
+    data = pickle.loads(pickle.dumps(graph.node))
+    assert(data["r1"]["_ports"] == graph.node["r1"]["_ports"])
+    assert(data["r1"]["_ports"][1]["category"] == "physical")
+
+    graph_copy = graph.copy()
+    assert(graph_copy.nodes() == graph.nodes())
+    assert(graph_copy.node["r2"]["asn"] == 1)
+
+
+def test_storage_report():
+    anm = house()
+    anm.add_overlay("ospf", anm['phy'].nodes(), retain="asn",
+                    storage="columnar")
+    report = columnar.storage_report(anm)
+    assert(report['phy']['storage'] == 'dict')
+    assert(report['phy']['bytes'] == report['phy']['dict_bytes'])
+    assert(report['ospf']['bytes'] < report['ospf']['dict_bytes'])
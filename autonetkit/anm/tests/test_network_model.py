@@ -1,4 +1,4 @@
-from autonetkit.topologies import house
+from autonetkit.topologies import house, multi_edge
 from autonetkit.anm.network_model import NetworkModel
 from mock import patch
 
@@ -20,3 +20,242 @@ def test_init():
     anm = NetworkModel()
     assert(anm.has_overlay(("phy")) is True)
     assert(anm.has_overlay(("test")) is False)
+
+def test_node_label_lookup():
+    anm = house()
+    g_phy = anm['phy']
+    assert(g_phy.node("r1").node_id == "r1")
+
+    # label changes are picked up by the lookup
+    g_phy.node("r1").label = "core1"
+    assert(g_phy.node("core1").node_id == "r1")
+    assert(anm['input'].node("core1").node_id == "r1")
+
+    anm.set_node_label(".", ["label", "asn"])
+    assert(g_phy.node("core1.1").node_id == "r1")
+    assert(g_phy.node("r5.2").node_id == "r5")
+    assert(g_phy.node("core1") is None)
+
+    # removing a node removes it from the lookup
+    g_phy.remove_node("r5")
+    assert(g_phy.node("r5.2") is None)
+
+def test_element_interning():
+    anm = house()
+    g_phy = anm['phy']
+    r1 = g_phy.node("r1")
+    assert(r1 is g_phy.node("r1"))
+    assert(r1 is not anm['input'].node("r1"))
+    assert(g_phy.edge(r1, g_phy.node("r2")) is g_phy.edge("r1", "r2"))
+    assert(r1.loopback_zero is r1.loopback_zero)
+
+    import copy
+    r1_copy = copy.copy(r1)
+    assert(r1_copy == r1)
+
+    # entries are dropped once the wrapper is no longer in use
+    r5 = g_phy.node("r5")
+    assert(("phy", "r5") in anm._node_cache)
+    del r5
+    assert(("phy", "r5") not in anm._node_cache)
+
+def test_node_label_memo():
+    anm = house()
+    g_phy = anm['phy']
+    g_in = anm['input']
+    r1 = g_phy.node("r1")
+    assert(str(r1) == "r1")
+    assert(str(g_in.node("r1")) == "r1")
+
+    r1.label = "core1"
+    assert(str(r1) == "core1")
+    assert(str(g_in.node("r1")) == "core1")
+
+    anm.set_node_label("_", ["label", "asn", "pop"])
+    assert(str(r1) == "core1_1")
+    g_phy.node("r1").asn = 7
+    assert(str(r1) == "core1_7")
+
+    # writes through the nx graph helpers are also picked up
+    from autonetkit.ank import copy_attr_from, set_node_default
+    set_node_default(g_in, pop="syd")
+    copy_attr_from(g_in, g_phy, "pop")
+    assert(str(r1) == "core1_7_syd")
+
+def test_neigh_graphics_label():
+    from autonetkit.ank import neigh_graphics, split
+    anm = house()
+    g_phy = anm['phy']
+    anm.add_overlay("graphics")
+    anm.set_node_label("_", ["label", "asn"])
+    cd = split(g_phy, g_phy.edge("r1", "r2"), id_prepend="cd_")[0]
+    label = str(cd)
+    assert(cd.asn is None)
+
+    # the asn written to the nx graphs is in the memoized label
+    neigh_graphics(g_phy, [cd], g_phy, g_phy)
+    assert(cd.asn == 1)
+    assert(str(cd) == label + "_1")
+
+def test_node_attr_index():
+    anm = house()
+    anm.index_node_attrs("asn", "device_type", "platform")
+    g_phy = anm['phy']
+    g_ospf = anm.add_overlay("ospf", g_phy.nodes())
+    assert(g_phy.nodes(asn=2) == [g_phy.node("r4"), g_phy.node("r5")])
+    assert(g_ospf.nodes(asn=2) == [g_ospf.node("r4"), g_ospf.node("r5")])
+
+    # writes are reflected, including reads through from phy
+    g_phy.node("r4").asn = 3
+    assert(g_phy.nodes(asn=2) == [g_phy.node("r5")])
+    assert(g_ospf.nodes(asn=3) == [g_ospf.node("r4")])
+
+    g_phy.update(["r1", "r2"], platform="junos")
+    assert(g_phy.filter(platform="junos") == [g_phy.node("r1"),
+                                             g_phy.node("r2")])
+    assert(g_phy.nodes(platform="junos", asn=1) == g_phy.filter(
+        platform="junos"))
+
+    g_phy.node("r3").device_type = "server"
+    assert(g_ospf.routers() == [n for n in g_ospf if n.is_router()])
+    assert(g_ospf.servers() == [g_ospf.node("r3")])
+    g_ospf.node("r3").device_type = "router"  # overlay value takes priority
+    assert(g_ospf.node("r3") in g_ospf.routers())
+
+    # added and removed nodes
+    g_ospf.remove_node("r5")
+    g_ospf.add_node("r6", asn=2)
+    assert(g_ospf.nodes(asn=2) == [g_ospf.node("r6")])
+
+
+def test_copy_on_write_overlay():
+    anm = house()
+    g_phy = anm['phy']
+    g_ospf = anm.add_overlay("ospf", g_phy.nodes())
+    g_ospf.add_edges_from(g_phy.edges())
+    g_isis = anm.add_overlay("isis", g_phy.nodes())
+    g_isis.add_edges_from(g_ospf.edges())
+
+    # interfaces share defaults until written
+    eth0 = g_ospf.node("r1").interface("eth0")
+    eth1 = g_ospf.node("r1").interface("eth1")
+    eth0.cost = 10
+    assert(eth0.cost == 10)
+    assert(eth1.cost is None)
+    assert(eth1.category == "physical")
+    assert(g_isis.node("r1").interface("eth0").cost is None)
+    assert(g_phy.node("r1").interface("eth0").cost is None)
+
+    # edge bindings share the source edge's ports until rebound
+    r1_isis = g_isis.node("r1")
+    edge = g_isis.edge(r1_isis, g_isis.node("r2"))
+    source = g_ospf.edge(g_ospf.node("r1"), g_ospf.node("r2"))
+    assert(edge.raw_interfaces is source.raw_interfaces)
+    edge.bind_interface(r1_isis, 5)
+    assert(edge.raw_interfaces[r1_isis.node_id] == 5)
+    assert(source.raw_interfaces[r1_isis.node_id] != 5)
+
+
+def test_interface_index():
+    anm = house()
+    g_phy = anm['phy']
+    g_ospf = anm.add_overlay("ospf", g_phy.nodes())
+    r1 = g_ospf.node("r1")
+    assert(r1.loopback_zero.interface_id == 0)
+    assert(r1.loopback_zero.is_loopback_zero)
+    physical = [i for i in r1.interfaces() if i.category == "physical"]
+    assert(r1.edge_interfaces() == physical)
+
+    # added interfaces and category writes are picked up
+    lo1 = r1.add_loopback(description="lo1")
+    assert(r1.loopback_interfaces() == [r1.loopback_zero, lo1])
+    eth0 = g_phy.node("r1").interface("eth0")
+    eth0.category = "loopback"
+    assert(r1.interface("eth0") in r1.loopback_interfaces())
+    assert(r1.interface("eth0") not in r1.edge_interfaces())
+
+
+def test_port_edge_index():
+    anm = multi_edge()
+    g_phy = anm['phy']
+    r1 = g_phy.node("r1")
+    r2 = g_phy.node("r2")
+    r1_eth2 = r1.interface(3)
+    r2_eth4 = r2.interface(5)
+    edge = g_phy.edge(r1_eth2, r2_eth4)
+    assert(edge.ekey == 1)
+    assert(r1_eth2.edges() == [edge])
+    assert(r2_eth4.edges() == [g_phy.edge("r2", "r1", 1)])
+    assert(not g_phy.has_edge(r1_eth2, r2.interface(1)))
+
+    # added, rebound and removed edges
+    g_ospf = anm.add_overlay("ospf", g_phy.nodes(), multi_edge=True)
+    g_ospf.add_edges_from(g_phy.edges())
+    ospf_edge = g_ospf.edge(r1_eth2, r2_eth4)
+    assert(ospf_edge.ekey == 1)
+    ospf_edge.bind_interface(g_ospf.node("r1"), 4)
+    assert(g_ospf.edge(r1_eth2, r2_eth4) is None)
+    assert(g_ospf.edge(r1.interface(4), r2_eth4) == ospf_edge)
+    assert(g_phy.edge(r1_eth2, r2_eth4) == edge)
+    g_ospf.remove_edges_from([ospf_edge])
+    assert(g_ospf.node("r1").interface(4).edges() ==
+           [g_ospf.edge("r1", "r3", 1)])
+
+
+def test_add_edges_from_batch():
+    anm = house()
+    g_phy = anm['phy']
+    g_phy.edge("r1", "r2").color = "red"
+    g_test = anm.add_overlay("test", ["r1", "r2", "r3"])
+    added = g_test.add_edges_from(g_phy.edges(), retain="color", weight=5)
+    assert(added == [g_test.edge("r1", "r2"), g_test.edge("r1", "r3"),
+                     g_test.edge("r2", "r3")])
+    edge = g_test.edge("r1", "r2")
+    assert(edge.color == "red" and edge.weight == 5)
+    assert(edge.raw_interfaces == g_phy.edge("r1", "r2").raw_interfaces)
+
+    g_data = anm.add_overlay("data", ["r1", "r2", "r3"], directed=True)
+    added = g_data.add_edges_from([("r1", "r2", {"cost": 1}),
+                                   ("r2", "r4", {"cost": 2})],
+                                  bidirectional=True)
+    assert(added == [g_data.edge("r1", "r2"), g_data.edge("r2", "r1")])
+    assert(g_data.edge("r2", "r1").cost == 1)
+
+
+def test_multipoint_hub():
+    import autonetkit.ank as ank_utils
+    anm = house()
+    g_phy = anm['phy']
+    # without r1-r3, which the full mesh through r2 would overwrite
+    edges = [edge for edge in g_phy.edges() if edge != ("r1", "r3")]
+    g_mesh = anm.add_overlay("mesh", g_phy.nodes())
+    g_mesh.add_edges_from(edges)
+    ank_utils.explode_nodes(g_mesh, g_mesh.node("r2"))
+    g_hub = anm.add_overlay("hub", g_phy.nodes())
+    g_hub.add_edges_from(edges)
+    hub_edges = ank_utils.hub_nodes(g_hub, g_hub.node("r2"))
+    assert(len(hub_edges) == 3)
+    # stored as a star, queried as the mesh
+    assert(g_hub._graph.number_of_edges() == len(edges))
+    assert(sorted(sorted((str(e.src), str(e.dst))) for e in g_hub.edges())
+           == sorted(sorted((str(e.src), str(e.dst))) for e in g_mesh.edges()))
+
+    # same peers and interfaces as the full mesh
+    for node in g_mesh:
+        hub_node = g_hub.node(node)
+        assert(sorted(node.neighbors()) == sorted(hub_node.neighbors()))
+        assert(sorted((i.node_id, i.interface_id) for i in
+                      node.neighbor_interfaces()) ==
+               sorted((i.node_id, i.interface_id) for i in
+                      hub_node.neighbor_interfaces()))
+
+    edge = g_hub.node("r1").edges(multipoint=True)[0]
+    assert(edge == ("r1", "r4") and edge.hub == g_hub.node("r2"))
+    assert(edge.src_int.multipoint and edge.dst_int.multipoint)
+    assert(edge.src_int.interface_id ==
+           g_phy.edge("r1", "r2").src_int.interface_id)
+    assert(bool(edge))
+
+    # removing the hub removes its edges
+    g_hub.remove_node("r2")
+    assert(g_hub.node("r1").neighbors() == [])
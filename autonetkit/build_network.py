@@ -6,6 +6,7 @@ import autonetkit.anm
 import autonetkit.config
 import autonetkit.exception
 import autonetkit.log as log
+import autonetkit.profiling as profiling
 import networkx as nx
 
 SETTINGS = autonetkit.config.settings
@@ -79,7 +80,11 @@ def grid_2d(dim):
 def initialise(input_graph):
     """Initialises the input graph with from a NetworkX graph"""
     all_multigraph = input_graph.is_multigraph()
-    anm = autonetkit.anm.NetworkModel(all_multigraph=all_multigraph)
+    anm = autonetkit.anm.NetworkModel(all_multigraph=all_multigraph,
+        storage=SETTINGS['General']['overlay_storage'])
+    # attributes queried in loops by the design rules
+    anm.index_node_attrs('asn', 'device_type', 'host', 'platform',
+                         'broadcast_domain', 'igp')
 
     g_in = anm.initialise_input(input_graph)
     # autonetkit.update_vis(anm)
@@ -147,119 +152,193 @@ def check_server_asns(anm):
                              "not auto-correcting", server, server.asn)
 
 
-def apply_design_rules(anm):
-    """Applies appropriate design rules to ANM"""
-    # log.info("Building overlay topologies")
-    g_in = anm['input']
-
-    build_phy(anm)
-
+def _cisco_build_network():
+    """Returns the autonetkit_cisco build_network module, or None"""
     try:
         from autonetkit_cisco import build_network as cisco_build_network
-    except ImportError, e:
-        log.debug("Unable to load autonetkit_cisco %s", e)
-    else:
-        cisco_build_network.post_phy(anm)
-
-    g_phy = anm['phy']
-    from autonetkit.design.osi_layers import build_layer1, build_layer2, build_layer3
-    # log.info("Building layer2")
-    build_layer1(anm)
-    build_layer2(anm)
-    # autonetkit.update_http(anm)
-
-    # log.info("Building layer3")
-    build_layer3(anm)
-
-    check_server_asns(anm)
+    except ImportError, error:
+        log.debug("Unable to load autonetkit_cisco %s", error)
+        return None
+    return cisco_build_network
 
-    from autonetkit.design.mpls import build_vrf
-    build_vrf(anm)  # do before to add loopbacks before ip allocations
-    from autonetkit.design.ip import build_ip, build_ipv4, build_ipv6
-    # TODO: replace this with layer2 overlay topology creation
-    # log.info("Allocating IP addresses")
-    build_ip(anm)  # ip infrastructure topology
 
+def mark_address_families(anm):
+    """Marks the address families used by each device in phy"""
+    g_in = anm['input']
+    g_phy = anm['phy']
     address_family = g_in.data.address_family or "v4"  # default is v4
-# TODO: can remove the infrastructure now create g_ip seperately
     if address_family == "None":
-        log.info("IP addressing disabled, disabling routing protocol ",
+        log.info("IP addressing disabled, disabling routing protocol "
                  "configuration")
-        anm['phy'].data.enable_routing = False
+        g_phy.data.enable_routing = False
 
+    g_phy.update(g_phy, use_ipv4=address_family in ("v4", "dual_stack"))
+    g_phy.update(g_phy, use_ipv6=address_family in ("v6", "dual_stack"))
+
+
+def build_ipv4_family(anm):
+    """Allocates IPv4, with only loopbacks (for router ids) if v6"""
+    from autonetkit.design.ip import build_ipv4
+    address_family = anm['input'].data.address_family or "v4"
     if address_family == "None":
         log.info("IP addressing disabled, skipping IPv4")
         anm.add_overlay("ipv4")  # create empty so rest of code follows
-        g_phy.update(g_phy, use_ipv4=False)
     elif address_family in ("v4", "dual_stack"):
         build_ipv4(anm, infrastructure=True)
-        g_phy.update(g_phy, use_ipv4=True)
     elif address_family == "v6":
         # Allocate v4 loopbacks for router ids
         build_ipv4(anm, infrastructure=False)
-        g_phy.update(g_phy, use_ipv4=False)
 
+
+def build_ipv6_family(anm):
+    """Allocates IPv6, if used"""
+    from autonetkit.design.ip import build_ipv6
+    address_family = anm['input'].data.address_family or "v4"
     # TODO: Create collision domain overlay for ip addressing - l2 overlay?
     if address_family == "None":
         log.info("IP addressing disabled, not allocating IPv6")
         anm.add_overlay("ipv6")  # create empty so rest of code follows
-        g_phy.update(g_phy, use_ipv6=False)
     elif address_family in ("v6", "dual_stack"):
         build_ipv6(anm)
-        g_phy.update(g_phy, use_ipv6=True)
     else:
         anm.add_overlay("ipv6")  # placeholder for compiler logic
 
+
+def set_igp_defaults(anm):
+    """Sets the default IGP of input nodes, and copies it to phy"""
+    g_in = anm['input']
+    g_phy = anm['phy']
     default_igp = g_in.data.igp or "ospf"
     ank_utils.set_node_default(g_in, igp=default_igp)
     ank_utils.copy_attr_from(g_in, g_phy, "igp")
 
     ank_utils.copy_attr_from(g_in, g_phy, "include_csr")
 
-    try:
-        from autonetkit_cisco import build_network as cisco_build_network
-    except ImportError, error:
-        log.debug("Unable to load autonetkit_cisco %s" % error)
-    else:
-        cisco_build_network.pre_design(anm)
 
-    # log.info("Building IGP")
-    from autonetkit.design.igp import build_igp
-    build_igp(anm)
+def _if_routing(func):
+    """Returns func(anm), run only if routing is enabled in phy"""
+    def run_if_routing(anm):
+        if anm['phy'].data.enable_routing:
+            func(anm)
+    return run_if_routing
 
-    # log.info("Building BGP")
-    from autonetkit.design.bgp import build_bgp
-    build_bgp(anm)
-    # autonetkit.update_vis(anm)
-
-    from autonetkit.design.mpls import mpls_te, mpls_oam
-    mpls_te(anm)
-    mpls_oam(anm)
 
-# post-processing
-    if anm['phy'].data.enable_routing:
-        from autonetkit.design.mpls import (mark_ebgp_vrf,
-                                            build_ibgp_vpn_v4)
-        mark_ebgp_vrf(anm)
-        build_ibgp_vpn_v4(anm)  # build after bgp as is based on
-    # autonetkit.update_vis(anm)
+def design_stages():
+    """Returns the design rules as scheduler stages, in run order.
+    attrs lists the input attributes each stage reads, see
+    autonetkit.incremental"""
+    from autonetkit.design.scheduler import Stage
+    from autonetkit.design.osi_layers import build_layer1, build_layer2, build_layer3
+    from autonetkit.design.mpls import build_vrf
+    from autonetkit.design.ip import build_ip
+    from autonetkit.design.igp import build_igp
+    from autonetkit.design.bgp import build_bgp
+    from autonetkit.design.mpls import (mpls_te, mpls_oam, mark_ebgp_vrf,
+                                        build_ibgp_vpn_v4)
+
+    stages = [
+        Stage("build_phy", build_phy, ["input"], ["phy", "input"],
+              attrs=["enable_routing", "mgmt_block", "vpcid_block",
+                     "Creator", "label", "update", "device_type",
+                     "devsubtype", "asn", "specified_int_names", "x", "y",
+                     "device_subtype", "platform", "host", "syntax",
+                     "profile", "syslog", "Network", "custom_config_global",
+                     "custom_config_loopback_zero", "custom_config_phy_ints",
+                     "type", "_ports", "raw_interfaces"]),
+        Stage("build_layer1", build_layer1, ["phy", "graphics"],
+              ["layer1", "layer1_conn", "graphics"]),
+        Stage("build_layer2", build_layer2,
+              ["input", "phy", "graphics", "layer1", "layer1_conn"],
+              ["layer2", "layer2_conn", "layer2_bc", "vtp", "phy",
+               "graphics"],
+              attrs=["vlan", "_ports"]),
+        Stage("build_layer3", build_layer3,
+              ["input", "phy", "layer2", "layer2_conn"], ["layer3"],
+              attrs=["device_type", "asn", "label"]),
+        Stage("check_server_asns", check_server_asns,
+              ["input", "phy", "layer3"], ["phy"], attrs=["default_asn"]),
+        # before ip allocations to add loopbacks, which are added to phy
+        # and synced to the overlays built so far
+        Stage("build_vrf", build_vrf, ["input", "phy", "layer3"],
+              ["vrf", "mpls_ldp", "input", "phy", "layer1", "layer1_conn",
+               "layer2", "layer2_conn", "layer2_bc", "vtp", "layer3"],
+              attrs=["vrf", "vrf_role", "device_type"]),
+        # TODO: replace this with layer2 overlay topology creation
+        Stage("build_ip", build_ip, ["phy", "layer2"], ["ip"]),
+        Stage("mark_address_families", mark_address_families, ["input"],
+              ["phy"], attrs=["address_family"]),
+        Stage("build_ipv4", build_ipv4_family,
+              ["input", "phy", "layer2", "ip", "vrf"], ["ipv4"],
+              attrs=["address_family", "ipv4_infra_subnet",
+                     "ipv4_infra_prefix", "ipv4_loopback_subnet",
+                     "ipv4_loopback_prefix", "ipv4_vrf_loopback_subnet",
+                     "ipv4_vrf_loopback_prefix", "ipv4_prefixlen",
+                     "alloc_ipv4_loopbacks", "loopback_v4", "loopback_v6",
+                     "device_type", "_ports"]),
+        Stage("build_ipv6", build_ipv6_family,
+              ["input", "phy", "layer2", "ip", "vrf"], ["ipv6"],
+              attrs=["address_family", "ipv6_infra_subnet",
+                     "ipv6_infra_prefix", "ipv6_loopback_subnet",
+                     "ipv6_loopback_prefix", "ipv6_vrf_loopback_subnet",
+                     "ipv6_vrf_loopback_prefix", "ipv6_prefixlen",
+                     "loopback_v6", "device_type", "_ports"]),
+        Stage("set_igp_defaults", set_igp_defaults, ["input"],
+              ["phy", "input"], attrs=["igp", "include_csr"]),
+        Stage("build_igp", build_igp, ["input", "phy", "layer3", "ipv4"],
+              ["ospf", "eigrp", "isis", "rip", "igp"],
+              attrs=["ospf_area", "custom_config_ospf", "custom_config_eigrp",
+                     "custom_config_rip", "custom_config_isis"]),
+        Stage("build_bgp", build_bgp, ["input", "phy", "layer3"],
+              ["ebgp", "ebgp_v4", "ebgp_v6", "bgp", "ibgp_v4", "ibgp_v6"],
+              attrs=["ibgp_role", "ibgp_l2_cluster", "ibgp_l3_cluster",
+                     "custom_config_bgp"]),
+        # only built if used, eg by a compiler
+        Stage("mpls_te", mpls_te, ["input", "phy", "layer3"], ["mpls_te"],
+              lazy=True, attrs=["mpls_te_enabled", "device_type"]),
+        Stage("mpls_oam", mpls_oam, ["input"], ["mpls_oam"], lazy=True,
+              attrs=["use_mpls_oam", "device_type"]),
+        # post-processing
+        Stage("mark_ebgp_vrf", _if_routing(mark_ebgp_vrf),
+              ["phy", "vrf", "ebgp_v4", "ebgp_v6"], ["ebgp_v4", "ebgp_v6"]),
+        # build after bgp as is based on
+        Stage("build_ibgp_vpn_v4", _if_routing(build_ibgp_vpn_v4),
+              ["phy", "vrf", "bgp", "ibgp_v4", "ibgp_v6"],
+              ["ibgp_vpn_v4", "ibgp_v4", "ibgp_v6", "bgp"]),
+    ]
+
+    cisco_build_network = _cisco_build_network()
+    if cisco_build_network:
+        # the hooks don't declare what they read or modify
+        overlays = sorted(set(overlay_id for stage in stages
+                              for overlay_id in stage.inputs + stage.outputs))
+        post_phy = Stage("post_phy", cisco_build_network.post_phy,
+                         overlays, overlays)
+        pre_design = Stage("pre_design", cisco_build_network.pre_design,
+                           overlays, overlays)
+        post_design = Stage("post_design", cisco_build_network.post_design,
+                            overlays, overlays)
+        names = [stage.name for stage in stages]
+        stages.insert(names.index("build_igp"), pre_design)
+        stages.insert(names.index("build_phy") + 1, post_phy)
+        stages.append(post_design)
+
+    return stages
 
-    try:
-        from autonetkit_cisco import build_network as cisco_build_network
-    except ImportError, error:
-        log.debug("Unable to load autonetkit_cisco %s", error)
-    else:
-        cisco_build_network.post_design(anm)
 
-    # log.info("Finished building network")
+def apply_design_rules(anm):
+    """Applies appropriate design rules to ANM"""
+    from autonetkit.design import scheduler
+    scheduler.run(anm, design_stages())
     return anm
 
 
 def build(input_graph):
     """Main function to build network overlay topologies"""
     anm = None
-    anm = initialise(input_graph)
+    with profiling.stage("initialise"):
+        anm = initialise(input_graph)
     anm = apply_design_rules(anm)
+    profiling.record_overlays(anm)
     return anm
 
 def build_phy(anm):
@@ -3,7 +3,7 @@
 from collections import defaultdict
 
 import autonetkit.log as log
-import netaddr
+import autonetkit.ank_ip as ank_ip
 from autonetkit.ank import sn_preflen_to_network
 from autonetkit.compiler import sort_sessions
 from autonetkit.compilers.device.router_base import RouterCompiler
@@ -40,23 +40,23 @@ class IosBaseCompiler(RouterCompiler):
             node.ospf.use_ipv4 = phy_node.use_ipv4
             node.ospf.use_ipv6 = phy_node.use_ipv6
 
-        if node in self.anm['eigrp']:
+        if self.anm.has_overlay('eigrp') and node in self.anm['eigrp']:
             node.add_stanza("eigrp")
             node.eigrp.use_ipv4 = phy_node.use_ipv4
             node.eigrp.use_ipv6 = phy_node.use_ipv6
 
-        if node in self.anm['isis']:
+        if self.anm.has_overlay('isis') and node in self.anm['isis']:
             node.add_stanza("isis")
             node.isis.use_ipv4 = phy_node.use_ipv4
             node.isis.use_ipv6 = phy_node.use_ipv6
 
-        if node in self.anm['rip']:
+        if self.anm.has_overlay('rip') and node in self.anm['rip']:
             node.add_stanza("rip")
             node.rip.use_ipv4 = phy_node.use_ipv4
             node.rip.use_ipv6 = phy_node.use_ipv6            
 
         super(IosBaseCompiler, self).compile(node)
-        if node in self.anm['isis']:
+        if self.anm.has_overlay('isis') and node in self.anm['isis']:
             self.isis(node)
 
         node.label = self.anm['phy'].node(node).label
@@ -66,7 +66,7 @@ class IosBaseCompiler(RouterCompiler):
         phy_loopback_zero = self.anm['phy'
                                      ].interface(node.loopback_zero)
         if node.ip.use_ipv4:
-            ipv4_loopback_subnet = netaddr.IPNetwork('0.0.0.0/32')
+            ipv4_loopback_subnet = ank_ip.ip_network('0.0.0.0/32')
             ipv4_loopback_zero = phy_loopback_zero['ipv4']
             ipv4_address = ipv4_loopback_zero.ip_address
             node.loopback_zero.use_ipv4 = True
@@ -7,6 +7,7 @@ from autonetkit.nidb import ConfigStanza
 import autonetkit.plugins.naming as naming
 import autonetkit.log as log
 import netaddr
+import autonetkit.ank_ip as ank_ip
 from autonetkit.ank import sn_preflen_to_network
 
 
@@ -109,8 +110,7 @@ class RouterCompiler(DeviceCompiler):
         node.input_label = phy_node.id
         if node.ip.use_ipv4:
             node.loopback = ipv4_node.loopback
-            node.loopback_subnet = netaddr.IPNetwork(node.loopback)
-            node.loopback_subnet.prefixlen = 32
+            node.loopback_subnet = ank_ip.ip_network(node.loopback, 32)
 
         if self.anm['phy'].data.enable_routing:
             # applies even if ipv4 disabled, used for eg eigrp, bgp, ...
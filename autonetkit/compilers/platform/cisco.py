@@ -435,7 +435,7 @@ class CiscoCompiler(PlatformCompiler):
                 interface.id = numeric_to_portchannel_interface_label(
                         interface.numeric_id)
 
-            ios_compiler.compile(DmNode)
+            self.compile_device(ios_compiler, DmNode)
             if use_mgmt_interfaces:
                 mgmt_int = DmNode.add_interface(management=True)
                 mgmt_int.id = mgmt_int_id
@@ -462,7 +462,7 @@ class CiscoCompiler(PlatformCompiler):
             DmNode.supported_features = ConfigStanza(
                 mpls_te=False, mpls_oam=False, vrf=False)
 
-            nxos_compiler.compile(DmNode)
+            self.compile_device(nxos_compiler, DmNode)
             # TODO: make this work other way around
 
             if use_mgmt_interfaces:
@@ -489,7 +489,7 @@ class CiscoCompiler(PlatformCompiler):
                     interface.id = self.numeric_to_interface_label_star_os(
                         interface.numeric_id)
 
-            staros_compiler.compile(DmNode)
+            self.compile_device(staros_compiler, DmNode)
             # TODO: make this work other way around
 
             if use_mgmt_interfaces:
@@ -85,7 +85,7 @@ class NetkitCompiler(PlatformCompiler):
             dm_node.add_stanza("tap")
             dm_node.tap.id = self.index_to_int_id(int_ids.next())
 
-            quagga_compiler.compile(dm_node)
+            self.compile_device(quagga_compiler, dm_node)
 
             if dm_node.bgp:
                 dm_node.bgp.debug = True
@@ -5,10 +5,12 @@ class PlatformCompiler(object):
 
     """Base Platform Compiler"""
 
-    def __init__(self, nidb, anm, host):
+    def __init__(self, nidb, anm, host, devices=None):
         self.nidb = nidb
         self.anm = anm
         self.host = host
+        # autonetkit.incremental.DeviceCache, to reuse unaffected devices
+        self.devices = devices
 
     @property
     def timestamp(self):
@@ -18,6 +20,14 @@ class PlatformCompiler(object):
         # TODO: make this abstract
         pass
 
+    def compile_device(self, compiler, node):
+        """Runs compiler.compile(node), or repeats its previous changes
+        if node is unaffected, see autonetkit.incremental.DeviceCache"""
+        if self.devices is None:
+            compiler.compile(node)
+        else:
+            self.devices.compile(compiler, node)
+
     def copy_across_ip_addresses(self):
         # log.info("Copying IP addresses to device model")
         # TODO: try/except and raise SystemError as fatal error if cant copy
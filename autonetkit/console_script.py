@@ -8,7 +8,9 @@ from datetime import datetime
 
 import autonetkit.config as config
 import autonetkit.log as log
+import autonetkit.profiling as profiling
 import autonetkit.workflow as workflow
+from autonetkit.incremental import IncrementalBuild
 import pkg_resources
 
 try:
@@ -61,6 +63,10 @@ def parse_options(argument_string=None):
     parser.add_argument(
         '--webserver', action="store_true", default=False, help="Webserver")
     parser.add_argument('--grid', type=int, help="Grid Size (n * n)")
+    parser.add_argument('--timing', default=None, metavar='FILE',
+                        help="Write per-stage timing report as JSON to FILE")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Worker processes for independent design rules")
     parser.add_argument(
         '--target', choices=['netkit', 'cisco'], default=None)
     parser.add_argument(
@@ -80,6 +86,8 @@ def main(options):
     dst_folder = None
     if options.vis_uuid:
         config.settings['Http Post']['uuid'] = options.vis_uuid
+    if options.workers:
+        settings['General']['design_workers'] = options.workers
 
     try:
         # test if can import, if not present will fail and not add to template
@@ -149,10 +157,19 @@ def main(options):
         log.info("No input file specified. Exiting")
         return None
 
+    # keep state between builds in monitor mode, to only redo what changed
+    incremental = None
+    if build_options['monitor']:
+        incremental = IncrementalBuild()
+
+    profiling.reset()
     try:
         dst_folder = workflow.manage_network(input_string, timestamp,
-                       grid=options.grid, **build_options)
+                       grid=options.grid, incremental=incremental,
+                       **build_options)
     except Exception, err:
+        if incremental:
+            incremental.reset()  # rebuild in full on the next update
         log.error(
             "Error generating network configurations: %s" % err)
         log.debug("Error generating network configurations", exc_info=True)
@@ -160,6 +177,9 @@ def main(options):
             print traceback.print_exc()
         # sys.exit("Unable to build configurations.")
 
+    if options.timing:
+        profiling.write_report(options.timing)
+
 # TODO: work out why build_options is being clobbered for monitor mode
     build_options['monitor'] = options.monitor or settings['General'][
         'monitor']
@@ -180,10 +200,15 @@ def main(options):
                         log.info("Input graph updated, recompiling network")
                         with open(options.file, "r") as fh:
                             input_string = fh.read()  # read updates
+                        profiling.reset()
                         dst_folder = workflow.manage_network(input_string,
-                                       timestamp, build_options)
+                                       timestamp, incremental=incremental,
+                                       **build_options)
+                        if options.timing:
+                            profiling.write_report(options.timing)
                         log.info("Monitoring for updates...")
                     except Exception, e:
+                        incremental.reset()
                         log.warning("Unable to build network %s" % e)
                         traceback.print_exc()
 
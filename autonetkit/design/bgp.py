@@ -1,6 +1,10 @@
+import itertools
+
 import autonetkit.ank as ank_utils
 import autonetkit.log as log
 from autonetkit.ank_utils import call_log
+from autonetkit.design import scheduler
+from autonetkit.design.scheduler import Stage
 
 #@call_log
 
@@ -82,6 +86,108 @@ def build_ebgp(anm):
     ebgp_edges = [e for e in g_l3.edges() if e.src.asn != e.dst.asn]
     g_ebgp.add_edges_from(ebgp_edges, bidirectional=True, type='ebgp')
 
+IBGP_BATCH_SIZE = 10000  # sessions added to the bgp overlay per call
+
+
+def _cluster_index(nodes, attr):
+    """Returns {cluster: [node_id, ...]} for the nodes with attr set,
+    in the order of nodes"""
+
+    index = {}
+    for (node_id, clusters) in nodes:
+        cluster = clusters[attr]
+        if cluster is not None:
+            index.setdefault(cluster, []).append(node_id)
+    return index
+
+
+def _ibgp_sessions(peers, rrs, hrrs, rrcs):
+    """Returns generators of the (src_id, dst_id) over, up and down iBGP
+    sessions between the devices of an ASN, by ibgp_role.
+
+    The rr_cluster and hrr_cluster memberships are indexed up front, so
+    the sessions are generated per cluster rather than filtered from the
+    cross product of each pair of roles.
+
+    >>> over, up, down = _ibgp_sessions(
+    ...     [("p1", {'rr_cluster': None, 'hrr_cluster': None})],
+    ...     [("rr1", {'rr_cluster': "a", 'hrr_cluster': None})], [],
+    ...     [("c1", {'rr_cluster': "a", 'hrr_cluster': None}),
+    ...      ("c2", {'rr_cluster': "b", 'hrr_cluster': None})])
+    >>> list(over), list(up), list(down)
+    ([('p1', 'rr1'), ('rr1', 'p1')], [('c1', 'rr1')], [('rr1', 'c1')])
+
+    """
+
+    # devices as (node_id, {'rr_cluster': x, 'hrr_cluster': y})
+    rrs_by_rr = _cluster_index(rrs, 'rr_cluster')
+    hrrs_by_rr = _cluster_index(hrrs, 'rr_cluster')
+    hrrs_by_hrr = _cluster_index(hrrs, 'hrr_cluster')
+    rrcs_by_rr = _cluster_index(rrcs, 'rr_cluster')
+    # RRCs only use their hrr_cluster if they have no rr_cluster set
+    rrcs_by_hrr = _cluster_index(
+        [(node_id, clusters) for (node_id, clusters) in rrcs
+         if clusters['rr_cluster'] is None], 'hrr_cluster')
+
+    def same_cluster(sources, attr, index):
+        for (src, clusters) in sources:
+            for dst in index.get(clusters[attr], ()):
+                yield (src, dst)
+
+    def over_links():
+        # 1. Peers connect over to peers and RRs
+        # 2. RRs connect over to Peers and RRs
+        for (src, _) in peers + rrs:
+            for (dst, _) in peers + rrs:
+                yield (src, dst)
+
+    def up_links():
+        # 3a. HRRs connect up to RRs in the same rr_cluster
+        for pair in same_cluster(hrrs, 'rr_cluster', rrs_by_rr):
+            yield pair
+        # 4a. RRCs connect up to RRs in the same rr_cluster (regardless if
+        # RRC has hrr_cluster set)
+        for pair in same_cluster(rrcs, 'rr_cluster', rrs_by_rr):
+            yield pair
+        # 4b. RRCs connect up to HRRs in same hrr_cluster (providing RRC has
+        # no rr_cluster set)
+        for pair in same_cluster(
+                [(node_id, clusters) for (node_id, clusters) in rrcs
+                 if clusters['rr_cluster'] is None],
+                'hrr_cluster', hrrs_by_hrr):
+            yield pair
+
+    def down_links():
+        # 2c. RRs connect down to RRCs in same rr_cluster
+        for pair in same_cluster(rrs, 'rr_cluster', rrcs_by_rr):
+            yield pair
+        # 2d. RRs connect down to HRRs in the same rr_cluster
+        for pair in same_cluster(rrs, 'rr_cluster', hrrs_by_rr):
+            yield pair
+        # 3b. HRRs connect down to RRCs in same hrr_cluster (providing RRC
+        # has no rr_cluster set)
+        for pair in same_cluster(hrrs, 'hrr_cluster', rrcs_by_hrr):
+            yield pair
+
+    def without_self_links(links):
+        return ((src, dst) for (src, dst) in links if src != dst)
+
+    return (without_self_links(over_links()), without_self_links(up_links()),
+            without_self_links(down_links()))
+
+
+def _add_ibgp_edges(g_bgp, links, direction):
+    """Adds the (src_id, dst_id) links to g_bgp as iBGP sessions,
+    IBGP_BATCH_SIZE at a time"""
+
+    links = iter(links)
+    while True:
+        batch = [(src, dst, {'_ports': {}}) for (src, dst)
+                 in itertools.islice(links, IBGP_BATCH_SIZE)]
+        if not batch:
+            return
+        g_bgp.add_edges_from(batch, type='ibgp', direction=direction)
+
 #@call_log
 
 
@@ -140,10 +246,6 @@ def build_ibgp(anm):
         hrrs = [n for n in asn_devices if n.ibgp_role == "HRR"]
         rrcs = [n for n in asn_devices if n.ibgp_role == "RRC"]
 
-        over_links = []
-        up_links = []
-        down_links = []
-
         # 0. RRCs can only belong to either an rr_cluster or a hrr_cluster
         invalid_rrcs = [r for r in rrcs if r.rr_cluster is not None
                         and r.hrr_cluster is not None]
@@ -156,53 +258,16 @@ def build_ibgp(anm):
         # TODO: do we also want to warn for HRRs and RRs with no cluster set?
         # Do we also exclude these?
 
-        # 1. Peers:
-        # 1a. Peers connect over to peers
-        over_links += [(s, t) for s in peers for t in peers]
-        # 1b. Peers connect over to RRs
-        over_links += [(s, t) for s in peers for t in rrs]
-
-        # 2. RRs:
-        # 2a. RRs connect over to Peers
-        over_links += [(s, t) for s in rrs for t in peers]
-        # 2b. RRs connect over to RRs
-        over_links += [(s, t) for s in rrs for t in rrs]
-        # 2c. RRs connect down to RRCs in same rr_cluster
-        down_links += [(s, t) for s in rrs for t in rrcs
-                       if s.rr_cluster == t.rr_cluster != None]
-        # 2d. RRs connect down to HRRs in the same rr_cluster
-        down_links += [(s, t) for s in rrs for t in hrrs
-                       if s.rr_cluster == t.rr_cluster != None]
+        def clusters(nodes):
+            return [(n.node_id, {'rr_cluster': n.rr_cluster,
+                                 'hrr_cluster': n.hrr_cluster})
+                    for n in nodes]
 
-        # 3. HRRs
-        # 3a. HRRs connect up to RRs in the same rr_cluster
-        up_links += [(s, t) for s in hrrs for t in rrs
-                     if s.rr_cluster == t.rr_cluster != None]
-        # 3b. HRRs connect down to RRCs in same hrr_cluster (providing RRC has
-        # no rr_cluster set)
-        down_links += [(s, t) for s in hrrs for t in rrcs
-                       if s.hrr_cluster == t.hrr_cluster != None
-                       and t.rr_cluster is None]
-
-        # 4. RRCs
-        # 4a. RRCs connect up to RRs in the same rr_cluster (regardless if RRC
-        # has hrr_cluster set)
-        up_links += [(s, t) for s in rrcs for t in rrs
-                     if s.rr_cluster == t.rr_cluster != None]
-        # 3b. RRCs connect up to HRRs in same hrr_cluster (providing RRC has no
-        # rr_cluster set)
-        up_links += [(s, t) for s in rrcs for t in hrrs
-                     if s.hrr_cluster == t.hrr_cluster != None
-                     and s.rr_cluster is None]
-
-        # Remove self-links
-        over_links = [(s, t) for s, t in over_links if s != t]
-        up_links = [(s, t) for s, t in up_links if s != t]
-        down_links = [(s, t) for s, t in down_links if s != t]
-
-        g_bgp.add_edges_from(over_links, type='ibgp', direction='over')
-        g_bgp.add_edges_from(up_links, type='ibgp', direction='up')
-        g_bgp.add_edges_from(down_links, type='ibgp', direction='down')
+        over_links, up_links, down_links = _ibgp_sessions(
+            clusters(peers), clusters(rrs), clusters(hrrs), clusters(rrcs))
+        _add_ibgp_edges(g_bgp, over_links, 'over')
+        _add_ibgp_edges(g_bgp, up_links, 'up')
+        _add_ibgp_edges(g_bgp, down_links, 'down')
 
 #@call_log
 
@@ -218,8 +283,10 @@ def build_bgp(anm):
         return
 
     build_ebgp(anm)
-    build_ebgp_v4(anm)
-    build_ebgp_v6(anm)
+    scheduler.run(anm, [
+        Stage("build_ebgp_v4", build_ebgp_v4, ["ebgp", "phy"], ["ebgp_v4"]),
+        Stage("build_ebgp_v6", build_ebgp_v6, ["ebgp", "phy"], ["ebgp_v6"]),
+    ])
 
     """TODO: remove from here once compiler updated"""
     g_bgp = anm.add_overlay("bgp", directed=True)
@@ -258,5 +325,7 @@ def build_bgp(anm):
 
     # log.info("Building iBGP")
     build_ibgp(anm)
-    build_ibgp_v4(anm)
-    build_ibgp_v6(anm)
+    scheduler.run(anm, [
+        Stage("build_ibgp_v4", build_ibgp_v4, ["bgp", "phy"], ["ibgp_v4"]),
+        Stage("build_ibgp_v6", build_ibgp_v6, ["bgp", "phy"], ["ibgp_v6"]),
+    ])
@@ -1,21 +1,47 @@
 import autonetkit.log as log
 import autonetkit.ank as ank_utils
+from autonetkit.design import scheduler
+from autonetkit.design.scheduler import Stage
 
-from autonetkit.ank_utils import call_log
+from autonetkit.anm.shared_data import SharedDict
+from autonetkit.ank_utils import call_log, unwrap_graph
 
 # TODO: extract the repeated code and use the layer2  and layer3 graphs
 
 
-def build_igp(anm):
-    build_ospf(anm)
-    build_eigrp(anm)
-    build_isis(anm)
-    build_rip(anm)
+def _igp_used(protocol):
+    """Returns used(anm) for the stage of protocol: if any node runs it,
+    as otherwise the overlay is empty"""
+
+    def used(anm):
+        g_phy = anm['phy']
+        return bool(g_phy.data.enable_routing and g_phy.nodes(igp=protocol))
+    return used
 
-    # Build a protocol summary graph
+
+def build_igp(anm):
+    # each protocol only reads the shared overlays: can run concurrently.
+    # the less used protocols, and the summary, are built on first use
+    scheduler.run(anm, [
+        Stage("build_ospf", build_ospf, ["input", "layer3", "phy"], ["ospf"]),
+        Stage("build_eigrp", build_eigrp, ["input", "layer3", "phy"],
+              ["eigrp"], lazy=True, used=_igp_used("eigrp")),
+        Stage("build_isis", build_isis, ["input", "layer3", "phy", "ipv4"],
+              ["isis"], lazy=True, used=_igp_used("isis")),
+        Stage("build_rip", build_rip, ["input", "layer3", "phy"], ["rip"],
+              lazy=True, used=_igp_used("rip")),
+        Stage("build_igp_summary", build_igp_summary,
+              ["ospf", "eigrp", "isis", "rip"], ["igp"], lazy=True),
+    ])
+
+
+def build_igp_summary(anm):
+    """Build a protocol summary graph"""
     g_igp = anm.add_overlay("igp")
     igp_protocols = ["ospf", "eigrp", "isis", "rip"]
     for protocol in igp_protocols:
+        if not anm.has_overlay(protocol):
+            continue  # unused, see _igp_used
         g_protocol = anm[protocol]
         g_igp.add_nodes_from(g_protocol, igp=protocol)
         g_igp.add_edges_from(g_protocol.edges(), igp=protocol)
@@ -56,112 +82,170 @@ def build_ospf(anm):
     g_ospf.add_edges_from(g_l3.edges(), warn=False)
     ank_utils.copy_int_attr_from(g_l3, g_ospf, "multipoint")
 
-    # TODO: work out why this doesnt work
-    #ank_utils.copy_int_attr_from(g_in, g_ospf, "ospf_cost", dst_attr="cost",  type=int, default = 1)
-    for node in g_ospf:
-        for interface in node.physical_interfaces():
-            interface.cost = 1
-
     ank_utils.copy_attr_from(g_in, g_ospf, "ospf_area", dst_attr="area")
     #ank_utils.copy_edge_attr_from(g_in, g_ospf, "ospf_cost", dst_attr="cost",  type=int, default = 1)
     ank_utils.copy_attr_from(
         g_in, g_ospf, "custom_config_ospf", dst_attr="custom_config")
 
-    g_ospf.remove_edges_from([link for link in g_ospf.edges(
-    ) if link.src.asn != link.dst.asn])  # remove inter-AS links
+    graph = unwrap_graph(g_ospf)
+    asns = dict((router.node_id, router.asn) for router in g_ospf)
+    g_ospf.remove_edges_from([(src, dst) for (src, dst) in graph.edges()
+                              if asns[src] != asns[dst]])  # remove inter-AS links
 
     area_zero_ip = netaddr.IPAddress("0.0.0.0")
     area_zero_int = 0
     area_zero_ids = {area_zero_ip, area_zero_int}
     default_area = area_zero_int
-    if any(router.area == "0.0.0.0" for router in g_ospf):
+    if any(data.get('area') == "0.0.0.0" for data in graph.node.values()):
         # string comparison as hasn't yet been cast to IPAddress
         default_area = area_zero_ip
 
+    # router areas are needed before the edge areas: cast them first
     for router in g_ospf:
-        if not router.area or router.area == "None":
-            router.area = default_area
+        # TODO: work out why this doesnt work
+        #ank_utils.copy_int_attr_from(g_in, g_ospf, "ospf_cost", dst_attr="cost",  type=int, default = 1)
+        for interface in router.physical_interfaces():
+            interface.cost = 1
+
+        data = graph.node[router.node_id]
+        area = data.get('area')
+        if not area or area == "None":
+            data['area'] = default_area
             # check if 0.0.0.0 used anywhere, if so then use 0.0.0.0 as format
         else:
             try:
-                router.area = int(router.area)
+                data['area'] = int(area)
             except ValueError:
                 try:
-                    router.area = netaddr.IPAddress(router.area)
+                    data['area'] = netaddr.IPAddress(area)
                 except netaddr.core.AddrFormatError:
                     router.log.warning("Invalid OSPF area %s. Using default"
-                                       " of %s" % (router.area, default_area))
-                    router.area = default_area
+                                       " of %s" % (area, default_area))
+                    data['area'] = default_area
 
+    # then a single pass sets the edge areas and costs, maps them onto the
+    # interfaces, and sets the router areas and types. Edges are mapped
+    # in g_ospf.edges() order, from the first router they are listed from.
     # TODO: use interfaces throughout, rather than edges
-    for router in g_ospf:
-        # and set area on interface
-        for edge in router.edges():
-            if edge.area:
-                continue  # allocated (from other "direction", as undirected)
-            if router.area == edge.dst.area:
-                edge.area = router.area  # intra-area
+    position = dict((node_id, index) for (index, node_id)
+                    in enumerate(graph))
+    router_areas = []
+    for (node_id, data) in graph.nodes_iter(data=True):
+        area = data['area']
+        areas = set()
+        for (dst, edge_data) in graph.adj[node_id].items():
+            if position[dst] < position[node_id]:
+                areas.add(edge_data.get('area'))  # set from dst
                 continue
 
-            if router.area in area_zero_ids or edge.dst.area in area_zero_ids:
-                # backbone to other area
-                if router.area in area_zero_ids:
-                    # router in backbone, use other area
-                    edge.area = edge.dst.area
-                else:
-                    # router not in backbone, use its area
-                    edge.area = router.area
+            edge_area = _ospf_edge_area(area, graph.node[dst]['area'],
+                                        area_zero_ids)
+            if edge_area is not None:
+                edge_data['area'] = edge_area
+            if not edge_data.get('cost'):
+                edge_data['cost'] = 1
+            areas.add(edge_area)
 
-    for router in g_ospf:
-        areas = {edge.area for edge in router.edges()}
-        router.areas = list(areas)  # edges router participates in
+            # map area and cost onto interfaces
+            for (port_node_id, interface_id) in edge_data.get(
+                    '_ports', {}).items():
+                _set_interface_attrs(graph, port_node_id, interface_id, [
+                    ('cost', edge_data['cost']), ('area', edge_area),
+                    ('multipoint', edge_data.get('multipoint'))])
+
+        data['areas'] = list(areas)  # edges router participates in
+        router_areas.append(data['areas'])
 
         if len(areas) in area_zero_ids:
-            router.type = "backbone"  # no ospf edges (eg single node in AS)
+            data['type'] = "backbone"  # no ospf edges (eg single node in AS)
         elif len(areas) == 1:
             # single area: either backbone (all 0) or internal (all nonzero)
             if len(areas & area_zero_ids):
                 # intersection has at least one element -> router has area zero
-                router.type = "backbone"
+                data['type'] = "backbone"
             else:
-                router.type = "internal"
+                data['type'] = "internal"
 
         else:
             # multiple areas
             if len(areas & area_zero_ids):
                 # intersection has at least one element -> router has area zero
-                router.type = "backbone ABR"
-            elif router.area in area_zero_ids:
-                router.log.debug(
+                data['type'] = "backbone ABR"
+            elif area in area_zero_ids:
+                g_ospf.node(node_id).log.debug(
                     "Router belongs to area %s but has no area zero interfaces",
-                    router.area)
-                router.type = "backbone ABR"
+                    area)
+                data['type'] = "backbone ABR"
             else:
-                router.log.warning(
+                g_ospf.node(node_id).log.warning(
                     "spans multiple areas but is not a member of area 0")
-                router.type = "INVALID"
+                data['type'] = "INVALID"
 
-    if (any(area_zero_int in router.areas for router in g_ospf) and
-            any(area_zero_ip in router.areas for router in g_ospf)):
-        router.log.warning("Using both area 0 and area 0.0.0.0")
+        _set_interface_attrs(graph, node_id, 0, [('area', area),
+                                                 ('cost', 0)])
+        data['process_id'] = asns[node_id]
 
-    for link in g_ospf.edges():
-        if not link.cost:
-            link.cost = 1
+    if (any(area_zero_int in areas for areas in router_areas) and
+            any(area_zero_ip in areas for areas in router_areas)):
+        g_ospf.log.warning("Using both area 0 and area 0.0.0.0")
 
-    # map areas and costs onto interfaces
-    # TODO: later map them directly rather than with edges - part of
-    # the transition
-    for edge in g_ospf.edges():
-        for interface in edge.interfaces():
-            interface.cost = edge.cost
-            interface.area = edge.area
-            interface.multipoint = edge.multipoint
+    anm._invalidate_attr_index(overlay_id="ospf")
 
-    for router in g_ospf:
-        router.loopback_zero.area = router.area
-        router.loopback_zero.cost = 0
-        router.process_id = router.asn
+
+def _ospf_edge_area(area, dst_area, area_zero_ids):
+    """Returns the area of an OSPF edge between routers in area and dst_area,
+    or None if not allowed (two different non-zero areas)
+
+    >>> _ospf_edge_area(1, 1, {0})
+    1
+    >>> _ospf_edge_area(0, 2, {0}), _ospf_edge_area(2, 0, {0})
+    (2, 2)
+    >>> _ospf_edge_area(1, 2, {0}) is None
+    True
+
+    """
+
+    edge_area = None
+    for (src_area, other_area) in [(area, dst_area), (dst_area, area)]:
+        # as set from each router in turn: unless already set to a
+        # non-zero area (area zero can be either 0 or 0.0.0.0)
+        if edge_area:
+            break
+        if src_area == other_area:
+            edge_area = src_area  # intra-area
+        elif src_area in area_zero_ids:
+            edge_area = other_area  # router in backbone, use other area
+        elif other_area in area_zero_ids:
+            edge_area = src_area  # router not in backbone, use its area
+    return edge_area
+
+
+def _set_interface_attrs(graph, node_id, interface_id, attrs):
+    """Sets the (key, value) attrs on interface_id of node_id in graph"""
+
+    ports = graph.node[node_id]['_ports']
+    try:
+        interface = ports[interface_id]
+    except KeyError, e:
+        log.warning(e)
+        return
+    if isinstance(interface, SharedDict):
+        # copy on write, as for NmPort
+        interface = ports[interface_id] = dict(interface)
+    for (key, val) in attrs:
+        interface[key] = val
+
+
+def _set_igp_metrics(nm_graph, metric=1):
+    """Sets the default metric on the edges of nm_graph, and maps the edge
+    metric and multipoint onto the interfaces, in one pass over the edges"""
+
+    graph = unwrap_graph(nm_graph)
+    for (_, _, data) in graph.edges_iter(data=True):
+        data['metric'] = metric
+        for (node_id, interface_id) in data.get('_ports', {}).items():
+            _set_interface_attrs(graph, node_id, interface_id, [
+                ('metric', metric), ('multipoint', data.get('multipoint'))])
 
 #@call_log
 
@@ -227,13 +311,7 @@ def build_eigrp(anm):
     for node in g_eigrp:
         node.process_id = node.asn
 
-    for link in g_eigrp.edges():
-        link.metric = 1  # default
-
-    for edge in g_eigrp.edges():
-        for interface in edge.interfaces():
-            interface.metric = edge.metric
-            interface.multipoint = edge.multipoint
+    _set_igp_metrics(g_eigrp)
 
 #@call_log
 
@@ -274,13 +352,7 @@ def build_rip(anm):
     for node in g_rip:
         node.process_id = node.asn
 
-    for link in g_rip.edges():
-        link.metric = 1  # default
-
-    for edge in g_rip.edges():
-        for interface in edge.interfaces():
-            interface.metric = edge.metric
-            interface.multipoint = edge.multipoint
+    _set_igp_metrics(g_rip)
 
 
 def build_isis(anm):
@@ -315,10 +387,4 @@ def build_isis(anm):
     for node in g_isis.routers():
         node.process_id = node.asn
 
-    for link in g_isis.edges():
-        link.metric = 1  # default
-
-    for edge in g_isis.edges():
-        for interface in edge.interfaces():
-            interface.metric = edge.metric
-            interface.multipoint = edge.multipoint
+    _set_igp_metrics(g_isis)
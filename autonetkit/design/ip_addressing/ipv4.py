@@ -1,7 +1,7 @@
 import autonetkit.ank as ank_utils
+import autonetkit.ank_ip as ank_ip
 import autonetkit.config
 import autonetkit.log as log
-from netaddr import IPAddress
 from autonetkit.ank import sn_preflen_to_network
 
 SETTINGS = autonetkit.config.settings
@@ -83,13 +83,13 @@ def manual_ipv4_infrastructure_allocation(anm):
                 # TODO: copy interface allocate attribute across
                 continue
 
-            ip_address = netaddr.IPAddress(interface['input'
-                                                     ].ipv4_address)
+            ip_address = ank_ip.ip_address(interface['input'
+                                                    ].ipv4_address)
             prefixlen = interface['input'].ipv4_prefixlen
             interface.ip_address = ip_address
             interface.prefixlen = prefixlen
             cidr_string = '%s/%s' % (ip_address, prefixlen)
-            interface.subnet = netaddr.IPNetwork(cidr_string)
+            interface.subnet = ank_ip.ip_network(cidr_string)
 
     broadcast_domains = [d for d in g_ipv4 if d.broadcast_domain]
 
@@ -106,7 +106,6 @@ def manual_ipv4_infrastructure_allocation(anm):
         log.info("Unable to parse specified ipv4 infra subnets %s/%s")
 
     mismatched_interfaces = []
-    from netaddr import IPNetwork
     for coll_dom in broadcast_domains:
         if coll_dom.allocate is False:
             continue
@@ -118,7 +117,7 @@ def manual_ipv4_infrastructure_allocation(anm):
         connected_interfaces = [i for i in connected_interfaces
                                 if i.node.is_l3device()]
 
-        cd_subnets = [IPNetwork('%s/%s' % (i.subnet.network,
+        cd_subnets = [ank_ip.ip_network('%s/%s' % (i.subnet.network,
                                            i.prefixlen)) for i in connected_interfaces
                       if i['ip'].allocate is not False]
 
@@ -180,7 +179,8 @@ def manual_ipv4_loopback_allocation(anm):
 
     for l3_device in g_ipv4.l3devices():
         try:
-            l3_device.loopback = IPAddress(l3_device['input'].loopback_v4)
+            l3_device.loopback = ank_ip.ip_address(
+                l3_device['input'].loopback_v4)
         except netaddr.AddrFormatError:
             log.debug("Unable to parse IP address %s on %s",
                       l3_device['input'].loopback_v6, l3_device)
@@ -245,6 +245,12 @@ def build_ipv4(anm, infrastructure=True):
     (infra_block, loopback_block, vrf_loopback_block) = \
         extract_ipv4_blocks(anm)
 
+    ip_settings = SETTINGS['IP Addressing']
+    ledger = None
+    if ip_settings['ledger']:
+        # keep the allocations of previous builds
+        ledger = ipv4.IpLedger.load()
+
 # TODO: don't present if using manual allocation
     if any(i for n in g_ip.nodes() for i in
            n.loopback_interfaces() if not i.is_loopback_zero):
@@ -300,7 +306,8 @@ def build_ipv4(anm, infrastructure=True):
     if manual_alloc_ipv4_infrastructure:
         manual_ipv4_infrastructure_allocation(anm)
     else:
-        ipv4.allocate_infra(g_ipv4, infra_block)
+        ipv4.allocate_infra(g_ipv4, infra_block, ledger=ledger,
+                            cd_slack=ip_settings['cd_slack'])
 
     if g_in.data.alloc_ipv4_loopbacks is False:
         manual_ipv4_loopback_allocation(anm)
@@ -313,12 +320,17 @@ def build_ipv4(anm, infrastructure=True):
             log.warning(
                 "Using automatic IPv4 loopback allocation. IPv4 loopback addresses specified on nodes %s will be ignored." % allocated)
             # TODO: if set is > 50% of nodes then list those that are NOT set
-        ipv4.allocate_loopbacks(g_ipv4, loopback_block)
+        ipv4.allocate_loopbacks(g_ipv4, loopback_block, ledger=ledger,
+                                group_slack=ip_settings['group_slack'])
 
     # TODO: need to also support secondary_loopbacks for IPv6
     # TODO: only call if secondaries are set
 
-    ipv4.allocate_secondary_loopbacks(g_ipv4, vrf_loopback_block)
+    ipv4.allocate_secondary_loopbacks(g_ipv4, vrf_loopback_block,
+                                      ledger=ledger,
+                                      group_slack=ip_settings['group_slack'])
+    if ledger is not None:
+        ledger.save()
 
     # TODO: replace this with direct allocation to interfaces in ip alloc plugin
     # TODO: add option for nonzero interfaces on node - ie
@@ -328,7 +340,7 @@ def build_ipv4(anm, infrastructure=True):
 
     for node in g_ipv4.routers():
         node.loopback_zero.ip_address = node.loopback
-        node.loopback_zero.subnet = netaddr.IPNetwork("%s/32" % node.loopback)
+        node.loopback_zero.subnet = ank_ip.ip_network(node.loopback, 32)
         for interface in node.loopback_interfaces():
             if not interface.is_loopback_zero:
                 # TODO: fix this inconsistency elsewhere
@@ -1,8 +1,8 @@
 import autonetkit.ank as ank_utils
+import autonetkit.ank_ip as ank_ip
 import autonetkit.config
 import autonetkit.log as log
 from autonetkit.ank import sn_preflen_to_network
-from netaddr import IPAddress
 
 SETTINGS = autonetkit.config.settings
 
@@ -18,7 +18,8 @@ def manual_ipv6_loopback_allocation(anm):
 
     for l3_device in g_ipv6.l3devices():
         try:
-            l3_device.loopback = IPAddress(l3_device['input'].loopback_v6)
+            l3_device.loopback = ank_ip.ip_address(
+                l3_device['input'].loopback_v6)
         except netaddr.AddrFormatError:
             log.debug("Unable to parse IP address %s on %s",
                 l3_device['input'].loopback_v6, l3_device)
@@ -129,13 +130,13 @@ def manual_ipv6_infrastructure_allocation(anm):
                 continue  # unbound interface
             if not interface['ipv6'].is_bound:
                 continue
-            ip_address = netaddr.IPAddress(interface['input'
-                                                     ].ipv6_address)
+            ip_address = ank_ip.ip_address(interface['input'
+                                                    ].ipv6_address)
             prefixlen = interface['input'].ipv6_prefixlen
             interface.ip_address = ip_address
             interface.prefixlen = prefixlen
             cidr_string = '%s/%s' % (ip_address, prefixlen)
-            interface.subnet = netaddr.IPNetwork(cidr_string)
+            interface.subnet = ank_ip.ip_network(cidr_string)
 
     broadcast_domains = [d for d in g_ipv6 if d.broadcast_domain]
 
@@ -151,13 +152,12 @@ def manual_ipv6_infrastructure_allocation(anm):
     except Exception, e:
         log.info("Unable to parse specified ipv4 infra subnets %s/%s")
 
-    from netaddr import IPNetwork
     mismatched_interfaces = []
 
     for coll_dom in broadcast_domains:
         connected_interfaces = [edge.dst_int for edge in
                                 coll_dom.edges()]
-        cd_subnets = [IPNetwork('%s/%s' % (i.subnet.network,
+        cd_subnets = [ank_ip.ip_network('%s/%s' % (i.subnet.network,
                                            i.prefixlen)) for i in connected_interfaces]
 
         if global_infra_block is not None:
@@ -320,7 +320,7 @@ def build_ipv6(anm):
     for node in g_ipv6.routers():
         # TODO: test this code
         node.loopback_zero.ip_address = node.loopback
-        node.loopback_zero.subnet = netaddr.IPNetwork("%s/32" % node.loopback)
+        node.loopback_zero.subnet = ank_ip.ip_network(node.loopback, 32)
         for interface in node.loopback_interfaces():
             if not interface.is_loopback_zero:
                 # TODO: fix this inconsistency elsewhere
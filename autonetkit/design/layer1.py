@@ -1,4 +1,5 @@
 import autonetkit.ank as ank_utils
+import autonetkit.config as config
 import autonetkit.log as log
 
 
@@ -28,6 +29,12 @@ def build_layer1_conn(anm):
     g_l1_conn.add_edges_from(g_l1.edges())
 
     collision_domains = g_l1_conn.nodes(collision_domain=True)
+    if config.settings['General']['multipoint_hubs']:
+        # linear in the size of each collision domain: the edges through
+        # the hubs are formed on query, and marked multipoint
+        ank_utils.hub_nodes(g_l1_conn, collision_domains)
+        return
+
     exploded_edges = ank_utils.explode_nodes(g_l1_conn, collision_domains)
 
     # explode each seperately?
@@ -70,21 +77,8 @@ def split_ptp(anm):
     else:
         co_ords_overlay = g_phy  # source from phy overlay
 
-    for node in split_created_nodes:
-        node['graphics'].x = ank_utils.neigh_average(g_l1, node, 'x',
-                                                     co_ords_overlay) + 0.1
-
-        # temporary fix for gh-90
-
-        node['graphics'].y = ank_utils.neigh_average(g_l1, node, 'y',
-                                                     co_ords_overlay) + 0.1
-
-        # temporary fix for gh-90
-
-        asn = ank_utils.neigh_most_frequent(
-            g_l1, node, 'asn', g_phy)  # arbitrary choice
-        node['graphics'].asn = asn
-        node.asn = asn  # need to use asn in IP overlay for aggregating subnets
+    # position and asn from the neighbors
+    ank_utils.neigh_graphics(g_l1, split_created_nodes, co_ords_overlay, g_phy)
 
 
 # TODO: build layer 1 connectivity graph
@@ -1,4 +1,5 @@
 import autonetkit.ank as ank_utils
+import autonetkit.config as config
 import autonetkit.log as log
 
 
@@ -41,6 +42,10 @@ def build_layer2_conn(anm):
     g_l2_conn.add_edges_from(g_l2.edges())
 
     broadcast_domains = g_l2_conn.nodes(broadcast_domain=True)
+    if config.settings['General']['multipoint_hubs']:
+        ank_utils.hub_nodes(g_l2_conn, broadcast_domains)  # see layer1
+        return
+
     exploded_edges = ank_utils.explode_nodes(g_l2_conn, broadcast_domains)
 
     # explode each seperately?
@@ -51,17 +56,47 @@ def build_layer2_conn(anm):
 
 
 def check_layer2(anm):
-    """Sanity checks on topology"""
+    """Sanity checks on topology.
+    Only reads the layer2 and phy overlays, so can also run as a scheduler
+    Stage with no outputs, eg alongside other checks in a parallel wave
+    """
     from collections import defaultdict
     g_l2 = anm['layer2']
-
-    # check for igp and ebgp on same switch
+    graph = g_l2._graph
+    phy_nodes = anm.overlay_nx_graphs['phy'].node
+    hubs = anm._hub_ids('layer2')
+
+    def neigh_asn(node_id):
+        # as NmNode.asn: set in layer2, otherwise from phy
+        data = graph.node[node_id]
+        if 'asn' in data:
+            return data['asn']
+        return phy_nodes.get(node_id, {}).get('asn')
+
+    parallel = []  # reported after the IGP/eBGP checks
     for switch in sorted(g_l2.switches()):
+        # one pass over the adjacency of the switch: edges to each neighbor
+        if hubs:
+            # neighbors through multipoint hubs, as switch.neighbors()
+            peers = [(dst, hub is None) for (dst, _, hub, _)
+                     in switch._multipoint_peers(hubs)]
+        elif graph.is_multigraph():
+            peers = [(dst, True) for (dst, keys)
+                     in graph.adj[switch.node_id].items() for _ in keys]
+        else:
+            peers = [(dst, True) for dst in graph.adj[switch.node_id]]
+
+        edge_counts = {}
+        for (dst, direct) in peers:
+            edge_counts[dst] = edge_counts.get(dst, 0) + direct
+
+        # check for igp and ebgp on same switch
         neigh_asns = defaultdict(int)
-        for neigh in switch.neighbors():
-            if neigh.asn is None:
+        for neigh in edge_counts:
+            asn = neigh_asn(neigh)
+            if asn is None:
                 continue  # don't add if not set
-            neigh_asns[neigh.asn] += 1
+            neigh_asns[asn] += 1
 
         # IGP if two or more neighbors share the same ASN
         is_igp = any(asns > 1 for asns in neigh_asns.values())
@@ -71,14 +106,16 @@ def check_layer2(anm):
             log.warning("Switch %s contains both IGP and eBGP neighbors",
                         switch)
 
-    # check for multiple links from nodes to switch
-    for switch in sorted(g_l2.switches()):
-        for neighbor in sorted(switch.neighbors()):
-            edges = g_l2.edges(switch, neighbor)
-            if len(edges) > 1:
-                # more than one edge between the (src, dst) pair -> parallel
-                log.warning("Multiple edges (%s) between %s and device %s",
-                            len(edges), switch, neighbor)
+        # check for multiple links from nodes to switch
+        multiple = [g_l2.node(neigh) for (neigh, count) in edge_counts.items()
+                    if count > 1]
+        for neighbor in sorted(multiple):
+            # more than one edge between the (src, dst) pair -> parallel
+            parallel.append((edge_counts[neighbor.node_id], switch, neighbor))
+
+    for (count, switch, neighbor) in parallel:
+        log.warning("Multiple edges (%s) between %s and device %s",
+                    count, switch, neighbor)
 
 
 def build_layer2_broadcast(anm):
@@ -109,21 +146,8 @@ def build_layer2_broadcast(anm):
     else:
         co_ords_overlay = g_phy  # source from phy overlay
 
-    for node in split_created_nodes:
-        node['graphics'].x = ank_utils.neigh_average(g_l2_bc, node, 'x',
-                                                     co_ords_overlay) + 0.1
-
-        # temporary fix for gh-90
-
-        node['graphics'].y = ank_utils.neigh_average(g_l2_bc, node, 'y',
-                                                     co_ords_overlay) + 0.1
-
-        # temporary fix for gh-90
-
-        asn = ank_utils.neigh_most_frequent(
-            g_l2_bc, node, 'asn', g_phy)  # arbitrary choice
-        node['graphics'].asn = asn
-        node.asn = asn  # need to use asn in IP overlay for aggregating subnets
+    # position and asn from the neighbors
+    ank_utils.neigh_graphics(g_l2_bc, split_created_nodes, co_ords_overlay, g_phy)
 
     # also allocate an ASN for virtual switches
     vswitches = [n for n in g_l2_bc.nodes()
@@ -251,7 +275,7 @@ def build_vlans(anm):
     managed_switches = [n for n in g_l2.switches()
                         if n.device_subtype == "managed"]
 
-    g_vtp.add_nodes_from(g_l1_conn)
+    g_vtp.add_nodes_from(n for n in g_l1_conn if not n.multipoint_hub)
     g_vtp.add_edges_from(g_l1_conn.edges())
 
     # remove anything not a managed_switch or connected to a managed_switch
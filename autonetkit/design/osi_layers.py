@@ -14,7 +14,8 @@ def build_layer3(anm):
     g_in = anm['input']
     gl2_conn = anm['layer2_conn']
     g_l3 = anm.add_overlay("layer3")
-    g_l3.add_nodes_from(gl2_conn, retain=['label'])
+    g_l3.add_nodes_from((n for n in gl2_conn if not n.multipoint_hub),
+                        retain=['label'])
     g_l3.add_nodes_from(g_in.switches(), retain=['asn'])
     g_l3.add_edges_from(gl2_conn.edges())
 
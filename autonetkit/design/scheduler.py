@@ -0,0 +1,235 @@
+"""Dependency-aware scheduling of design rule stages.
+
+Each Stage declares the overlays it reads (inputs) and the overlays it
+creates or modifies (outputs). The declarations are recorded in the
+_dependencies overlay, as for the overlays derived in add_nodes_from.
+
+A stage depends on the earlier stages that write an overlay it reads or
+writes, or that read an overlay it writes. Stages are grouped into waves
+of independent stages.
+
+By default (design_workers = 1 in [General]) stages run in sequence, in
+declared order. With more workers, the stages of a wave run concurrently
+in forked worker processes. Python threads would serialise on the GIL.
+Each worker returns its output overlays, which are merged back into the
+anm in declared order. Writes a stage makes to overlays that aren't in its
+outputs would be lost in this mode, so outputs must list every overlay the
+stage modifies: a worker raises UndeclaredOutput if the node, edge or node
+attribute counts of any other overlay change.
+
+A stage can also declare the input attributes (node, edge and graph data
+keys of the input overlay) it reads, as attrs. IncrementalBuild (see
+autonetkit.incremental) reruns a stage when its attrs or input overlays
+change, and otherwise reuses its outputs from the previous build.
+
+A lazy stage isn't run, but registered as the producer of its outputs
+(see NetworkModel.add_producer): it runs the first time one of its overlays
+is requested, eg by a compiler. Lazy stages must only create their outputs,
+as they run after the later stages. A lazy stage can give a used(anm)
+check, so that has_overlay() reports its outputs as absent rather than
+building them when they would be empty.
+
+>>> stages = [Stage("ospf", None, ["layer3"], ["ospf"]),
+...           Stage("isis", None, ["layer3", "ipv4"], ["isis"]),
+...           Stage("igp", None, ["ospf", "isis"], ["igp"])]
+>>> [[stage.name for stage in wave] for wave in waves(stages)]
+[['ospf', 'isis'], ['igp']]
+
+"""
+
+import os
+
+import networkx as nx
+
+import autonetkit.config as config
+import autonetkit.log as log
+import autonetkit.profiling as profiling
+from autonetkit.exception import AutoNetkitException
+
+
+class UndeclaredOutput(AutoNetkitException):
+
+    """A stage modified an overlay that isn't in its outputs"""
+
+
+class Stage(object):
+
+    """A design rule func(anm), reading the inputs overlays,
+    and creating or modifying the outputs overlays"""
+
+    def __init__(self, name, func, inputs=(), outputs=(), lazy=False,
+                 used=None, attrs=None):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.lazy = lazy
+        self.used = used  # for lazy stages, see NetworkModel.add_producer
+        # input attributes read, None if unknown (any change affects)
+        self.attrs = None if attrs is None else set(attrs)
+
+    def __repr__(self):
+        return "Stage(%s)" % self.name
+
+    def depends_on(self, other):
+        """If this stage must run after other (declared before it)"""
+
+        outputs = set(self.outputs)
+        return bool(set(other.outputs) & (set(self.inputs) | outputs)
+                    or set(other.inputs) & outputs)
+
+
+def waves(stages):
+    """Groups stages into lists of independent stages, in run order.
+    Stages keep their declared order within a wave"""
+
+    levels = []
+    for (index, stage) in enumerate(stages):
+        level = 0
+        for other_index in range(index):
+            if stage.depends_on(stages[other_index]):
+                level = max(level, levels[other_index] + 1)
+        levels.append(level)
+
+    result = [[] for _ in range(max(levels) + 1)] if levels else []
+    for (stage, level) in zip(stages, levels):
+        result[level].append(stage)
+    return result
+
+
+def _producer(stage):
+    """Returns func(anm) running stage, for NetworkModel.add_producer"""
+
+    def produce(anm):
+        with profiling.stage(stage.name, anm):
+            stage.func(anm)
+    return produce
+
+
+def record_dependencies(anm, stages):
+    """Records the inputs -> outputs of stages in the _dependencies overlay.
+    Edges that would close a cycle, eg build_layer2 marking phy from
+    layer1, aren't recorded: the overlay is kept acyclic for its layout in
+    ank_json"""
+
+    g_deps = anm['_dependencies']._graph
+    for stage in stages:
+        for overlay_id in stage.inputs + stage.outputs:
+            if overlay_id not in g_deps:
+                g_deps.add_node(overlay_id)
+        for src in stage.inputs:
+            for dst in stage.outputs:
+                if (src != dst and not g_deps.has_edge(src, dst)
+                        and not nx.has_path(g_deps, dst, src)):
+                    g_deps.add_edge(src, dst)
+
+
+# state for the forked workers, set before the pool is created
+_worker_anm = None
+_worker_stages = None
+_in_worker = False
+
+
+def _signature(anm, exclude):
+    """Cheap signature of the overlays not in exclude: the graph, and its
+    node, edge and node attribute counts"""
+
+    return dict((overlay_id, (id(graph), graph.number_of_nodes(),
+                              graph.number_of_edges(),
+                              sum(len(data) for data in graph.node.values())))
+                for (overlay_id, graph) in anm.overlay_nx_graphs.items()
+                if overlay_id not in exclude)
+
+
+def _run_in_worker(index):
+    """Runs stage index of _worker_stages, in a worker process.
+    Returns the output overlays, new _dependencies edges and timing"""
+
+    global _in_worker
+    _in_worker = True  # stages run in sequence within a worker
+    anm = _worker_anm
+    stage = _worker_stages[index]
+    g_deps = anm['_dependencies']._graph
+    deps_before = set(g_deps.edges())
+    # pending overlays can be built by reading them, see add_producer
+    exclude = set(stage.outputs + anm.pending_overlays() + ['_dependencies'])
+    before = _signature(anm, exclude)
+
+    with profiling.stage(stage.name, anm):
+        stage.func(anm)
+
+    after = _signature(anm, exclude)
+    changed = sorted(overlay_id for overlay_id in set(before) | set(after)
+                     if before.get(overlay_id) != after.get(overlay_id))
+    if changed:
+        raise UndeclaredOutput("Stage %s modified %s, not in its outputs %s"
+                               % (stage.name, ", ".join(changed),
+                                  stage.outputs))
+
+    overlays = [(overlay_id, anm.overlay_nx_graphs[overlay_id])
+                for overlay_id in stage.outputs
+                if overlay_id in anm.overlay_nx_graphs]
+    deps = [edge for edge in g_deps.edges() if edge not in deps_before]
+    return (overlays, deps, profiling.report()['stages'][-1])
+
+
+def _run_wave(anm, wave, workers):
+    """Runs the stages of wave in worker processes, and merges the results"""
+
+    global _worker_anm, _worker_stages
+    import multiprocessing
+
+    _worker_anm = anm
+    _worker_stages = wave
+    pool = multiprocessing.Pool(min(workers, len(wave)))
+    try:
+        results = pool.map(_run_in_worker, range(len(wave)))
+    finally:
+        pool.close()
+        pool.join()
+        _worker_anm = _worker_stages = None
+
+    g_deps = anm['_dependencies']._graph
+    for (stage, (overlays, deps, record)) in zip(wave, results):
+        for (overlay_id, graph) in overlays:
+            anm._replace_overlay(overlay_id, graph)
+        for (src, dst) in deps:
+            if (not g_deps.has_edge(src, dst)
+                    and not nx.has_path(g_deps, dst, src)):
+                g_deps.add_edge(src, dst)
+        profiling.add_stage(record, [overlay_id for (overlay_id, _)
+                                     in overlays])
+
+
+def run(anm, stages, workers=None):
+    """Runs stages on anm, with up to workers processes
+    (default from design_workers in [General])"""
+
+    if workers is None:
+        workers = config.settings['General']['design_workers']
+
+    record_dependencies(anm, stages)
+
+    if not _in_worker:
+        # in a worker, run lazy stages so their overlays are returned
+        for stage in stages:
+            if stage.lazy:
+                anm.add_producer(stage.outputs, _producer(stage),
+                                 stage.used)
+        stages = [stage for stage in stages if not stage.lazy]
+
+    if workers <= 1 or _in_worker or not hasattr(os, 'fork'):
+        for stage in stages:
+            with profiling.stage(stage.name, anm):
+                stage.func(anm)
+        return
+
+    for wave in waves(stages):
+        if len(wave) == 1:
+            with profiling.stage(wave[0].name, anm):
+                wave[0].func(anm)
+            continue
+
+        log.debug("Running stages %s in parallel" % ", ".join(
+            stage.name for stage in wave))
+        _run_wave(anm, wave, workers)
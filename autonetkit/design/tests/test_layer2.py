@@ -0,0 +1,60 @@
+import autonetkit
+import autonetkit.ank as ank_utils
+from autonetkit.design.layer2 import check_layer2
+from mock import patch
+
+
+def build_switches():
+    """Two switches with parallel edges and mixed ASN neighbors.
+    r4 and r5 are attached to sw1 through the multipoint hub h1, and r2
+    both directly and through h1"""
+    anm = autonetkit.NetworkModel()
+    g_phy = anm['phy']
+    asns = {"r1": 1, "r2": 1, "r3": 2, "r4": 3, "r5": 1, "r6": 2}
+    g_phy.add_nodes_from(sorted(asns), device_type="router")
+    for label, asn in asns.items():
+        g_phy.node(label).asn = asn
+    g_phy.add_nodes_from(["sw1", "sw2"], device_type="switch", asn=1)
+    g_phy.add_nodes_from(["h1"], device_type="hub")
+
+    g_l2 = anm.add_overlay("layer2", multi_edge=True)
+    g_l2.add_nodes_from(g_phy)
+    g_l2.add_edges_from([("sw1", "r1"), ("sw1", "r1"), ("sw1", "r2"),
+                         ("sw1", "r3"), ("sw1", "h1"), ("h1", "r2"),
+                         ("h1", "r4"), ("h1", "r5"),
+                         ("sw2", "r3"), ("sw2", "r3"), ("sw2", "r3"),
+                         ("sw2", "r6"), ("sw2", "r1")])
+    ank_utils.hub_nodes(g_l2, g_l2.node("h1"))
+    return anm
+
+
+def logged_warnings(anm):
+    with patch("autonetkit.design.layer2.log") as mock_log:
+        check_layer2(anm)
+    return [args[0] % args[1:]
+            for (args, _) in mock_log.warning.call_args_list]
+
+
+def test_check_layer2():
+    anm = build_switches()
+    # the parallel edges are reported after the IGP/eBGP checks, and the
+    # edges through h1 aren't parallel to the direct sw1-r2 edge
+    assert logged_warnings(anm) == [
+        "Switch sw1 contains both IGP and eBGP neighbors",
+        "Switch sw2 contains both IGP and eBGP neighbors",
+        "Multiple edges (2) between sw1 and device r1",
+        "Multiple edges (3) between sw2 and device r3",
+    ]
+
+
+def test_check_layer2_single_asn():
+    anm = build_switches()
+    g_l2 = anm['layer2']
+    # sw2 now only has IGP neighbors (r3 and r6), and sw1 only eBGP
+    g_l2.remove_edges_from([("sw2", "r1")])
+    anm['phy'].node("r2").asn = 4
+    anm['phy'].node("r5").asn = 5
+    assert logged_warnings(anm) == [
+        "Multiple edges (2) between sw1 and device r1",
+        "Multiple edges (3) between sw2 and device r3",
+    ]
@@ -0,0 +1,80 @@
+import netaddr
+
+import autonetkit
+import autonetkit.design.igp
+from autonetkit.design.osi_layers import build_layer1, build_layer2, build_layer3
+
+
+def build_ospf(areas):
+    """Builds OSPF on the house topology (r1-r3 in AS1, r4-r5 in AS2),
+    with the ospf_area of each router from areas"""
+    anm = autonetkit.topos.house()
+    for label, area in areas.items():
+        anm['input'].node(label).ospf_area = area
+    build_layer1(anm)
+    build_layer2(anm)
+    build_layer3(anm)
+    anm['phy'].data.enable_routing = True
+    for node in anm['phy']:
+        node.igp = "ospf"
+
+    autonetkit.design.igp.build_ospf(anm)
+    return anm['ospf']
+
+
+def edge_areas(g_ospf):
+    """Returns {(src, dst): (edge area, src_int area, dst_int area)}"""
+    return dict(((str(edge.src), str(edge.dst)),
+                 (edge.area, edge.src_int.area, edge.dst_int.area))
+                for edge in g_ospf.edges())
+
+
+def test_ospf_areas():
+    # 0 is the default, cast to 0.0.0.0 as it is used by r4
+    g_ospf = build_ospf({"r1": 0, "r2": None, "r3": 1,
+                         "r4": "0.0.0.0", "r5": 2})
+    zero = netaddr.IPAddress("0.0.0.0")
+
+    expected = {
+        ("r1", "r2"): (zero, zero, zero),
+        ("r1", "r3"): (1, 1, 1),
+        ("r2", "r3"): (1, 1, 1),
+        ("r4", "r5"): (2, 2, 2),
+    }
+    assert edge_areas(g_ospf) == expected
+
+    expected = {
+        "r1": (zero, "backbone ABR"),
+        "r2": (zero, "backbone ABR"),
+        "r3": (1, "internal"),
+        "r4": (zero, "internal"),
+        "r5": (2, "internal"),
+    }
+    assert dict((str(n), (n.area, n.type)) for n in g_ospf) == expected
+    for node in g_ospf:
+        assert node.loopback_zero.area == node.area
+
+
+def test_ospf_areas_int():
+    # without 0.0.0.0, area zero is kept as 0
+    g_ospf = build_ospf({"r1": 0, "r2": "0", "r3": 0,
+                         "r4": 3, "r5": None})
+
+    expected = {
+        ("r1", "r2"): (0, 0, 0),
+        ("r1", "r3"): (0, 0, 0),
+        ("r2", "r3"): (0, 0, 0),
+        ("r4", "r5"): (3, 3, 3),
+    }
+    assert edge_areas(g_ospf) == expected
+
+    expected = {
+        "r1": (0, "backbone"),
+        "r2": (0, "backbone"),
+        "r3": (0, "backbone"),
+        "r4": (3, "internal"),
+        "r5": (0, "internal"),
+    }
+    assert dict((str(n), (n.area, n.type)) for n in g_ospf) == expected
+    for node in g_ospf:
+        assert node.loopback_zero.area == node.area
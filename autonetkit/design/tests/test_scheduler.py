@@ -0,0 +1,105 @@
+import autonetkit
+import autonetkit.design.igp
+from autonetkit.design import scheduler
+from autonetkit.design.scheduler import Stage
+
+
+def build_house(igp):
+    anm = autonetkit.topos.house()
+    from autonetkit.design.osi_layers import (build_layer1, build_layer2,
+                                              build_layer3)
+    build_layer1(anm)
+    build_layer2(anm)
+    build_layer3(anm)
+    anm['phy'].data.enable_routing = True
+    for node in anm['phy']:
+        node.igp = igp
+    return anm
+
+
+def igp_stages():
+    inputs = ["input", "layer3", "phy"]
+    return [Stage("build_ospf", autonetkit.design.igp.build_ospf, inputs,
+                  ["ospf"]),
+            Stage("build_rip", autonetkit.design.igp.build_rip, inputs,
+                  ["rip"])]
+
+
+def test_waves():
+    stages = igp_stages()
+    stages.append(Stage("summary", None, ["ospf", "rip"], ["igp"]))
+    stages.append(Stage("ospf_costs", None, ["phy"], ["ospf"]))
+    waves = scheduler.waves(stages)
+    assert([[stage.name for stage in wave] for wave in waves] ==
+           [["build_ospf", "build_rip"], ["summary"], ["ospf_costs"]])
+
+
+def test_run():
+    results = []
+    for workers in [1, 2]:
+        anm = build_house("ospf")
+        scheduler.run(anm, igp_stages(), workers=workers)
+        g_ospf = anm['ospf']
+        edges = {tuple(sorted([str(e.src), str(e.dst)]))
+                 for e in g_ospf.edges()}
+        results.append(edges)
+
+        assert(len(g_ospf) == 5)
+        assert(g_ospf.node("r1").loopback_zero.area == 0)
+        assert(len(anm['rip']) == 0)
+        g_deps = anm['_dependencies']._graph
+        assert(g_deps.has_edge("layer3", "ospf"))
+        assert(g_deps.has_edge("phy", "rip"))
+
+    assert(results[0] == results[1])
+
+
+def test_lazy():
+    anm = build_house("rip")
+    stages = igp_stages()
+    stages[1].lazy = True
+    scheduler.run(anm, stages)
+    assert("ospf" in anm.overlays())
+    assert("rip" not in anm.overlays())
+    assert(anm.pending_overlays() == ["rip"])
+    assert(anm['_dependencies']._graph.has_edge("phy", "rip"))
+
+    # built on first use
+    rip_node = anm['phy'].node("r1")['rip']
+    assert("rip" in anm.overlays())
+    assert(rip_node in anm['rip'])
+    assert(len(anm['rip']) == 5)
+    assert(anm.pending_overlays() == [])
+
+
+def test_check_stage():
+    # read-only checks have no outputs, and run alongside other stages
+    from autonetkit.design.layer2 import check_layer2
+    anm = build_house("ospf")
+    stages = igp_stages()
+    stages.append(Stage("check_layer2", check_layer2, ["layer2", "phy"]))
+    assert(len(scheduler.waves(stages)) == 1)
+    scheduler.run(anm, stages, workers=2)
+    assert(len(anm['ospf']) == 5)
+
+
+def test_undeclared_output():
+    # in parallel, writes outside the outputs would be lost: fail instead
+    def build_rip(anm):
+        autonetkit.design.igp.build_rip(anm)
+        anm['phy'].remove_nodes_from(["r5"])
+
+    anm = build_house("rip")
+    stages = igp_stages()
+    stages[1] = Stage("build_rip", build_rip, stages[1].inputs, ["rip"])
+    try:
+        scheduler.run(anm, stages, workers=2)
+    except scheduler.UndeclaredOutput, e:
+        assert("build_rip modified phy" in str(e))
+    else:
+        assert False, "UndeclaredOutput not raised"
+
+    # in sequence, the write is kept
+    anm = build_house("rip")
+    scheduler.run(anm, stages, workers=1)
+    assert(len(anm['phy']) == 4)
@@ -0,0 +1,640 @@
+"""Incremental rebuilds for --monitor mode.
+
+The new input graph is diffed against the previous one (graph_diff), and
+only the work that depends on what changed is redone:
+
+* build: each design stage (build_network.design_stages) declares the
+  overlays it reads and writes, as recorded in the _dependencies overlay,
+  and the input attributes it reads. A stage reruns if an attribute it
+  reads changed, or if it reads an overlay that a rerun stage writes, or
+  that depends on one in _dependencies. Stages that write the same overlay
+  rerun together. The other stages are skipped: their output overlays are
+  reused from the previous build, and their writes to the input overlay
+  are replayed. Adding or removing nodes or edges reruns every stage that
+  reads the input overlay.
+* compile: devices are recompiled if their data, or the data of a
+  neighbor in any overlay, differs from the previous build. For the other
+  devices, the changes the device compiler made in the previous compile
+  are copied, if the device data before the device compiler is unchanged
+  (see DeviceCache). The platform compilers still run for all devices.
+* render: only the devices whose compiled data changed are rendered.
+* an unchanged input graph (eg the file was saved without edits) skips the
+  rebuild entirely.
+
+So a change to an attribute that no stage reads, such as ospf_cost on an
+edge (design/igp.py doesn't copy it to the ospf overlay), reruns no
+design stage and recompiles just the devices of the edge.
+
+>>> import networkx as nx
+>>> old = nx.Graph()
+>>> old.add_edge("r1", "r2", ospf_cost=1)
+>>> new = old.copy()
+>>> new["r1"]["r2"]["ospf_cost"] = 10
+>>> diff = graph_diff(old, new)
+>>> diff['edges_changed'], changed_attrs(old, new, diff)
+([('r1', 'r2')], set(['ospf_cost']))
+>>> new.add_node("r3")
+>>> diff = graph_diff(old, new)
+>>> diff['nodes_added'], changed_attrs(old, new, diff)
+(['r3'], None)
+
+"""
+
+import copy
+import hashlib
+import json
+import os
+
+import autonetkit.ank_json as ank_json
+import autonetkit.log as log
+import autonetkit.profiling as profiling
+import autonetkit.render as render
+from autonetkit.nidb import ConfigStanza, DmInterface
+
+# input attributes copied to the graphics overlay in
+# build_network.initialise
+_GRAPHICS_ATTRS = set(['x', 'y', 'device_type', 'label', 'device_subtype',
+                       'asn'])
+
+
+def _edge_data(graph):
+    """Returns {edge: data} for graph, with undirected edges normalised"""
+
+    if graph.is_multigraph():
+        edges = ((src, dst, key, data) for (src, dst, key, data)
+                 in graph.edges(keys=True, data=True))
+    else:
+        edges = ((src, dst, data) for (src, dst, data)
+                 in graph.edges(data=True))
+
+    result = {}
+    for edge in edges:
+        (src, dst), rest, data = edge[:2], edge[2:-1], edge[-1]
+        if not graph.is_directed() and dst < src:
+            src, dst = dst, src
+        result[(src, dst) + rest] = data
+    return result
+
+
+def graph_diff(old, new):
+    """Returns the added, removed and changed nodes and edges of new
+    against old (both NetworkX graphs, eg from build_network.load)"""
+
+    old_edges = _edge_data(old)
+    new_edges = _edge_data(new)
+    return {
+        'nodes_added': sorted(n for n in new if n not in old),
+        'nodes_removed': sorted(n for n in old if n not in new),
+        'nodes_changed': sorted(n for n in new
+                                if n in old and new.node[n] != old.node[n]),
+        'edges_added': sorted(e for e in new_edges if e not in old_edges),
+        'edges_removed': sorted(e for e in old_edges if e not in new_edges),
+        'edges_changed': sorted(e for e in new_edges if e in old_edges
+                                and new_edges[e] != old_edges[e]),
+        'graph_changed': new.graph != old.graph,
+    }
+
+
+def is_empty(diff):
+    """If graph_diff found no changes"""
+
+    return not any(diff.values())
+
+
+def summary(diff):
+    """Returns a one line description of diff, for logging"""
+
+    counts = ["%s %s" % (len(items), key.replace("_", " "))
+              for (key, items) in sorted(diff.items())
+              if key != 'graph_changed' and items]
+    if diff['graph_changed']:
+        counts.append("graph data changed")
+    return ", ".join(counts) or "no changes"
+
+
+def changed_attrs(old, new, diff):
+    """Returns the node, edge and graph data keys whose values differ
+    between the old and new graphs of diff. None if nodes or edges were
+    added or removed, as that can affect any reader of the input"""
+
+    if (diff['nodes_added'] or diff['nodes_removed']
+            or diff['edges_added'] or diff['edges_removed']):
+        return None
+
+    def differing(old_data, new_data):
+        return set(key for key in set(old_data) | set(new_data)
+                   if old_data.get(key) != new_data.get(key))
+
+    result = differing(old.graph, new.graph)
+    for node in diff['nodes_changed']:
+        result.update(differing(old.node[node], new.node[node]))
+    if diff['edges_changed']:
+        old_edges = _edge_data(old)
+        new_edges = _edge_data(new)
+        for edge in diff['edges_changed']:
+            result.update(differing(old_edges[edge], new_edges[edge]))
+    return result
+
+
+def _descendants(g_deps, overlay_ids):
+    """Returns overlay_ids and the overlays derived from them in the
+    _dependencies graph g_deps. Not followed through input, whose changes
+    are tracked per attribute"""
+
+    result = set()
+    stack = list(overlay_ids)
+    while stack:
+        overlay_id = stack.pop()
+        if overlay_id in result or overlay_id == 'input':
+            continue
+        result.add(overlay_id)
+        if overlay_id in g_deps:
+            stack.extend(g_deps.successors(overlay_id))
+    return result
+
+
+def affected_stages(stages, changed, dirty, g_deps, input_writes):
+    """Returns the names of the stages to rerun, for the changed input
+    attributes (None if any may have changed) and dirty overlays.
+    g_deps is the _dependencies graph of the previous build, and
+    input_writes the input attributes each stage wrote in that build
+
+    >>> from autonetkit.design.scheduler import Stage
+    >>> import networkx as nx
+    >>> stages = [Stage("phy", None, ["input"], ["phy"], attrs=["asn"]),
+    ...           Stage("ospf", None, ["input", "phy"], ["ospf"],
+    ...                 attrs=["ospf_area"]),
+    ...           Stage("bgp", None, ["input", "phy"], ["bgp"],
+    ...                 attrs=["ibgp_role"])]
+    >>> g_deps = nx.DiGraph([("input", "phy"), ("phy", "ospf"),
+    ...                      ("phy", "bgp")])
+    >>> sorted(affected_stages(stages, set(["ospf_area"]), [], g_deps, {}))
+    ['ospf']
+    >>> sorted(affected_stages(stages, set(["asn"]), [], g_deps, {}))
+    ['bgp', 'ospf', 'phy']
+
+    """
+
+    affected = set()
+    dirty = set(dirty)
+    while True:
+        count = len(affected)
+        for stage in stages:
+            if stage.name in affected:
+                continue
+            reads_changed = 'input' in stage.inputs and (
+                changed is None or stage.attrs is None
+                or stage.attrs & changed)
+            if reads_changed or dirty & set(stage.inputs):
+                affected.add(stage.name)
+
+        # stages writing the same overlay rerun together: reusing the
+        # overlay would also reuse the writes of the stages that rerun
+        outputs = set(overlay_id for stage in stages
+                      if stage.name in affected
+                      for overlay_id in stage.outputs)
+        outputs.discard('input')  # replayed per stage, see _apply_writes
+        for stage in stages:
+            if outputs & set(stage.outputs):
+                affected.add(stage.name)
+        dirty.update(_descendants(g_deps, outputs))
+
+        for stage in stages:
+            if (stage.name in affected and 'input' in stage.outputs
+                    and changed is not None):
+                writes = input_writes.get(stage.name)
+                changed = None if writes is None else changed | writes
+
+        if len(affected) == count:
+            return affected
+
+
+_REMOVED = object()  # marks a key removed by a stage, see _input_writes
+
+
+def _input_snapshot(anm):
+    """Returns copies of the graph and node data of the input overlay"""
+
+    graph = anm.overlay_nx_graphs['input']
+    return (dict(graph.graph),
+            dict((node, dict(data)) for (node, data)
+                 in graph.nodes(data=True)))
+
+
+def _input_writes(snapshot, anm):
+    """Returns the changes to the graph and node data of the input overlay
+    since snapshot, as (graph data, {node: data}) of the changed keys"""
+
+    def changes(before, after):
+        result = dict((key, value) for (key, value) in after.items()
+                      if key not in before or before[key] != value)
+        result.update((key, _REMOVED) for key in before if key not in after)
+        return result
+
+    graph = anm.overlay_nx_graphs['input']
+    graph_before, nodes_before = snapshot
+    nodes = {}
+    for (node, data) in graph.nodes(data=True):
+        node_changes = changes(nodes_before.get(node, {}), data)
+        if node_changes:
+            nodes[node] = node_changes
+    return (changes(graph_before, graph.graph), nodes)
+
+
+def _written_attrs(writes):
+    """Returns the keys changed in writes, from _input_writes"""
+
+    graph_changes, node_changes = writes
+    result = set(graph_changes)
+    for changes in node_changes.values():
+        result.update(changes)
+    return result
+
+
+def _apply_writes(anm, writes):
+    """Repeats writes, from _input_writes, on the input overlay of anm"""
+
+    graph = anm.overlay_nx_graphs['input']
+    graph_changes, node_changes = writes
+    items = [(graph.graph, graph_changes)]
+    items += [(graph.node[node], changes)
+              for (node, changes) in node_changes.items() if node in graph]
+    for (data, changes) in items:
+        for (key, value) in changes.items():
+            if value is not _REMOVED:
+                data[key] = value
+            elif key in data:
+                del data[key]
+    anm._invalidate_node_indexes('input')  # written directly
+
+
+def _signature(data):
+    """Returns a comparable form of the attribute dict data"""
+
+    try:
+        return json.dumps(dict(data), cls=ank_json.AnkEncoder,
+                          sort_keys=True)
+    except TypeError:
+        return repr(sorted(dict(data).items()))  # eg tuple keys
+
+
+def affected_devices(old, new):
+    """Returns the ids of the nodes whose compiled configuration can differ
+    between the old and new anm: nodes with changed data or edges in an
+    overlay, and for changed data their neighbors in any overlay (also
+    through nodes that aren't devices, such as collision domains).
+    None if the graph data of an overlay changed, as any device can read it.
+    Overlays reused by IncrementalBuild.build are the same graph, and are
+    skipped"""
+
+    old_graphs = old.overlay_nx_graphs
+    new_graphs = new.overlay_nx_graphs
+    changed_nodes = set()
+    changed_edges = set()
+    for overlay_id in set(old_graphs) | set(new_graphs):
+        old_graph = old_graphs.get(overlay_id)
+        new_graph = new_graphs.get(overlay_id)
+        if old_graph is new_graph:
+            continue
+        if old_graph is None or new_graph is None:
+            changed_nodes.update(new_graph if old_graph is None
+                                 else old_graph)
+            continue
+        if _signature(old_graph.graph) != _signature(new_graph.graph):
+            return None
+
+        for node in set(old_graph) | set(new_graph):
+            if (node not in old_graph or node not in new_graph
+                    or _signature(old_graph.node[node])
+                    != _signature(new_graph.node[node])):
+                changed_nodes.add(node)
+
+        old_edges = _edge_data(old_graph)
+        new_edges = _edge_data(new_graph)
+        for edge in set(old_edges) | set(new_edges):
+            if (edge not in old_edges or edge not in new_edges
+                    or _signature(old_edges[edge])
+                    != _signature(new_edges[edge])):
+                changed_edges.update(edge[:2])
+
+    devices = set(new_graphs['phy'])
+    graphs = [graph for graph in old_graphs.values() + new_graphs.values()
+              if graph.number_of_edges()]
+
+    def all_neighbors(graph, node):
+        if graph.is_directed():
+            return graph.predecessors(node) + graph.successors(node)
+        return graph.neighbors(node)
+
+    def neighbors(node):
+        for graph in graphs:
+            if node in graph:
+                for neigh in all_neighbors(graph, node):
+                    yield (graph, neigh)
+
+    result = changed_nodes | changed_edges
+    for node in changed_nodes:
+        for (graph, neigh) in neighbors(node):
+            result.add(neigh)
+            if neigh not in devices:
+                result.update(all_neighbors(graph, neigh))
+    for node in changed_edges - devices:
+        for (graph, neigh) in neighbors(node):
+            result.add(neigh)
+    return result & devices
+
+
+def device_signature(node):
+    """Returns a digest of the device model data of node"""
+
+    data = json.dumps(dict(node._node_data), cls=ank_json.AnkEncoder,
+                      sort_keys=True)
+    return hashlib.md5(data).hexdigest()
+
+
+def _copy(value, nidb):
+    """Copies the compiled value, with interfaces bound to nidb"""
+
+    if isinstance(value, ConfigStanza):
+        result = ConfigStanza()
+        for (key, item) in value.items():
+            setattr(result, key, _copy(item, nidb))  # keeps the order
+        return result
+    if isinstance(value, dict):
+        result = copy.copy(value)
+        for (key, item) in value.items():
+            result[key] = _copy(item, nidb)
+        return result
+    if isinstance(value, (list, tuple, set)):
+        return type(value)(_copy(item, nidb) for item in value)
+    if isinstance(value, DmInterface):
+        return DmInterface(nidb, value.node_id, value.interface_id)
+    return value  # eg str, IpAddress: not modified in place
+
+
+def _device_data(node):
+    """Returns {path: value} of the data of DmNode node, where path is
+    (key,) for node data, or (port id, key) for interface data"""
+
+    data = node._node_data
+    result = dict(((key,), value) for (key, value) in data.items()
+                  if key != '_ports')
+    for (port_id, port) in data.get('_ports', {}).items():
+        result.update(((port_id, key), value)
+                      for (key, value) in port.items())
+    return result
+
+
+class DeviceCache(object):
+
+    """The changes each device compiler made to the device model in the
+    previous compile, so that unaffected devices aren't recompiled.
+    See PlatformCompiler.compile_device"""
+
+    def __init__(self):
+        self.affected = None  # node_ids to recompile, None for all
+        self.compiled = set()  # node_ids compiled (not reused) last time
+        self._results = {}  # node_id -> (signature, {path: value})
+
+    def compile(self, compiler, node):
+        """Runs compiler.compile(node), or repeats the changes it made in
+        the previous compile if node isn't affected, and its data before
+        the compile is unchanged"""
+
+        before = dict((path, _signature({'value': value}))
+                      for (path, value) in _device_data(node).items())
+        signature = hashlib.md5(repr(sorted(before.items()))).hexdigest()
+        node_id = node.node_id
+        result = self._results.get(node_id)
+        if (self.affected is not None and node_id not in self.affected
+                and result is not None and result[0] == signature):
+            self._apply(node, result[1])
+            return
+
+        compiler.compile(node)
+        self.compiled.add(node_id)
+        changes = {}
+        after = _device_data(node)
+        for (path, value) in after.items():
+            if before.get(path) != _signature({'value': value}):
+                changes[path] = _copy(value, None)
+        changes.update((path, _REMOVED) for path in before
+                       if path not in after)
+        self._results[node_id] = (signature, changes)
+
+    @staticmethod
+    def _apply(node, changes):
+        data = node._node_data
+        for (path, value) in changes.items():
+            if len(path) == 2:
+                target = data['_ports'].setdefault(path[0], {})
+            else:
+                target = data
+            if value is not _REMOVED:
+                target[path[-1]] = _copy(value, node.nidb)
+            elif path[-1] in target:
+                del target[path[-1]]
+
+
+def _rendered(node):
+    """If the output files of node from a previous render exist"""
+
+    if node.render.dst_file:
+        if not os.path.isfile(os.path.join(node.render.dst_folder,
+                                           node.render.dst_file)):
+            return False
+    if node.render.base:
+        if not os.path.isdir(node.render.base_dst_folder):
+            return False
+    return True
+
+
+class IncrementalBuild(object):
+
+    """State kept between builds in monitor mode"""
+
+    def __init__(self):
+        self.input_graph = None  # copy of the last loaded input graph
+        self.changed_attrs = None  # input attributes changed, None if any
+        self.anm = None  # last built anm
+        self.compiled_anm = None  # anm of the last compile
+        self.input_writes = {}  # stage name -> writes to the input overlay
+        self.stages_run = []  # names of the stages run in the last build
+        self.devices = DeviceCache()
+        self.device_signatures = {}  # node_id -> device_signature
+        self.dst_folder = None
+
+    def reset(self):
+        """Forgets the previous build, eg after an error"""
+
+        self.__init__()
+
+    def update_input(self, graph):
+        """Records graph as the current input, and returns the diff against
+        the previous input, or None if there is no previous input"""
+
+        diff = None
+        self.changed_attrs = None
+        if self.input_graph is not None:
+            diff = graph_diff(self.input_graph, graph)
+            self.changed_attrs = changed_attrs(self.input_graph, graph, diff)
+        self.input_graph = graph.copy()  # build modifies the input graph
+        return diff
+
+    def build(self, graph):
+        """Builds the anm for graph, as build_network.build, rerunning only
+        the design stages affected by the changes since the previous build"""
+
+        import autonetkit.build_network as build_network
+        from autonetkit.design import scheduler
+
+        stages = build_network.design_stages()
+        with profiling.stage("initialise"):
+            anm = build_network.initialise(graph)
+
+        previous = self.anm
+        if previous is None:
+            affected = set(stage.name for stage in stages)
+        else:
+            dirty = set()
+            changed = self.changed_attrs
+            if changed is None or changed & _GRAPHICS_ATTRS:
+                dirty.add('graphics')  # from initialise
+            g_deps = previous.overlay_nx_graphs['_dependencies']
+            affected = affected_stages(stages, changed, dirty, g_deps,
+                                       dict((name, _written_attrs(writes))
+                                            for (name, writes)
+                                            in self.input_writes.items()))
+            anm._replace_overlay('_dependencies', g_deps.copy())
+
+        input_writes = {}
+        batch = []
+        for stage in stages:
+            if stage.lazy or stage.name in affected:
+                if 'input' not in stage.outputs:
+                    batch.append(stage)  # can run in parallel
+                    continue
+                scheduler.run(anm, batch)
+                batch = []
+                snapshot = _input_snapshot(anm)
+                scheduler.run(anm, [stage])
+                writes = input_writes[stage.name] = _input_writes(snapshot,
+                                                                  anm)
+                if previous is not None and not self._writes_expected(
+                        stage, writes, stages, affected):
+                    log.info("Stage %s wrote unexpected input attributes, "
+                             "rebuilding in full" % stage.name)
+                    self.anm = None
+                    if self.input_graph is not None:
+                        graph = self.input_graph.copy()  # before this build
+                    return self.build(graph)
+                continue
+
+            scheduler.run(anm, batch)
+            batch = []
+            self._reuse(stage, previous, anm)
+            if stage.name in self.input_writes:
+                writes = input_writes[stage.name] = self.input_writes[
+                    stage.name]
+                _apply_writes(anm, writes)
+        scheduler.run(anm, batch)
+
+        self.stages_run = [stage.name for stage in stages
+                           if stage.name in affected and not stage.lazy]
+        log.info("Ran %s of %s design stages: %s"
+                 % (len(self.stages_run),
+                    len([stage for stage in stages if not stage.lazy]),
+                    ", ".join(self.stages_run)))
+        self.anm = anm
+        self.input_writes = input_writes
+        profiling.record_overlays(anm)
+        return anm
+
+    def _writes_expected(self, stage, writes, stages, affected):
+        """If the input attributes written by stage, which reran, were
+        assumed to change when planning the stages to rerun (as the
+        attributes it wrote in the previous build), or aren't read by a
+        later stage that was skipped"""
+
+        previous = self.input_writes.get(stage.name)
+        if previous is None:
+            return False
+        unexpected = _written_attrs(writes) - _written_attrs(previous)
+        later = stages[stages.index(stage) + 1:]
+        return not any(
+            'input' in other.inputs and other.name not in affected
+            and (other.attrs is None or other.attrs & unexpected)
+            for other in later if unexpected)
+
+    @staticmethod
+    def _reuse(stage, previous, anm):
+        """Sets the outputs of stage in anm to those of previous"""
+
+        for overlay_id in stage.outputs:
+            if overlay_id == 'input':
+                continue  # see _apply_writes
+            if overlay_id in previous.overlay_nx_graphs:
+                anm._replace_overlay(overlay_id,
+                                     previous.overlay_nx_graphs[overlay_id])
+                hub_ids = previous._hub_ids(overlay_id)
+                if hub_ids:
+                    anm._add_hubs(overlay_id, hub_ids)
+            elif overlay_id in previous._producers:
+                anm.add_producer([overlay_id],
+                                 previous._producers[overlay_id],
+                                 previous._producer_checks.get(overlay_id))
+
+    def compile(self, anm):
+        """Compiles anm, as workflow.compile_network, recompiling only the
+        devices affected by the changes since the previous compile"""
+
+        import autonetkit.workflow as workflow
+
+        previous = self.compiled_anm
+        affected = None
+        if previous is not None:
+            # overlays built on demand in the previous compile
+            for overlay_id in previous.overlay_nx_graphs:
+                if overlay_id in anm.pending_overlays():
+                    anm.has_overlay(overlay_id)
+            affected = affected_devices(previous, anm)
+
+        while True:
+            self.devices.affected = affected
+            self.devices.compiled = set()
+            nidb = workflow.compile_network(anm, devices=self.devices)
+            if affected is None:
+                break
+            # overlays built on demand in this compile
+            now_affected = affected_devices(previous, anm)
+            if now_affected is not None and now_affected <= affected:
+                break
+            affected = now_affected
+
+        log.info("Compiled %s devices" % len(self.devices.compiled))
+        self.compiled_anm = anm
+        return nidb
+
+    def render(self, nidb):
+        """Renders the devices of nidb that changed since the last render,
+        and the topologies. Returns the destination folder, as render.render"""
+
+        signatures = {}
+        skipped = 0
+        node = None
+        for node in sorted(nidb):
+            signature = signatures[node.node_id] = device_signature(node)
+            if (signature == self.device_signatures.get(node.node_id)
+                    and not node.render.to_memory and _rendered(node)):
+                skipped += 1
+                continue
+            render.render_node(node)
+
+        log.info("Rendered %s of %s devices (%s unchanged)"
+                 % (len(signatures) - skipped, len(signatures), skipped))
+        self.device_signatures = signatures
+        render.render_topologies(nidb)
+
+        if node is not None:
+            self.dst_folder = node.render.dst_folder
+        return self.dst_folder
@@ -14,6 +14,7 @@ class DmBase(object):
     def __init__(self):
         # TODO: make optional for restore serialized file on init
         self._graph = None
+        self._label_index = None  # {label or node_id: node_id}, built on use
         pass
 
     def __getstate__(self):
@@ -21,6 +22,7 @@ class DmBase(object):
 
     def __setstate__(self, state):
         self._graph = state
+        self._label_index = None
 
     def __repr__(self):
         return "nidb"
@@ -82,6 +84,7 @@ class DmBase(object):
             #data = json.load(fh)
             data = fh.read()
             self._graph = ank_json.ank_json_loads(data)
+            self._label_index = None
 
         ank_json.rebind_nidb_interfaces(self)
 
@@ -126,22 +129,55 @@ class DmBase(object):
 
     def node(self, key):
         """Returns node based on name
-        This is currently O(N). Could use a lookup table"""
+        Labels are resolved through a cached lookup table"""
         try:
             if key.node_id in self._graph:
                 return DmNode(self, key.node_id)
         except AttributeError:
             # doesn't have node_id, likely a label string, search on label
-            for node in self:
-                if str(node) == key:
-                    return node
-                elif node.id == key:
-                    # label could be "a b" -> "a_b" (ie folder safe, etc)
-                    # TODO: need to fix this discrepancy
-                    return node
+            node = self._node_from_label(key)
+            if node is not None:
+                return node
+
+            # index may be stale, eg label set directly on the nx graph
+            self._label_index = None
+            node = self._node_from_label(key)
+            if node is not None:
+                return node
+
             print "Unable to find node", key, "in", self
             return None
 
+    def _build_label_index(self):
+        """Maps both label and id to node_id: first match in iteration
+        order wins, as for a linear search"""
+        index = {}
+        for node_id in self._graph:
+            try:
+                label = str(DmNode(self, node_id))
+            except KeyError:
+                pass  # no label set
+            else:
+                index.setdefault(label, node_id)
+            # label could be "a b" -> "a_b" (ie folder safe, etc)
+            # TODO: need to fix this discrepancy
+            index.setdefault(node_id, node_id)
+
+        return index
+
+    def _node_from_label(self, key):
+        """Returns node from the label index, if the entry is still valid"""
+        if self._label_index is None:
+            self._label_index = self._build_label_index()
+
+        node_id = self._label_index.get(key)
+        if node_id is None or node_id not in self._graph:
+            return None
+
+        node = DmNode(self, node_id)
+        if node_id == key or str(node) == key:
+            return node
+
     def update(self, nbunch, **kwargs):
         for node in nbunch:
             for (_, key), value in kwargs.items():
@@ -213,6 +249,7 @@ class DmBase(object):
             log.warning(
                 "Cannot add node ids directly to DeviceModel: must add overlay nodes")
         self._graph.add_nodes_from(nbunch, **kwargs)
+        self._label_index = None
 
         for node in nodes_to_add:
             # TODO: add an interface_retain for attributes also
@@ -276,6 +276,8 @@ class DmNode(object):
 
     def __setattr__(self, key, val):
         """Sets edge property"""
+        if key == 'label':
+            self.nidb._label_index = None
         self._node_data[key] = val
         # return DmNode_category(self.nidb, self.node_id, key)
 
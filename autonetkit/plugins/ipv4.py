@@ -1,11 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import itertools
+import json
 import math
+import os
 import time
 from collections import defaultdict
 
 import autonetkit.ank as ank_utils
+import autonetkit.ank_ip as ank_ip
 import autonetkit.ank_json
 import autonetkit.ank_messaging
 import autonetkit.log as log
@@ -13,9 +16,6 @@ import netaddr
 import networkx as nx
 from autonetkit.exception import AutoNetkitException
 
-# TODO: allow slack in allocations: both for ASN (group level), and for
-# collision domains to allow new nodes to be easily added
-
 try:
     import cPickle as pickle
 except ImportError:
@@ -29,19 +29,34 @@ def subnet_size(host_count):
     return int(math.ceil(math.log(host_count, 2)))
 
 
+def with_slack(host_count, slack):
+    """Returns host_count plus slack percent spare hosts, rounded up.
+    Blocks sized with slack have room for new nodes, without moving the
+    other blocks
+
+    >>> with_slack(10, 25)
+    13
+    >>> with_slack(10, 0)
+    10
+
+    """
+
+    return host_count + int(math.ceil(host_count * slack / 100.0))
+
+
 class TreeNode(object):
 
-    def __init__(self, graph, node):
-        object.__setattr__(self, 'graph', graph)
-        object.__setattr__(self, 'node', node)
+    """View of node of an IpTree, eg for json()"""
 
-# TODO: make thise fixed attributes, as only certain number needed here
+    def __init__(self, tree, node):
+        object.__setattr__(self, 'tree', tree)
+        object.__setattr__(self, 'node', node)
 
     def __getattr__(self, attr):
-        return self.graph.node[self.node].get(attr)
+        return self.tree.node_data(self.node).get(attr)
 
     def __setattr__(self, key, val):
-        self.graph.node[self.node][key] = val
+        raise AttributeError("IpTree nodes are read-only")
 
     def __lt__(self, other):
         if self.host and other.host:
@@ -62,10 +77,10 @@ class TreeNode(object):
         return 'TreeNode: %s' % self.node
 
     def is_broadcast_domain(self):
-        return self.host and self.host.broadcast_domain
+        return self.node in self.tree._cds
 
     def is_loopback_group(self):
-        return self.loopback_group
+        return self.node in self.tree._loopback_groups
 
     def is_interface(self):
         return isinstance(self.host, autonetkit.anm.NmPort)
@@ -74,36 +89,139 @@ class TreeNode(object):
         return bool(self.host)
 
     def children(self):
-        return [TreeNode(self.graph, child) for child in
-                self.graph.successors(self.node)]
+        return [TreeNode(self.tree, child) for child in
+                self.tree._sorted_children(self.node)]
+
+
+def _host_key(host):
+    """Sort key of an IpTree host: ank_utils.sort_key of the node, or of
+    the node of a port. Ports of tied nodes keep their input order, as
+    NmPort.__lt__ ranks them equal"""
+
+    if isinstance(host, autonetkit.anm.NmPort):
+        host = host.node
+    return ank_utils.sort_key(host)
+
+
+def _subnets(base, prefixlen, child_prefixlen):
+    """Successive (base, child_prefixlen) blocks of the block base/prefixlen,
+    as netaddr.IPNetwork.subnet"""
+
+    if not prefixlen <= child_prefixlen:
+        return
+    size = 1 << (32 - child_prefixlen)
+    for index in range(1 << (child_prefixlen - prefixlen)):
+        yield (base + index * size, child_prefixlen)
+
+
+def _iter_hosts(base, prefixlen):
+    """Host addresses of the block base/prefixlen, as
+    netaddr.IPNetwork.iter_hosts: excludes the network and broadcast address
+
+    >>> list(_iter_hosts(167772160, 30))
+    [167772161, 167772162]
+    >>> list(_iter_hosts(167772160, 31))
+    []
+
+    """
+
+    size = 1 << (32 - prefixlen)
+    if size >= 4:
+        for address in xrange(base + 1, base + size - 1):
+            yield address
 
 
 class IpTree(object):
 
-    def __init__(self, root_ip_block):
+    """Allocates IPv4 blocks as a binary (buddy) tree over integer addresses.
+
+    Each group (eg ASN) is a subtree: leaves are sized for their hosts, and
+    pairs of blocks are joined into a parent of twice the size, up to the
+    group root. Allocation splits each block into its two halves, from the
+    root block down. Blocks are held as (int, prefixlen), and only
+    converted to netaddr objects in assign() and the TreeNode views.
+
+    Loopback groups and collision domains are sized with group_slack and
+    cd_slack percent spare hosts (see with_slack). Infrastructure groups
+    are /16 blocks, so already have room for new collision domains.
+
+    >>> tree = IpTree(netaddr.IPNetwork("10.0.0.0/8"))
+    >>> root = tree._new_node(30)
+    >>> (left, right) = (tree._new_node(31), tree._new_node(31))
+    >>> tree._children[root] += [left, right]
+    >>> tree._subnet[root] = (167772160, 30)
+    >>> tree._allocate(root)
+    >>> [tree.node_data(n)['subnet'] for n in (left, right)]
+    [IPNetwork('10.0.0.0/31'), IPNetwork('10.0.0.2/31')]
+
+    """
+
+    def __init__(self, root_ip_block, group_slack=0, cd_slack=0):
         self.unallocated_nodes = []
-        self.graph = nx.DiGraph()
         self.root_node = None
         self.timestamp = time.strftime('%Y%m%d_%H%M%S',
                                        time.localtime())
-
-# taken_nodes -> these are nodes manually specified, eg in graphml
-
-        self.node_id_counter = (i for i in itertools.count(0) if i
-                                not in self.graph)
         self.root_ip_block = root_ip_block
+        self.group_slack = group_slack  # percent spare in loopback groups
+        self.cd_slack = cd_slack  # percent spare in collision domains
+
+        # indexed by node id: ids are allocated in sequence from 0
+        self._prefixlen = []
+        self._host = []
+        self._children = defaultdict(list)
+        self._group_attr = {}  # node id -> group attr, for group roots
+        self._loopback_groups = set()
+        self._cds = set()  # nodes whose host is a broadcast domain
+        self._subnet = {}  # node id -> (int, prefixlen), or int if address
+        self._ip_address = {}  # node id -> int
 
     def __len__(self):
-        return len(self.graph)
+        return len(self._prefixlen)
 
     def __iter__(self):
-        return iter(TreeNode(self.graph, node) for node in self.graph)
+        return iter(TreeNode(self, node) for node in
+                    range(len(self._prefixlen)))
+
+    def _new_node(self, prefixlen, host=None):
+        """Adds a node, returning its id"""
+
+        node = len(self._prefixlen)
+        self._prefixlen.append(prefixlen)
+        self._host.append(host)
+        return node
+
+    def node_data(self, node):
+        """Returns the attributes of node, as netaddr objects"""
+
+        data = {'prefixlen': self._prefixlen[node]}
+        if self._host[node] is not None:
+            data['host'] = self._host[node]
+        if node in self._group_attr:
+            data['group_attr'] = self._group_attr[node]
+        if node in self._loopback_groups:
+            data['loopback_group'] = True
+        if node in self._subnet:
+            data['subnet'] = _to_netaddr(self._subnet[node])
+        if node in self._ip_address:
+            data['ip_address'] = ank_ip.ip_address(self._ip_address[node])
+        return data
 
     @property
-    def next_node_id(self):
-        return self.node_id_counter.next()
+    def graph(self):
+        """The tree as a NetworkX DiGraph, eg to save"""
 
-    def add_parent_nodes(self, subgraph, level_counts):
+        graph = nx.DiGraph()
+        for node in range(len(self._prefixlen)):
+            graph.add_node(node, self.node_data(node))
+        for (node, children) in sorted(self._children.items()):
+            graph.add_edges_from((node, child) for child in children)
+        return graph
+
+    def add_parent_nodes(self, nodes, level_counts):
+        """Adds parents for the nodes at each level, from the leaves up,
+        to the nodes dict. level_counts is updated with the new nodes"""
+
+        prefixlen = self._prefixlen
         for level in range(32, 0, -1):
             try:
                 # float so do floating point division
@@ -113,28 +231,21 @@ class IpTree(object):
             parent_count = int(math.ceil(current_count / 2))
             parent_level = level - 1
             level_counts[parent_level] += parent_count
-            subgraph.add_nodes_from((self.next_node_id,
-                                     {'prefixlen': parent_level})
-                                    for n in range(parent_count))
+            for _ in range(parent_count):
+                nodes[self._new_node(parent_level)] = None
 
             if level_counts[parent_level] == 1:
                 if parent_level == min(level_counts.keys()):
-                    children = [n for n in subgraph
-                                if subgraph.node[n]['prefixlen']
-                                == parent_level + 1]
-                    if all('host' in subgraph.node[n] for n in
-                           children):
-                        subgraph.add_node(self.next_node_id,
-                                          prefixlen=parent_level - 1)
+                    if all(self._host[n] is not None for n in nodes
+                           if prefixlen[n] == parent_level + 1):
+                        nodes[self._new_node(parent_level - 1)] = None
 
                     break  # Reached top of tree
 
-    def build_tree(
-        self,
-        subgraph,
-        level_counts,
-        nodes_by_level,
-    ):
+    def build_tree(self, level_counts, nodes_by_level):
+        """Pairs the nodes at each level with a parent at the level above,
+        returning the root"""
+
         smallest_prefix = min(level_counts.keys())
         for prefixlen in range(smallest_prefix, 32):
 
@@ -142,14 +253,13 @@ class IpTree(object):
 
             unallocated_children = set(nodes_by_level[prefixlen + 1])
             for node in sorted(nodes_by_level[prefixlen]):
-                is_not_subnet = not ('host' in subgraph.node[node]
-                                     or 'group_attr' in subgraph.node[node])
+                is_not_subnet = not (self._host[node] is not None
+                                     or node in self._group_attr)
                 if is_not_subnet:
-                    child_a = unallocated_children.pop()
-                    subgraph.add_edge(node, child_a)
+                    self._children[node].append(unallocated_children.pop())
                     try:
                         child_b = unallocated_children.pop()
-                        subgraph.add_edge(node, child_b)
+                        self._children[node].append(child_b)
                     except KeyError:
                         pass  # single child, just attach
 
@@ -162,8 +272,9 @@ class IpTree(object):
         if not os.path.isdir(archive_dir):
             os.makedirs(archive_dir)
 
-        self.graph.graph['timestamp'] = self.timestamp
-        data = autonetkit.ank_json.ank_json_dumps(self.graph)
+        graph = self.graph
+        graph.graph['timestamp'] = self.timestamp
+        data = autonetkit.ank_json.ank_json_dumps(graph)
 
 # TODO: should this use the ank_json.jsonify_nidb() ?
 
@@ -176,12 +287,22 @@ class IpTree(object):
         with open(json_path, 'wb') as json_fh:
             json_fh.write(data)
 
+    def _add_group(self, items, prefixlen=None):
+        """Adds a loopback group of items, returning the root"""
+
+        parent_id = self._new_node(
+            32 - subnet_size(with_slack(len(items), self.group_slack)))
+        self._loopback_groups.add(parent_id)
+        for item in sorted(items, key=_host_key):
+            self._children[parent_id].append(self._new_node(32, item))
+        if prefixlen is not None:
+            self._prefixlen[parent_id] = prefixlen
+        return parent_id
+
     def build(self, group_attr='asn'):
         """Builds tree from unallocated_nodes,
         groupby is the attribute to build subtrees from"""
 
-        subgraphs = []
-
 # if network final octet is .0 eg 10.0.0.0 or 192.168.0.0, then add extra "dummy" node, so don't have a loopback of 10.0.0.0
 # Change strategy: if just hosts (ie loopbacks), then allocate as a large
 # collision domain
@@ -202,13 +323,14 @@ class IpTree(object):
         unallocated_nodes = sorted(unallocated_nodes, key=key_func)
         groupings = itertools.groupby(unallocated_nodes, key=key_func)
         prefixes_by_attr = {}
+        prefixlen = self._prefixlen
+        root_nodes = []
 
         for (attr_value, items) in groupings:
 
             # make subtree for each attr
 
-            items = sorted(list(items))
-            subgraph = nx.DiGraph()
+            items = sorted(items, key=_host_key)
 
             if all(isinstance(item, autonetkit.anm.NmPort)
                    for item in items):
@@ -216,25 +338,10 @@ class IpTree(object):
                 # interface
 
                 if all(item.is_loopback for item in items):
-                    parent_id = self.next_node_id
                     # group all loopbacks into single subnet
-                    prefixlen = 32 - subnet_size(len(items))
-                    subgraph.add_node(parent_id, prefixlen=prefixlen,
-                                      loopback_group=True)
-                    for item in sorted(items):
-
-                        # subgraph.add_edge(node, child_a)
-
-                        item_id = self.next_node_id
-                        subgraph.add_node(item_id, prefixlen=32,
-                                          host=item)
-                        subgraph.add_edge(parent_id, item_id)
-
-                    root_node = parent_id
-                    subgraphs.append(subgraph)
-                    subgraph.graph['root'] = root_node
-                    subgraph.node[root_node]['group_attr'] = attr_value
-                    subgraph.node[root_node]['prefixlen'] = 24
+                    root_node = self._add_group(items, prefixlen=24)
+                    self._group_attr[root_node] = attr_value
+                    root_nodes.append(root_node)
                     # finished for loopbacks, continue only for collision
                     # domains
                     continue
@@ -245,140 +352,87 @@ class IpTree(object):
                 # to edges not devices (for now) - will be fixed when move to
                 # proper interface model
 
-                parent_id = self.next_node_id
-                # group all loopbacks into single subnet
-                prefixlen = 32 - subnet_size(len(items))
-                subgraph.add_node(parent_id, prefixlen=prefixlen,
-                                  loopback_group=True)
-                for item in sorted(items):
-
-                    # subgraph.add_edge(node, child_a)
-
-                    item_id = self.next_node_id
-                    subgraph.add_node(item_id, prefixlen=32, host=item)
-                    subgraph.add_edge(parent_id, item_id)
-
-                root_node = parent_id
-                subgraphs.append(subgraph)
-                subgraph.graph['root'] = root_node
-                subgraph.node[root_node]['group_attr'] = attr_value
+                root_node = self._add_group(items)
+                self._group_attr[root_node] = attr_value
+                root_nodes.append(root_node)
                 # finished for loopbacks, continue only for collision domains
                 continue
 
-            for item in sorted(items):
+            nodes = {}  # in id order, as the subtree nodes
+            for item in items:
                 if item.broadcast_domain:
-                    subgraph.add_node(self.next_node_id, prefixlen=32
-                                      - subnet_size(item.degree()), host=item)
+                    size = subnet_size(with_slack(item.degree(),
+                                                  self.cd_slack))
+                    node = self._new_node(32 - size, item)
+                    self._cds.add(node)
+                    nodes[node] = None
                 if item.is_l3device():
-                    subgraph.add_node(self.next_node_id, prefixlen=32,
-                                      host=item)
-
-            # now group by levels
-
-            level_counts = defaultdict(int)
-
-            nodes_by_level = defaultdict(list)
-            for node in subgraph.nodes():
-                prefixlen = subgraph.node[node]['prefixlen']
-                nodes_by_level[prefixlen].append(node)
+                    node = self._new_node(32, item)
+                    if item.broadcast_domain:
+                        self._cds.add(node)
+                    nodes[node] = None
 
             log.debug('Building IP subtree for %s %s' % (group_attr,
                                                          attr_value))
 
-            for (level, nodes) in nodes_by_level.items():
-                level_counts[level] = len(nodes)
+            # now group by levels
 
-            self.add_parent_nodes(subgraph, level_counts)
+            level_counts = defaultdict(int)
+            for node in nodes:
+                level_counts[prefixlen[node]] += 1
+
+            self.add_parent_nodes(nodes, level_counts)
 
 # test if min_level node is bound, if so then add a parent, so root for AS
 # isn't a cd
 
             min_level = min(level_counts)
-            min_level_nodes = [n for n in subgraph
-                               if subgraph.node[n]['prefixlen']
-                               == min_level]
+            min_level_nodes = [n for n in nodes if prefixlen[n] == min_level]
 
             # test if bound
 
             if len(min_level_nodes) == 2:
-                subgraph.add_node(self.next_node_id,
-                                  {'prefixlen': min_level - 2})
-                subgraph.add_node(self.next_node_id,
-                                  {'prefixlen': min_level - 2})
-                subgraph.add_node(self.next_node_id,
-                                  {'prefixlen': min_level - 1})
+                nodes[self._new_node(min_level - 2)] = None
+                nodes[self._new_node(min_level - 2)] = None
+                nodes[self._new_node(min_level - 1)] = None
             if len(min_level_nodes) == 1:
-                subgraph.add_node(self.next_node_id,
-                                  {'prefixlen': min_level - 1})
+                nodes[self._new_node(min_level - 1)] = None
 
             # rebuild with parent nodes
 
             nodes_by_level = defaultdict(list)
-            for node in sorted(subgraph.nodes()):
-                prefixlen = subgraph.node[node]['prefixlen']
-                nodes_by_level[prefixlen].append(node)
+            for node in sorted(nodes):
+                nodes_by_level[prefixlen[node]].append(node)
 
-            root_node = self.build_tree(subgraph, level_counts,
-                                        nodes_by_level)
-            subgraphs.append(subgraph)
-
-            subgraph.graph['root'] = root_node
+            root_node = self.build_tree(level_counts, nodes_by_level)
+            root_nodes.append(root_node)
 
 # FOrce to be a /16 block
 # TODO: document this
 
-            subgraph.node[root_node]['prefixlen'] = 16
-            subgraph.node[root_node]['group_attr'] = attr_value
-            prefixes_by_attr[attr_value] = subgraph.node[
-                root_node]['prefixlen']
-
-        global_graph = nx.DiGraph()
-        subgraphs = sorted(subgraphs, key=lambda x:
-                           subgraph.node[subgraph.graph['root'
-                                                        ]]['group_attr'])
-        root_nodes = [subgraph.graph['root'] for subgraph in subgraphs]
-        root_nodes = []
-        for subgraph in subgraphs:
-            root_node = subgraph.graph['root']
-            root_nodes.append(root_node)
-            global_graph.add_node(root_node, subgraph.node[root_node])
-
-        nodes_by_level = defaultdict(list)
-        for node in root_nodes:
-            prefixlen = global_graph.node[node]['prefixlen']
-            nodes_by_level[prefixlen].append(node)
+            prefixlen[root_node] = 16
+            self._group_attr[root_node] = attr_value
+            prefixes_by_attr[attr_value] = prefixlen[root_node]
 
+        # join the group roots into a tree
+        global_nodes = dict.fromkeys(root_nodes)
         level_counts = defaultdict(int)
-        for (level, nodes) in nodes_by_level.items():
-            level_counts[level] = len(nodes)
-
-        self.add_parent_nodes(global_graph, level_counts)
+        for node in root_nodes:
+            level_counts[prefixlen[node]] += 1
 
-# rebuild nodes by level
-# TODO: make this a function
+        self.add_parent_nodes(global_nodes, level_counts)
 
         nodes_by_level = defaultdict(list)
-        for node in global_graph:
-            prefixlen = global_graph.node[node]['prefixlen']
-            nodes_by_level[prefixlen].append(node)
+        for node in global_nodes:
+            nodes_by_level[prefixlen[node]].append(node)
 
-        global_root = self.build_tree(global_graph, level_counts,
-                                      nodes_by_level)
-        global_root = TreeNode(global_graph, global_root)
-
-        for subgraph in subgraphs:
-            global_graph = nx.compose(global_graph, subgraph)
+        global_root = self.build_tree(level_counts, nodes_by_level)
 
         # now allocate the IPs
 
-        global_prefix_len = global_root.prefixlen
-
-        # TODO: try/catch if the block is too small for prefix
-
-        try:
-            global_ip_block = \
-                self.root_ip_block.subnet(global_prefix_len).next()
-        except StopIteration:
+        global_prefix_len = prefixlen[global_root]
+        root_ip_block = self.root_ip_block
+        if not root_ip_block.prefixlen <= global_prefix_len:
             #message = ("Unable to allocate IPv4 subnets. ")
             formatted_prefixes = ", ".join(
                 "AS%s: /%s" % (k, v) for k, v in sorted(prefixes_by_attr.items()))
@@ -387,150 +441,130 @@ class IpTree(object):
             log.error(message)
             # TODO: throw ANK specific exception here
             raise AutoNetkitException(message)
-        self.graph = global_graph
 
 # add children of collision domains
 
-        cd_nodes = [n for n in self if n.is_broadcast_domain()]
-        for cd in sorted(cd_nodes):
-            for edge in sorted(cd.host.edges()):
-
-                # TODO: sort these
-
-                child_id = self.next_node_id
-                cd_id = cd.node
-                global_graph.add_node(child_id, prefixlen=32,
-                                      host=edge.dst_int)
-                # cd -> neigh (cd is parent)
-                global_graph.add_edge(cd_id, child_id)
-
-# TODO: make allocate seperate step
-
-        def allocate(node):
-
-            # children = graph.successors(node)
-
-            children = sorted(node.children())
-            prefixlen = node.prefixlen + 1
-
-            # workaround for clobbering attr subgraph root node with /16 if was
-            # a /28
-
-            subnet = node.subnet.subnet(prefixlen)
+        host = self._host
+        for cd in sorted(self._cds):
+            # in allocation order, as _sorted_children: the sort is stable,
+            # and ids are given in list order
+            interfaces = sorted((edge.dst_int for edge
+                                 in sorted(host[cd].edges())), key=_host_key)
+            first = len(prefixlen)
+            prefixlen.extend([32] * len(interfaces))
+            host.extend(interfaces)
+            self._children[cd] = range(first, len(prefixlen))
 
-# handle case where children subnet
+        self._subnet[global_root] = (root_ip_block.first, global_prefix_len)
+        self._allocate(global_root)
 
-            # special case of single AS -> root is loopback_group
-            if node.is_loopback_group() or node.is_broadcast_domain():
-
-                # TODO: generalise this rather than repeated code with below
-                # node.subnet = subnet.next() # Note: don't break into smaller
-                # subnets if single-AS
-
-                # ensures start at .1 rather than .0
-                iterhosts = node.subnet.iter_hosts()
-                sub_children = node.children()
-                for sub_child in sorted(sub_children):
-
-                    # TODO: tidy up this allocation to always record the subnet
-
-                    if sub_child.is_interface() \
-                            and sub_child.host.is_loopback:
-                        if sub_child.host.is_loopback_zero:
-
-                            # loopback zero, just store the ip address
-
-                            sub_child.ip_address = iterhosts.next()
-                        else:
-
-                            # secondary loopback
-
-                            sub_child.ip_address = iterhosts.next()
-                            sub_child.subnet = node.subnet
-                    elif sub_child.is_interface() \
-                            and (sub_child.host.is_physical or interface.is_portchannel):
-
-                        # physical interface
-
-                        sub_child.ip_address = iterhosts.next()
-                        sub_child.subnet = node.subnet
-                    else:
-                        sub_child.subnet = iterhosts.next()
+# check for parentless nodes
 
-                return
+        self.root_node = TreeNode(self, global_root)
+
+    def _sorted_children(self, node):
+        """Children of node, in allocation order: by host if all are hosts,
+        then by node id, so hosts that compare equal have a fixed order"""
+
+        host = self._host
+        children = self._children.get(node, ())
+        for child in children:
+            if host[child] is None:
+                return sorted(children)
+        return sorted(children, key=lambda child: (_host_key(host[child]),
+                                                   child))
+
+    def _allocate(self, root):
+        """Splits the block of each node between its children, from root
+        down the tree"""
+
+        NmPort = autonetkit.anm.NmPort
+        host = self._host
+        cds = self._cds
+        loopback_groups = self._loopback_groups
+        subnets = self._subnet
+        ip_addresses = self._ip_address
+
+        # special case of single AS -> root is loopback_group
+        if root in loopback_groups or root in cds:
+            subnet = subnets[root]
+            # ensures start at .1 rather than .0
+            iterhosts = _iter_hosts(*subnet)
+            for sub_child in self._sorted_children(root):
+                interface = host[sub_child]
+                if isinstance(interface, NmPort) and interface.is_loopback:
+                    ip_addresses[sub_child] = iterhosts.next()
+                    if not interface.is_loopback_zero:
+
+                        # secondary loopback
+
+                        subnets[sub_child] = subnet
+                elif isinstance(interface, NmPort) \
+                        and (interface.is_physical or interface.is_portchannel):
+
+                    # physical interface
+
+                    ip_addresses[sub_child] = iterhosts.next()
+                    subnets[sub_child] = subnet
+                else:
+                    subnets[sub_child] = iterhosts.next()
+            return
 
-            for child in sorted(children):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            (base, prefixlen) = subnets[node]
+            child_subnets = _subnets(base, prefixlen,
+                                     self._prefixlen[node] + 1)
+            for child in self._sorted_children(node):
 
                 # traverse the tree
 
-                if child.is_broadcast_domain():
-                    subnet = subnet.next()
-                    child.subnet = subnet
+                subnet = subnets[child] = child_subnets.next()
+                if child in cds:
                     # ensures start at .1 rather than .0
-                    iterhosts = child.subnet.iter_hosts()
-                    sub_children = child.children()
-                    for sub_child in sorted(sub_children):
-                        if sub_child.is_interface():
-                            interface = sub_child.host
-                            if interface.is_physical or interface.is_portchannel:
-
-                                # physical interface
-
-                                sub_child.ip_address = iterhosts.next()
-                                sub_child.subnet = subnet
-                            elif interface.is_loopback \
-                                    and not interface.is_loopback_zero:
-
-                                # secondary loopback interface
-
-                                sub_child.ip_address = iterhosts.next()
-                                sub_child.subnet = subnet
+                    iterhosts = _iter_hosts(*subnet)
+                    for sub_child in self._children[child]:  # sorted in build
+                        interface = host[sub_child]
+                        if isinstance(interface, NmPort):
+                            if (interface.is_physical
+                                    or interface.is_portchannel
+                                    or interface.is_loopback
+                                    and not interface.is_loopback_zero):
+
+                                # physical or secondary loopback interface
+
+                                ip_addresses[sub_child] = iterhosts.next()
+                                subnets[sub_child] = subnet
                         else:
-                            sub_child.subnet = iterhosts.next()
-
-                        #log.debug('Allocate sub_child to %s %s'% (sub_child, sub_child.subnet))
-                elif child.is_host():
-                    child.subnet = subnet.next()
-                elif child.is_loopback_group():
-                    child.subnet = subnet.next()
+                            subnets[sub_child] = iterhosts.next()
+                elif host[child] is not None:
+                    pass
+                elif child in loopback_groups:
                     # ensures start at .1 rather than .0
-                    iterhosts = child.subnet.iter_hosts()
-                    sub_children = child.children()
-                    for sub_child in sorted(sub_children):
-                        if sub_child.is_interface() \
-                                and not sub_child.host.is_loopback_zero:
+                    iterhosts = _iter_hosts(*subnet)
+                    for sub_child in self._sorted_children(child):
+                        interface = host[sub_child]
+                        if isinstance(interface, NmPort) \
+                                and not interface.is_loopback_zero:
 
-                           # secondary loopback
+                            # secondary loopback
 
-                            sub_child.ip_address = iterhosts.next()
-                            sub_child.subnet = child.subnet
+                            ip_addresses[sub_child] = iterhosts.next()
+                            subnets[sub_child] = subnet
                         else:
-                            sub_child.subnet = iterhosts.next()
+                            subnets[sub_child] = iterhosts.next()
                 else:
-                    child.subnet = subnet.next()
-                    allocate(child)  # continue down the tree
-
-        global_root.subnet = global_ip_block
-
-# TODO: fix this workaround where referring to the wrong graph
-
-        global_root_id = global_root.node
-        global_root = TreeNode(global_graph, global_root_id)
-        allocate(global_root)
-
-# check for parentless nodes
-
-        self.graph = global_graph
-        self.root_node = global_root
+                    stack.append(child)  # continue down the tree
 
     def group_allocations(self):
         allocs = {}
-        for node in self:
-            if node.group_attr:
+        for (node, attr_value) in sorted(self._group_attr.items()):
+            if attr_value:
 
                 # TODO: Also need to store the type
 
-                allocs[node.group_attr] = [node.subnet]
+                allocs[attr_value] = [_to_netaddr(self._subnet.get(node))]
 
         return allocs
 
@@ -540,13 +574,13 @@ class IpTree(object):
     def walk(self):
 
         def list_successors(node):
-            successors = self.graph.successors(node)
+            successors = self._sorted_children(node)
             if successors:
                 children = [list_successors(n) for n in successors]
                 return {node: children}
             return node
 
-        return list_successors(self.root_node)
+        return list_successors(self.root_node.node)
 
     def json(self):
 
@@ -562,7 +596,6 @@ class IpTree(object):
             log.debug('No root node set')
             return {'name': str(self.root_ip_block),
                     'subnet': str(self.root_ip_block), 'children': []}
-            return
         return list_successors(self.root_node)
 
     def assign(self):
@@ -570,39 +603,430 @@ class IpTree(object):
         # assigns allocated addresses back to hosts
         # don't look at host nodes now - use loopback_groups
         # TODO: make check for interface and loopback zero now
-        host_tree_nodes = [n for n in self if n.is_host()
-                           and isinstance(n.host, autonetkit.anm.NmNode)
-                           and n.host.is_l3device()]
-
-        # for host_tree_node in host_tree_nodes:
-        # print host_tree_node, host_tree_node.subnet
-
-        for host_tree_node in host_tree_nodes:
-            host_tree_node.host.loopback = host_tree_node.subnet
-
-        cds = [n for n in self if n.is_broadcast_domain()]
-        for cd in cds:
-            cd.host.subnet = cd.subnet
+        for (node, host) in enumerate(self._host):
+            if host is None:
+                continue
+            subnet = self._subnet.get(node)
+            if node in self._cds:
+                host.subnet = _to_netaddr(subnet)
+            if isinstance(host, autonetkit.anm.NmNode):
+                if host.is_l3device():
+                    host.loopback = _to_netaddr(subnet)
+                continue
 
-        interfaces = [n for n in self if n.is_interface()]
-        for n in interfaces:
-            interface = n.host
+            interface = host
+            ip_address = self._ip_address.get(node)
+            if ip_address is not None:
+                ip_address = ank_ip.ip_address(ip_address)
             if interface.is_loopback and interface.is_loopback_zero:
 
                 # primary loopback
 
-                interface.loopback = n.ip_address
+                interface.loopback = ip_address
             elif interface.is_loopback \
                     and not interface.is_loopback_zero:
 
                 # secondary loopback
 
-                interface.loopback = n.ip_address
-                loopback_255 = netaddr.IPNetwork("%s/32" % n.ip_address)
+                interface.loopback = ip_address
+                loopback_255 = ank_ip.ip_network(ip_address, 32)
                 interface.subnet = loopback_255
             elif interface.is_physical or interface.is_portchannel:
-                interface.ip_address = n.ip_address
-                interface.subnet = n.subnet
+                interface.ip_address = ip_address
+                interface.subnet = _to_netaddr(subnet)
+
+
+def _to_netaddr(value):
+    """Returns an (int, prefixlen) block as an IpNetwork, an int as an
+    IpAddress, or None. Users of a block share its interned value"""
+
+    if value is None:
+        return None
+    if isinstance(value, tuple):
+        return ank_ip.ip_network(*value)
+    return ank_ip.ip_address(value)
+
+
+class BlockPool(object):
+
+    """Free space of an IPv4 block, as aligned free blocks by prefixlen.
+    Taking a block splits the free block holding it in halves (buddy
+    allocation). Addresses are ints
+
+    >>> pool = BlockPool(167772160, 29)
+    >>> pool.reserve(167772164, 30)
+    True
+    >>> pool.allocate(31)
+    167772160
+    >>> pool.allocate(30) is None
+    True
+
+    """
+
+    def __init__(self, base, prefixlen):
+        self.prefixlen = prefixlen
+        self.free = defaultdict(set)  # prefixlen -> bases of free blocks
+        self.free[prefixlen].add(base)
+
+    def _take(self, base, prefixlen, target, target_prefixlen):
+        """Takes target from the free block base, freeing the other halves"""
+
+        self.free[prefixlen].remove(base)
+        while prefixlen < target_prefixlen:
+            prefixlen += 1
+            half = 1 << (32 - prefixlen)
+            if target & half:
+                self.free[prefixlen].add(base)
+                base += half
+            else:
+                self.free[prefixlen].add(base + half)
+
+    def reserve(self, base, prefixlen):
+        """Takes the block base/prefixlen, or returns False if not free"""
+
+        for level in range(prefixlen, self.prefixlen - 1, -1):
+            block = base >> (32 - level) << (32 - level)
+            if block in self.free[level]:
+                self._take(block, level, base, prefixlen)
+                return True
+        return False
+
+    def allocate(self, prefixlen):
+        """Takes the lowest block of prefixlen from the smallest free block
+        it fits, returning its base, or None if there is no space"""
+
+        for level in range(prefixlen, self.prefixlen - 1, -1):
+            if self.free[level]:
+                base = min(self.free[level])
+                self._take(base, level, base, prefixlen)
+                return base
+
+
+def _host_pool(base, prefixlen):
+    """BlockPool of the host addresses of a block, as _iter_hosts"""
+
+    pool = BlockPool(base, prefixlen)
+    if prefixlen > 30:
+        pool.reserve(base, prefixlen)  # no host addresses
+    else:
+        pool.reserve(base, 32)  # network
+        pool.reserve(base + (1 << (32 - prefixlen)) - 1, 32)  # broadcast
+    return pool
+
+
+def _reallocate(pool, required, previous, keep=False):
+    """Returns {key: (base, prefixlen)} for the (key, prefixlen, needed) of
+    required: the previous block of key if it is at least a /needed and
+    free in pool, otherwise a new /prefixlen block from pool. prefixlen
+    includes slack, so previous blocks are kept until their slack is used.
+    A previous block that is too small is grown into the free space
+    around it if it can be, which keeps its addresses. If not, with keep
+    it is still returned, and the caller adds space for the rest.
+    Returns None if pool is full
+
+    >>> previous = {'a': (167772160, 30), 'b': (167772164, 30)}
+    >>> _reallocate(BlockPool(167772160, 24), [('a', 29, 29)], previous)
+    {'a': (167772160, 29)}
+    >>> _reallocate(BlockPool(167772160, 24), [('a', 29, 29), ('b', 30, 30)],
+    ...             previous, keep=True)
+    {'a': (167772160, 30), 'b': (167772164, 30)}
+
+    """
+
+    result = {}
+    for (key, _, needed) in required:
+        block = previous.get(key)
+        if block and block[1] <= needed and pool.reserve(*block):
+            result[key] = block
+
+    # after the blocks that fit, as a grown block may cover a previous one
+    for (key, prefixlen, needed) in required:
+        block = previous.get(key)
+        if key in result or not block:
+            continue
+        for target in (prefixlen, needed):  # with slack if there's room
+            grown = (block[0] >> (32 - target) << (32 - target), target)
+            if target < block[1] and pool.reserve(*grown):
+                result[key] = grown
+                break
+        else:
+            if keep and pool.reserve(*block):
+                result[key] = block
+
+    # new blocks, largest first
+    for (key, prefixlen, _) in sorted(required, key=lambda x: x[1]):
+        if key not in result:
+            base = pool.allocate(prefixlen)
+            if base is None:
+                return None
+            result[key] = (base, prefixlen)
+    return result
+
+
+def _parse_block(text):
+    """Returns an address or network string as (int, prefixlen)"""
+
+    network = netaddr.IPNetwork(text)
+    return (network.first, network.prefixlen)
+
+
+class IpLedger(object):
+
+    """Allocations of previous builds, saved as versions/ip/ledger.json.
+
+    Allocations are keyed by node id, collision domain id, or interface
+    position, which are stable between builds. With ledger enabled in
+    [IP Addressing], the allocate functions keep the allocations of
+    existing entities, and allocate new entities from free space, so only
+    the devices whose addressing changed are re-rendered.
+
+    >>> ledger = IpLedger()
+    >>> block = netaddr.IPNetwork("192.168.0.0/22")
+    >>> ledger.record("loopbacks", block,
+    ...               {1: [netaddr.IPNetwork("192.168.0.0/29")]},
+    ...               {("r1",): netaddr.IPAddress("192.168.0.1")})
+    >>> ledger.previous("loopbacks", block)['allocations']
+    {('r1',): (3232235521, 32)}
+
+    """
+
+    def __init__(self, sections=None):
+        self.sections = sections or {}
+
+    @staticmethod
+    def filename(directory=None):
+        if directory is None:
+            directory = os.path.join('versions', 'ip')
+        return os.path.join(directory, 'ledger.json')
+
+    @classmethod
+    def load(cls, directory=None):
+        """Loads the ledger, or returns an empty ledger if none saved"""
+
+        filename = cls.filename(directory)
+        if not os.path.isfile(filename):
+            return cls()
+        try:
+            with open(filename) as fh:
+                return cls(json.load(fh))
+        except ValueError, error:
+            log.warning('Unable to load IP ledger %s: %s' % (filename,
+                                                             error))
+            return cls()
+
+    def save(self, directory=None):
+        filename = self.filename(directory)
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        log.debug('Saving IP ledger to %s' % filename)
+        with open(filename, 'w') as fh:
+            json.dump(self.sections, fh, indent=1, sort_keys=True)
+
+    def previous(self, section, address_block):
+        """Returns the group blocks and allocations recorded for section,
+        as {'groups': {group: [block]}, 'allocations': {key: block}} with
+        blocks as (int, prefixlen), or None if none were recorded from
+        address_block"""
+
+        data = self.sections.get(section)
+        if not data or data['block'] != str(address_block):
+            return None
+        groups = defaultdict(list)
+        for (group, block) in data['groups']:
+            groups[group].append(_parse_block(block))
+        return {
+            'groups': dict(groups),
+            'allocations': dict((tuple(row[:-1]), _parse_block(row[-1]))
+                                for row in data['allocations']),
+        }
+
+    def record(self, section, address_block, groups, allocations):
+        """Records the group blocks ({group: [block]}) and the allocations
+        ({key: address or subnet}) of section from address_block"""
+
+        self.sections[section] = {
+            'block': str(address_block),
+            # blocks of a group in order, the first block first
+            'groups': sorted(([group, str(block)]
+                              for (group, blocks) in groups.items()
+                              for block in blocks), key=lambda row: row[0]),
+            'allocations': sorted(list(key) + [str(value)]
+                                  for (key, value) in allocations.items()
+                                  if value is not None),
+        }
+
+
+def _cd_interfaces(cd):
+    """(key, interface) for the interfaces of cd that are allocated an
+    address, in allocation order. Keys are (cd, node, index), index
+    counting the interfaces of node onto cd"""
+
+    result = []
+    counts = defaultdict(int)
+    for interface in sorted((edge.dst_int for edge in sorted(cd.edges())),
+                            key=_host_key):
+        if (interface.is_physical or interface.is_portchannel
+                or interface.is_loopback and not interface.is_loopback_zero):
+            node_id = interface.node_id
+            result.append(((cd.node_id, node_id, counts[node_id]),
+                           interface))
+            counts[node_id] += 1
+    return result
+
+
+def _secondary_loopback_keys(interfaces):
+    """(key, interface) for secondary loopback interfaces. Keys are
+    (node, description, index), index counting the interfaces of node
+    with that description"""
+
+    result = []
+    counts = defaultdict(int)
+    for interface in interfaces:
+        position = (interface.node_id, interface.description)
+        result.append((position + (counts[position],), interface))
+        counts[position] += 1
+    return result
+
+
+def _allocate_groups(pool, previous, groups, prefixlens):
+    """Allocates blocks from pool for each group, of the (prefixlen,
+    needed) of prefixlens[group] as _reallocate, keeping the previous
+    blocks where possible. A group keeps its first block even if it has
+    outgrown it, and the blocks added for it since (see
+    _allocate_hosts_from). Returns {group: [block]}, or None if pool is
+    full"""
+
+    extra_blocks = dict((group, [block for block
+                                 in previous['groups'].get(group, [])[1:]
+                                 if pool.reserve(*block)])
+                        for group in groups)
+    required = [(group,) + prefixlens[group] for group in groups]
+    blocks = _reallocate(pool, required,
+                         dict((group, group_blocks[0]) for (group,
+                              group_blocks) in previous['groups'].items()),
+                         keep=True)
+    if blocks is None:
+        return None
+    return dict((group, [blocks[group]] + extra_blocks[group])
+                for group in groups)
+
+
+def _allocate_infra_from(previous, address_block, cds, cd_slack=0):
+    """Allocates cds, keeping their previous allocations where still valid.
+    Returns ({asn: block}, {key: block}), or None if there isn't space"""
+
+    groups = defaultdict(list)
+    for cd in cds:
+        groups[cd.get('asn')].append(cd)
+    group_blocks = _allocate_groups(BlockPool(address_block.first,
+                                              address_block.prefixlen),
+                                    previous, sorted(groups),
+                                    dict.fromkeys(groups, (16, 16)))
+    if group_blocks is None:
+        return None
+
+    allocations = {}
+    for (asn, group_cds) in sorted(groups.items()):
+        # a /16 per asn, so the first block has room for new cds
+        subnets = _reallocate(BlockPool(*group_blocks[asn][0]),
+                              [((cd.node_id,),
+                                32 - subnet_size(with_slack(cd.degree(),
+                                                            cd_slack)),
+                                32 - subnet_size(cd.degree()))
+                               for cd in group_cds],
+                              previous['allocations'])
+        if subnets is None:
+            return None
+        allocations.update(subnets)
+        for cd in group_cds:
+            addresses = _reallocate(_host_pool(*subnets[(cd.node_id,)]),
+                                    [(key, 32, 32) for (key, _)
+                                     in _cd_interfaces(cd)],
+                                    previous['allocations'])
+            if addresses is None:
+                return None
+            allocations.update(addresses)
+    return (group_blocks, allocations)
+
+
+def _allocate_hosts_from(previous, address_block, hosts, max_prefixlen=32,
+                         group_slack=0):
+    """Allocates an address for each (group, key) of hosts, from the blocks
+    of each group, keeping the previous allocations where still valid.
+    A group that outgrows its blocks gets another block for the rest of
+    its hosts, so its existing addresses don't move.
+    Returns ({group: [block]}, {key: block}), or None if there isn't
+    space"""
+
+    groups = defaultdict(list)
+    for (group, key) in hosts:
+        groups[group].append(key)
+    prefixlens = dict((group, (
+        min(max_prefixlen, 32 - subnet_size(with_slack(len(keys),
+                                                       group_slack))),
+        min(max_prefixlen, 32 - subnet_size(len(keys)))))
+        for (group, keys) in groups.items())
+    pool = BlockPool(address_block.first, address_block.prefixlen)
+    group_blocks = _allocate_groups(pool, previous, sorted(groups),
+                                    prefixlens)
+    if group_blocks is None:
+        return None
+
+    allocations = {}
+    for (group, keys) in sorted(groups.items()):
+        host_pools = [_host_pool(*block) for block in group_blocks[group]]
+        new_keys = []
+        for key in keys:
+            block = previous['allocations'].get(key)
+            if block and any(host_pool.reserve(*block)
+                             for host_pool in host_pools):
+                allocations[key] = block
+            else:
+                new_keys.append(key)
+
+        for (index, key) in enumerate(new_keys):
+            for host_pool in host_pools:
+                base = host_pool.allocate(32)
+                if base is not None:
+                    break
+            else:
+                # outgrown: add a block for the remaining hosts
+                prefixlen = min(max_prefixlen, 32 - subnet_size(
+                    with_slack(len(new_keys) - index, group_slack)))
+                block_base = pool.allocate(prefixlen)
+                if block_base is None:
+                    return None
+                group_blocks[group].append((block_base, prefixlen))
+                host_pools.append(_host_pool(block_base, prefixlen))
+                base = host_pools[-1].allocate(32)
+            allocations[key] = (base, 32)
+    return (group_blocks, allocations)
+
+
+def _group_allocations(group_blocks):
+    """{group: [block]} as IpTree.group_allocations"""
+
+    return dict((group, [_to_netaddr(block) for block in blocks])
+                for (group, blocks) in group_blocks.items() if group)
+
+
+def _utilisation(group_blocks, hosts):
+    """Returns the capacity, allocated and used addresses of each group
+    block ({group: [block]}), from the (group, allocated, used) of hosts
+
+    >>> _utilisation({1: [netaddr.IPNetwork("10.0.0.0/29")]}, [(1, 4, 2)])
+    {1: {'allocated': 4, 'used': 2, 'capacity': 8}}
+
+    """
+
+    result = dict((group, {'capacity': sum(block.size for block in blocks),
+                           'allocated': 0, 'used': 0})
+                  for (group, blocks) in group_blocks.items())
+    for (group, allocated, used) in hosts:
+        if group in result:
+            result[group]['allocated'] += allocated
+            result[group]['used'] += used
+    return result
 
 
 def assign_asn_to_interasn_cds(g_ip, address_block=None):
@@ -620,46 +1044,117 @@ def assign_asn_to_interasn_cds(g_ip, address_block=None):
     return
 
 
-def allocate_infra(g_ip, address_block=None):
+def allocate_infra(g_ip, address_block=None, ledger=None, cd_slack=0):
     if not address_block:
         address_block = netaddr.IPNetwork('10.0.0.0/8')
     log.debug('Allocating v4 Infrastructure IPs')
-    ip_tree = IpTree(address_block)
     assign_asn_to_interasn_cds(g_ip)
-    nodes_to_allocate = sorted(n for n in g_ip.nodes('broadcast_domain')
-        if n.allocate)
-    ip_tree.add_nodes(nodes_to_allocate)
-    ip_tree.build()
-
-    # cd_tree = ip_tree.json()
-
-    ip_tree.assign()
-
-    g_ip.data.infra_blocks = ip_tree.group_allocations()
-
-    # total_tree = { 'name': "ip", 'children': [cd_tree], }
-    # jsontree = json.dumps(total_tree, cls=autonetkit.ank_json.AnkEncoder, indent = 4)
-
-    g_ip.data.infra_blocks = ip_tree.group_allocations()
+    nodes_to_allocate = sorted((n for n in g_ip.nodes('broadcast_domain')
+                                if n.allocate), key=_host_key)
+
+    result = None
+    previous = ledger.previous('infra', address_block) if ledger else None
+    if previous:
+        result = _allocate_infra_from(previous, address_block,
+                                      nodes_to_allocate, cd_slack)
+        if result is None:
+            log.warning('Not enough free space in IPv4 infrastructure '
+                        'block %s for new collision domains, re-allocating '
+                        'all' % address_block)
+
+    if result is None:
+        ip_tree = IpTree(address_block, cd_slack=cd_slack)
+        ip_tree.add_nodes(nodes_to_allocate)
+        ip_tree.build()
+
+        # cd_tree = ip_tree.json()
+
+        ip_tree.assign()
+
+        # total_tree = { 'name': "ip", 'children': [cd_tree], }
+        # jsontree = json.dumps(total_tree, cls=autonetkit.ank_json.AnkEncoder, indent = 4)
+
+        g_ip.data.infra_blocks = ip_tree.group_allocations()
+    else:
+        (group_blocks, allocations) = result
+        for cd in nodes_to_allocate:
+            subnet = _to_netaddr(allocations[(cd.node_id,)])
+            cd.subnet = subnet
+            for (key, interface) in _cd_interfaces(cd):
+                ip_address = ank_ip.ip_address(allocations[key][0])
+                if interface.is_loopback:
+                    # secondary loopback, as IpTree.assign
+                    interface.loopback = ip_address
+                    interface.subnet = ank_ip.ip_network(ip_address, 32)
+                else:
+                    interface.ip_address = ip_address
+                    interface.subnet = subnet
+        g_ip.data.infra_blocks = _group_allocations(group_blocks)
+
+    g_ip.data.infra_utilisation = _utilisation(
+        g_ip.data.infra_blocks, [(cd.asn, cd.subnet.size, cd.degree())
+                                 for cd in nodes_to_allocate])
+
+    if ledger is not None:
+        allocations = {}
+        for cd in nodes_to_allocate:
+            allocations[(cd.node_id,)] = cd.subnet
+            for (key, interface) in _cd_interfaces(cd):
+                if interface.is_loopback:
+                    allocations[key] = interface.loopback
+                else:
+                    allocations[key] = interface.ip_address
+        ledger.record('infra', address_block, g_ip.data.infra_blocks,
+                      allocations)
 
 
 # TODO: apply directly here
 
-def allocate_loopbacks(g_ip, address_block=None):
+def allocate_loopbacks(g_ip, address_block=None, ledger=None,
+                       group_slack=0):
     if not address_block:
         address_block = netaddr.IPNetwork('192.168.0.0/22')
     log.debug('Allocating v4 Primary Host loopback IPs')
-    ip_tree = IpTree(address_block)
-    ip_tree.add_nodes(sorted(g_ip.l3devices()))
-    ip_tree.build()
-
-    # loopback_tree = ip_tree.json()
-
-    ip_tree.assign()
-    g_ip.data.loopback_blocks = ip_tree.group_allocations()
-
-
-def allocate_secondary_loopbacks(g_ip, address_block=None):
+    l3devices = sorted(g_ip.l3devices(), key=_host_key)
+
+    result = None
+    previous = ledger.previous('loopbacks', address_block) if ledger else None
+    if previous:
+        result = _allocate_hosts_from(previous, address_block,
+                                      [(node.asn, (node.node_id,))
+                                       for node in l3devices],
+                                      group_slack=group_slack)
+        if result is None:
+            log.warning('Not enough free space in IPv4 loopback block %s '
+                        'for new devices, re-allocating all' % address_block)
+
+    if result is None:
+        ip_tree = IpTree(address_block, group_slack=group_slack)
+        ip_tree.add_nodes(l3devices)
+        ip_tree.build()
+
+        # loopback_tree = ip_tree.json()
+
+        ip_tree.assign()
+        g_ip.data.loopback_blocks = ip_tree.group_allocations()
+    else:
+        (group_blocks, allocations) = result
+        for node in l3devices:
+            node.loopback = ank_ip.ip_address(
+                allocations[(node.node_id,)][0])
+        g_ip.data.loopback_blocks = _group_allocations(group_blocks)
+
+    g_ip.data.loopback_utilisation = _utilisation(
+        g_ip.data.loopback_blocks, [(node.asn, 1, 1) for node in l3devices])
+
+    if ledger is not None:
+        ledger.record('loopbacks', address_block, g_ip.data.loopback_blocks,
+                      dict(((node.node_id,), node.loopback)
+                           for node in l3devices))
+
+
+def allocate_secondary_loopbacks(g_ip, address_block=None, ledger=None,
+                                 group_slack=0):
     if not address_block:
         address_block = netaddr.IPNetwork('172.16.0.0/24')
 
@@ -672,16 +1167,47 @@ def allocate_secondary_loopbacks(g_ip, address_block=None):
     log.debug('Allocating v4 Secondary Host loopback IPs')
     log.debug('Allocating v4 Secondary Host loopback IPs to %s',
         secondary_loopbacks)
-    ip_tree = IpTree(address_block)
-
-    #vrf_loopbacks = [i for i in secondary_loopbacks if i['vrf'].vrf_name]
-
-    ip_tree.add_nodes(sorted(secondary_loopbacks))
-
-    ip_tree.build()
-
-    # secondary_loopback_tree = ip_tree.json()
-
-    ip_tree.assign()
+    secondary_loopbacks = sorted(secondary_loopbacks, key=_host_key)
+    keys = _secondary_loopback_keys(secondary_loopbacks)
+
+    result = None
+    previous = (ledger.previous('secondary_loopbacks', address_block)
+                if ledger else None)
+    if previous:
+        # groups are /24 blocks, as in IpTree
+        result = _allocate_hosts_from(previous, address_block,
+                                      [(interface.node.asn, key)
+                                       for (key, interface) in keys],
+                                      max_prefixlen=24,
+                                      group_slack=group_slack)
+        if result is None:
+            log.warning('Not enough free space in IPv4 secondary loopback '
+                        'block %s for new loopbacks, re-allocating all'
+                        % address_block)
+
+    if result is None:
+        ip_tree = IpTree(address_block, group_slack=group_slack)
+
+        #vrf_loopbacks = [i for i in secondary_loopbacks if i['vrf'].vrf_name]
+
+        ip_tree.add_nodes(secondary_loopbacks)
+
+        ip_tree.build()
+
+        # secondary_loopback_tree = ip_tree.json()
+
+        ip_tree.assign()
+        groups = ip_tree.group_allocations()
+    else:
+        (group_blocks, allocations) = result
+        for (key, interface) in keys:
+            interface.loopback = ank_ip.ip_address(allocations[key][0])
+            interface.subnet = ank_ip.ip_network(interface.loopback, 32)
+        groups = _group_allocations(group_blocks)
 
     # TODO: store vrf block to g_ip.data
+
+    if ledger is not None:
+        ledger.record('secondary_loopbacks', address_block, groups,
+                      dict((key, interface.loopback)
+                           for (key, interface) in keys))
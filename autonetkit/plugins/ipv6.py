@@ -1,12 +1,14 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 import json
+from collections import defaultdict
 
 import autonetkit.ank as ank_utils
+import autonetkit.ank_ip as ank_ip
 import autonetkit.ank_json
 import autonetkit.ank_messaging
 import autonetkit.log as log
-import netaddr
+from autonetkit.exception import AutoNetkitException
 
 # TODO: allow slack in allocations: both for ASN (group level), and for
 # collision domains to allow new nodes to be easily added
@@ -37,109 +39,122 @@ def assign_asn_to_interasn_cds(G_ip):
     return
 
 
-def allocate_loopbacks(g_ip, address_block=None):
-    # TODO: handle no block specified
-    loopback_blocks = {}
-    loopback_pool = address_block.subnet(80)
+def _first_host(base):
+    """First address allocated from the block at base, as iter_hosts()
+    after dropping .0: iter_hosts() skips the address :: if base is 0"""
 
-    # consume the first address as it is the network address
+    if base == 0:
+        return 2
+    return base + 1
 
-    _ = loopback_pool.next()  # network address
 
-    unique_asns = set(n.asn for n in g_ip)
-    for asn in sorted(unique_asns):
-        loopback_blocks[asn] = loopback_pool.next()
+def _nodes_by_asn(g_ip):
+    """Returns {asn: nodes} for g_ip, in node order as groupby"""
 
-    for (asn, devices) in g_ip.groupby('asn').items():
-        loopback_hosts = loopback_blocks[asn].iter_hosts()
-        # drop .0 as a host address (valid but can be confusing)
-        loopback_hosts.next()
-        l3hosts = set(d for d in devices if d.is_l3device())
-        for host in sorted(l3hosts, key=lambda x: x.label):
-            host.loopback = loopback_hosts.next()
+    nodes_by_asn = defaultdict(list)
+    for node in g_ip:
+        nodes_by_asn[node.asn].append(node)
+    return nodes_by_asn
 
-    g_ip.data.loopback_blocks = dict((asn, [subnet]) for (asn,
-                                                          subnet) in loopback_blocks.items())
 
+def _asn_blocks(g_ip, address_block, prefixlen=80):
+    """Returns the nodes of g_ip by asn, and the base of the /prefixlen
+    block of each asn: the asns in sorted order take the blocks after the
+    first (network) block of address_block"""
 
-def allocate_infra(g_ip, address_block=None):
-    infra_blocks = {}
+    nodes_by_asn = _nodes_by_asn(g_ip)
+    size = 1 << (128 - prefixlen)
+    asns = sorted(nodes_by_asn)
+    if address_block.prefixlen > prefixlen \
+            or len(asns) >= 1 << (prefixlen - address_block.prefixlen):
+        message = ("Cannot allocate %s /%s IPv6 blocks from %s. Please "
+                   "specify a larger root IP block."
+                   % (len(asns) + 1, prefixlen, address_block))
+        log.error(message)
+        raise AutoNetkitException(message)
+
+    blocks = dict((asn, address_block.first + (index + 1) * size)
+                  for (index, asn) in enumerate(asns))
+    return (nodes_by_asn, blocks)
+
+
+def allocate_loopbacks(g_ip, address_block=None):
+    # TODO: handle no block specified
+    (nodes_by_asn, loopback_blocks) = _asn_blocks(g_ip, address_block)
 
-# TODO: check if need to do network address... possibly only for
-# loopback_pool and infra_pool so maps to asn
+    for (asn, devices) in nodes_by_asn.items():
+        address = _first_host(loopback_blocks[asn])
+        l3hosts = set(d for d in devices if d.is_l3device())
+        for host in sorted(l3hosts, key=lambda x: x.label):
+            host.loopback = ank_ip.ip_address(address, 6)
+            address += 1
 
-    infra_pool = address_block.subnet(80)
+    g_ip.data.loopback_blocks = dict(
+        (asn, [ank_ip.ip_network(base, 80, 6)])
+        for (asn, base) in loopback_blocks.items())
 
-    # consume the first address as it is the network address
 
-    _ = infra_pool.next()  # network address
+def _allocate_cds(cds, base, prefixlen):
+    """Allocates consecutive /prefixlen subnets from base to cds, and
+    addresses from each subnet to the edges of each cd"""
 
-    unique_asns = set(n.asn for n in g_ip)
-    for asn in sorted(unique_asns):
-        infra_blocks[asn] = infra_pool.next()
+    size = 1 << (128 - prefixlen)
+    for bc in cds:
+        bc.subnet = ank_ip.ip_network(base, prefixlen, 6)
+        address = _first_host(base)
+        # TODO: check: should sort by default on dst as tie-breaker
+        for edge in sorted(bc.edges(), key=lambda x: x.dst.label):
+            edge.ip = ank_ip.ip_address(address, 6)
+            address += 1
+        base += size
 
-    for (asn, devices) in sorted(g_ip.groupby('asn').items()):
-        subnets = infra_blocks[asn].subnet(96)
-        subnets.next()  # network address
-        ptp_subnet = subnets.next().subnet(126)
-        ptp_subnet.next()  # network address
+
+def allocate_infra(g_ip, address_block=None):
+    (nodes_by_asn, infra_blocks) = _asn_blocks(g_ip, address_block)
+
+    # each asn /80 is split into /96 subnets: the first is the network
+    # address, the second is split into /126 subnets for point-to-point
+    # links (after its network address), and the rest are for the other
+    # collision domains
+    for (asn, devices) in nodes_by_asn.items():
+        base = infra_blocks[asn]
         all_bcs = set(d for d in devices if d.broadcast_domain
             and d.allocate)
         ptp_bcs = [bc for bc in all_bcs if bc.degree() == 2]
-
-        for bc in sorted(ptp_bcs):
-            subnet = ptp_subnet.next()
-            hosts = subnet.iter_hosts()
-            # drop .0 as a host address (valid but can be confusing)
-            hosts.next()
-            bc.subnet = subnet
-            # TODO: check: should sort by default on dst as tie-breaker
-            for edge in sorted(bc.edges(), key=lambda x: x.dst.label):
-                edge.ip = hosts.next()
-
         non_ptp_cds = all_bcs - set(ptp_bcs)
+        if len(non_ptp_cds) > (1 << 16) - 2:
+            message = ("Cannot allocate %s /96 IPv6 subnets in AS%s block "
+                       "%s" % (len(non_ptp_cds), asn,
+                               ank_ip.ip_network(base, 80, 6)))
+            log.error(message)
+            raise AutoNetkitException(message)
 
-        # break into /96 subnets
+        _allocate_cds(sorted(ptp_bcs, key=ank_utils.sort_key),
+                      base + (1 << 32) + 4, 126)
+        _allocate_cds(sorted(non_ptp_cds, key=ank_utils.sort_key),
+                      base + (2 << 32), 96)
 
-        for bc in sorted(non_ptp_cds):
-            subnet = subnets.next()
-            hosts = subnet.iter_hosts()
-            # drop .0 as a host address (valid but can be confusing)
-            hosts.next()
-            bc.subnet = subnet
-            for edge in sorted(bc.edges(), key=lambda x: x.dst.label):
-                edge.ip = hosts.next()
-
-    g_ip.data.infra_blocks = dict((asn, [subnet]) for (asn, subnet) in
-                                  infra_blocks.items())
+    g_ip.data.infra_blocks = dict(
+        (asn, [ank_ip.ip_network(base, 80, 6)])
+        for (asn, base) in infra_blocks.items())
 
 
 def allocate_secondary_loopbacks(g_ip, address_block=None):
-    secondary_loopback_blocks = {}
-    secondary_loopback_pool = address_block.subnet(80)
-    # consume the first address as it is the network address
-    # network address
-    secondary_loopback_network = secondary_loopback_pool.next()
-
-    unique_asns = set(n.asn for n in g_ip)
-    for asn in sorted(unique_asns):
-        secondary_loopback_blocks[asn] = \
-            secondary_loopback_network.next()
-
-    for (asn, devices) in g_ip.groupby('asn').items():
+    (nodes_by_asn, secondary_loopback_blocks) = _asn_blocks(g_ip,
+                                                            address_block)
+
+    for (asn, devices) in nodes_by_asn.items():
         l3hosts = set(d for d in devices if d.is_l3device())
         routers = [n for n in l3hosts if n.is_router()]  # filter
         secondary_loopbacks = [i for n in routers for i in
                                n.loopback_interfaces()
                                if not i.is_loopback_zero]
 
-        secondary_loopback_hosts = \
-            secondary_loopback_blocks[asn].iter_hosts()
-        # drop .0 as a host address (valid but can be confusing)
-        secondary_loopback_hosts.next()
+        address = _first_host(secondary_loopback_blocks[asn])
         for interface in sorted(secondary_loopbacks):
-            interface.loopback = secondary_loopback_hosts.next()
-            interface.subnet = netaddr.IPNetwork("%s/128" % interface.loopback)
+            interface.loopback = ank_ip.ip_address(address, 6)
+            interface.subnet = ank_ip.ip_network(address, 128, 6)
+            address += 1
 
 
 def allocate_ips(G_ip, infra_block=None, loopback_block=None, secondary_loopback_block=None):
@@ -0,0 +1,138 @@
+"""Per-stage timing for build_network and workflow.
+
+Each stage of the design rules, compilers, render and archive is timed
+with the stage context manager. The report records per stage the wall
+time, CPU time, the process peak RSS so far and how much the stage raised
+it, and node and edge counts for each overlay.
+
+Stages can nest, eg an overlay built on demand during a compile stage:
+the time of a nested stage is also counted in its enclosing stages, so
+its record gives the parent stage name, or None for a top-level stage.
+
+>>> reset()
+>>> with stage("example"):
+...     with stage("nested"):
+...         pass
+>>> [(entry['name'], entry['parent']) for entry in report()['stages']]
+[('nested', 'example'), ('example', None)]
+
+console_script --timing FILE writes the report as JSON.
+"""
+
+import contextlib
+import json
+import os
+import time
+
+import autonetkit.log as log
+
+try:
+    import resource
+except ImportError:
+    resource = None  # eg Windows: peak RSS not reported
+
+_stages = []  # stage records, in order completed
+_open_stages = []  # names of the stages currently running, outermost first
+_overlay_stages = {}  # overlay_id -> name of stage that created it
+_overlays = {}  # overlay_id -> {'nodes': n, 'edges': m}
+
+
+def _cpu_time():
+    """User + system CPU time for this process"""
+
+    times = os.times()
+    return times[0] + times[1]
+
+
+def _peak_rss():
+    """Peak resident set size of this process (KB on Linux), or None"""
+
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def reset():
+    """Clears the recorded stages and overlays, eg before a new build"""
+
+    del _stages[:]
+    del _open_stages[:]
+    _overlay_stages.clear()
+    _overlays.clear()
+
+
+@contextlib.contextmanager
+def stage(name, anm=None):
+    """Records wall time, CPU time and peak RSS for the enclosed block.
+    If anm is given, overlays added in the block are attributed to name.
+
+    process_peak_rss is the peak for the process so far, at the end of the
+    stage. peak_rss_increase is how much the stage raised it: 0 unless the
+    stage set a new high-water mark"""
+
+    overlays_before = set(anm.overlay_nx_graphs) if anm else None
+    parent = _open_stages[-1] if _open_stages else None
+    _open_stages.append(name)
+    wall_start = time.time()
+    cpu_start = _cpu_time()
+    rss_start = _peak_rss()
+    try:
+        yield
+    finally:
+        _open_stages.pop()
+        process_peak_rss = _peak_rss()
+        record = {
+            'name': name,
+            'parent': parent,
+            'wall_time': time.time() - wall_start,
+            'cpu_time': _cpu_time() - cpu_start,
+            'process_peak_rss': process_peak_rss,
+            'peak_rss_increase': (process_peak_rss - rss_start
+                                  if resource is not None else None),
+        }
+        _stages.append(record)
+        if anm:
+            for overlay_id in set(anm.overlay_nx_graphs) - overlays_before:
+                _overlay_stages[overlay_id] = name
+        log.debug("Stage %s: %.3fs wall, %.3fs cpu" % (name,
+                  record['wall_time'], record['cpu_time']))
+
+
+def add_stage(record, overlay_ids=()):
+    """Adds a stage record made elsewhere, eg in a worker process,
+    and attributes overlay_ids to it. The RSS figures are of that process"""
+
+    record = dict(record)
+    record['parent'] = _open_stages[-1] if _open_stages else None
+    _stages.append(record)
+    for overlay_id in overlay_ids:
+        _overlay_stages[overlay_id] = record['name']
+
+
+def record_overlays(anm):
+    """Records the node and edge counts of each overlay in anm"""
+
+    for (overlay_id, graph) in anm.overlay_nx_graphs.items():
+        _overlays[overlay_id] = {
+            'nodes': graph.number_of_nodes(),
+            'edges': graph.number_of_edges(),
+            'stage': _overlay_stages.get(overlay_id),
+        }
+
+
+def report():
+    """Returns the recorded stages and overlay counts"""
+
+    return {
+        'stages': [dict(record) for record in _stages],
+        'overlays': dict((overlay_id, dict(counts)) for (overlay_id, counts)
+                         in _overlays.items()),
+    }
+
+
+def write_report(filename):
+    """Writes report() to filename as JSON"""
+
+    with open(filename, 'w') as fh:
+        json.dump(report(), fh, indent=4, sort_keys=True)
+    log.info("Wrote timing report to %s" % filename)
@@ -5,7 +5,9 @@ import os
 import autonetkit
 import autonetkit.ank_json as ank_json
 import autonetkit.config as config
+import autonetkit.incremental as incremental_module
 import autonetkit.log as log
+import autonetkit.profiling as profiling
 import autonetkit.render as render
 from autonetkit.nidb import DeviceModel
 
@@ -46,8 +48,11 @@ def file_monitor(filename):
 def manage_network(input_graph_string, timestamp, build=True,
                    visualise=True, compile=True, validate=True, render=True,
                    monitor=False, deploy=False, measure=False, diff=False,
-                   archive=False, grid=None, ):
-    """Build, compile, render network as appropriate"""
+                   archive=False, grid=None, incremental=None):
+    """Build, compile, render network as appropriate.
+    incremental is an autonetkit.incremental.IncrementalBuild, to skip
+    unchanged inputs, rerun only the affected design stages, and recompile
+    and re-render only the affected devices (eg for monitor)"""
 
     # import build_network_simple as build_network
 
@@ -56,15 +61,28 @@ def manage_network(input_graph_string, timestamp, build=True,
     dst_folder = None
 
     if build:
-        if input_graph_string:
-            graph = build_network.load(input_graph_string)
-        elif grid:
-            graph = build_network.grid_2d(grid)
+        with profiling.stage("load"):
+            if input_graph_string:
+                graph = build_network.load(input_graph_string)
+            elif grid:
+                graph = build_network.grid_2d(grid)
+
+        if incremental:
+            input_diff = incremental.update_input(graph)
+            if input_diff is not None:
+                if incremental_module.is_empty(input_diff):
+                    log.info("Input graph unchanged, skipping rebuild")
+                    return incremental.dst_folder
+                log.info("Input graph changed: %s"
+                         % incremental_module.summary(input_diff))
 
         # TODO: integrate the code to visualise on error (enable in config)
         anm = None
         try:
-            anm = build_network.build(graph)
+            if incremental:
+                anm = incremental.build(graph)
+            else:
+                anm = build_network.build(graph)
         except Exception, e:
             # Send the visualisation to help debugging
             try:
@@ -101,21 +119,30 @@ def manage_network(input_graph_string, timestamp, build=True,
 
     if compile:
         if archive:
-            anm.save()
-        nidb = compile_network(anm)
+            with profiling.stage("archive_anm"):
+                anm.save()
+        if incremental:
+            nidb = incremental.compile(anm)
+        else:
+            nidb = compile_network(anm)
         autonetkit.update_vis(anm, nidb)
 
         #autonetkit.update_vis(anm, nidb)
         log.debug('Sent ANM to web server')
         if archive:
-            nidb.save()
+            with profiling.stage("archive_nidb"):
+                nidb.save()
 
         # render.remove_dirs(["rendered"])
 
         if render:
             import time
             #start = time.clock()
-            dst_folder = autonetkit.render.render(nidb)
+            with profiling.stage("render"):
+                if incremental:
+                    dst_folder = incremental.render(nidb)
+                else:
+                    dst_folder = autonetkit.render.render(nidb)
             # print time.clock() - start
             #import autonetkit.render2
             #start = time.clock()
@@ -153,9 +180,12 @@ def manage_network(input_graph_string, timestamp, build=True,
 
 
 #@do_cprofile
-def compile_network(anm):
+def compile_network(anm, devices=None):
+    """devices is an autonetkit.incremental.DeviceCache, to reuse the
+    configurations of unaffected devices (netkit and cisco platforms)"""
     # log.info("Creating base network model")
-    nidb = create_nidb(anm)
+    with profiling.stage("create_nidb"):
+        nidb = create_nidb(anm)
     g_phy = anm['phy']
     # log.info("Compiling to targets")
 
@@ -165,12 +195,14 @@ def compile_network(anm):
         if platform == 'netkit':
             import autonetkit.compilers.platform.netkit as pl_netkit
             platform_compiler = pl_netkit.NetkitCompiler(nidb, anm,
-                                                         host)
+                                                         host,
+                                                         devices=devices)
         elif platform == 'cisco':
             try:
                 import autonetkit.compilers.platform.cisco as pl_cisco
                 platform_compiler = pl_cisco.CiscoCompiler(nidb, anm,
-                                                           host)
+                                                           host,
+                                                           devices=devices)
             except ImportError:
                 log.debug('Unable to load cisco platform compiler')
         elif platform == 'VIRL':
@@ -192,7 +224,8 @@ def compile_network(anm):
         if any(g_phy.nodes(host=host, platform=platform)):
             # log.info('Compiling configurations for %s on %s'
                      # % (platform, host))
-            platform_compiler.compile()  # only compile if hosts set
+            with profiling.stage("compile_%s_%s" % (platform, host)):
+                platform_compiler.compile()  # only compile if hosts set
         else:
             log.debug('No devices set for %s on %s' % (platform, host))
 
@@ -0,0 +1,41 @@
+import pickle
+
+import autonetkit.ank_ip as ank_ip
+import autonetkit.ank_json as ank_json
+import netaddr
+
+
+def test_ank_ip():
+    address = ank_ip.ip_address("192.168.0.1")
+    assert(address is ank_ip.ip_address(3232235521))
+    assert(address is ank_ip.ip_address(netaddr.IPAddress("192.168.0.1")))
+    assert(address == netaddr.IPAddress("192.168.0.1"))
+    assert(str(address) == "192.168.0.1")
+
+    subnet = ank_ip.ip_network(address, 30)
+    assert(subnet is ank_ip.ip_network("192.168.0.1/30"))
+    assert(subnet is ank_ip.interned(netaddr.IPNetwork("192.168.0.1/30")))
+    assert(address in subnet)
+    assert(subnet.network == netaddr.IPAddress("192.168.0.0"))
+    assert([str(s) for s in subnet.subnet(31)]
+           == ["192.168.0.0/31", "192.168.0.2/31"])
+    assert(str(subnet) == "192.168.0.1/30")
+
+    # shared values can't be modified in place
+    try:
+        subnet.prefixlen = 32
+    except TypeError:
+        pass
+    else:
+        assert(False)
+    next_address = address
+    next_address += 1
+    assert(str(next_address) == "192.168.0.2" and str(address) == "192.168.0.1")
+
+    assert(pickle.loads(pickle.dumps(subnet)) is subnet)
+    assert(ank_json.string_to_netaddr("192.168.0.1/30") is subnet)
+    assert(ank_json.string_to_netaddr("192.168.0.1") is address)
+
+    ipv6 = ank_ip.ip_network("2001:db8::/64")
+    assert(ipv6 is ank_ip.ip_network(ipv6.value, 64, 6))
+    assert(ipv6.version == 6)
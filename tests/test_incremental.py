@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+
+import autonetkit.build_network as build_network
+import autonetkit.incremental as incremental
+import autonetkit.workflow as workflow
+
+
+def test_incremental_render():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    os.chdir(tmp_dir)  # render to rendered/ in tmp_dir
+    try:
+        state = incremental.IncrementalBuild()
+
+        def rebuild(graph):
+            diff = state.update_input(graph)
+            nidb = workflow.compile_network(build_network.build(graph))
+            state.render(nidb)
+            return diff
+
+        graph = build_network.load(input_string)
+        assert(rebuild(graph) is None)
+        signatures = dict(state.device_signatures)
+        assert(len(signatures) == len(graph))
+
+        # unchanged input: same devices
+        graph = build_network.load(input_string)
+        diff = rebuild(graph)
+        assert(incremental.is_empty(diff))
+        assert(state.device_signatures == signatures)
+
+        # change one router: only its device changes
+        graph = build_network.load(input_string)
+        graph.node["as20r1"]["custom_config_ospf"] = "passive-interface eth1"
+        diff = rebuild(graph)
+        assert(diff['nodes_changed'] == ["as20r1"])
+        assert(incremental.summary(diff) == "1 nodes changed")
+        changed = [node_id for (node_id, signature)
+                   in state.device_signatures.items()
+                   if signatures[node_id] != signature]
+        assert(changed == ["as20r1"])
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+
+def test_incremental_build():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    def signatures(nidb):
+        return dict((node.node_id, incremental.device_signature(node))
+                    for node in nidb)
+
+    def full_build(graph):
+        return signatures(workflow.compile_network(build_network.build(graph)))
+
+    state = incremental.IncrementalBuild()
+
+    def rebuild(graph):
+        state.update_input(graph)
+        return signatures(state.compile(state.build(graph)))
+
+    graph = build_network.load(input_string)
+    rebuild(graph)
+    assert("build_phy" in state.stages_run)
+
+    # one link: ospf_cost isn't read by a design stage, so no stage reruns,
+    # and only the devices of the link are recompiled
+    graph = build_network.load(input_string)
+    graph.edge["as20r1"]["as20r3"]["ospf_cost"] = 10
+    result = rebuild(graph)
+    assert(state.stages_run == [])
+    assert(state.devices.compiled == set(["as20r1", "as20r3"]))
+    assert(result == full_build(graph))
+
+    # ospf_area is only read by build_igp, and changes the OSPF data of
+    # as20r2 and its neighbors (eg the ABR type)
+    graph = build_network.load(input_string)
+    graph.node["as20r2"]["ospf_area"] = 1
+    result = rebuild(graph)
+    assert(state.stages_run == ["build_igp"])
+    assert("as20r1" in state.devices.compiled)
+    assert("as100r2" not in state.devices.compiled)
+    assert(result == full_build(graph))
+
+    # removing a link changes phy: every stage reruns
+    graph = build_network.load(input_string)
+    graph.remove_edge("as20r1", "as20r3")
+    result = rebuild(graph)
+    assert("build_bgp" in state.stages_run)
+    assert(result == full_build(graph))
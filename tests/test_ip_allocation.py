@@ -0,0 +1,38 @@
+import json
+import os
+
+import autonetkit.build_network as build_network
+
+
+def allocation(anm):
+    """Returns the loopbacks, collision domain subnets, link addresses and
+    group blocks of the ipv4 overlay, as strings"""
+
+    g_ip = anm['ipv4']
+    result = {}
+    for node in g_ip:
+        if node.broadcast_domain:
+            result[node.node_id] = str(node.subnet)
+            for edge in node.edges():
+                key = "%s %s" % (node.node_id, edge.dst.node_id)
+                result[key] = str(edge.dst_int.ip_address)
+        else:
+            result[node.node_id] = str(node.loopback)
+    for name in ("infra_blocks", "loopback_blocks"):
+        result[name] = dict((str(asn), [str(block) for block in blocks])
+                            for (asn, blocks) in g_ip.data[name].items())
+    return result
+
+
+def test_aarnet():
+    # labels such as Adelaide1 and Melbourne1 tie on NmNode.__lt__, so the
+    # two ends of their links are ordered by input order
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "Aarnet.graphml")
+    with open(input_file, "r") as fh:
+        anm = build_network.build(build_network.load(fh.read()))
+
+    expected_file = os.path.join(dirname, "ip_allocation", "Aarnet.json")
+    with open(expected_file, "r") as fh:
+        expected = json.load(fh)
+    assert(allocation(anm) == expected)
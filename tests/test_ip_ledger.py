@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+
+import autonetkit.build_network as build_network
+import autonetkit.config as config
+import autonetkit.plugins.ipv4 as ipv4
+
+
+def addresses(anm):
+    """Returns the loopbacks, collision domain subnets and link addresses"""
+
+    g_ip = anm['ipv4']
+    result = {}
+    for node in g_ip:
+        if node.broadcast_domain:
+            result[node.node_id] = str(node.subnet)
+            for edge in node.edges():
+                result[(node.node_id, edge.dst.node_id)] = str(
+                    edge.dst_int.ip_address)
+        else:
+            result[node.node_id] = str(node.loopback)
+    return result
+
+
+def test_ip_ledger():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    os.chdir(tmp_dir)  # ledger in versions/ip in tmp_dir
+    settings = config.settings['IP Addressing']
+    try:
+        settings['ledger'] = True
+        first = addresses(build_network.build(
+            build_network.load(input_string)))
+        assert(os.path.isfile(ipv4.IpLedger.filename()))
+
+        # unchanged input: same addresses
+        second = addresses(build_network.build(
+            build_network.load(input_string)))
+        assert(second == first)
+
+        # new router: existing addresses kept, new entities allocated
+        graph = build_network.load(input_string)
+        graph.add_node("as20r9", dict(graph.node["as20r1"], label="as20r9"))
+        graph.add_edge("as20r9", "as20r1")
+        anm = build_network.build(graph)
+        third = addresses(anm)
+        assert(all(third[key] == value for (key, value) in first.items()))
+        new = [key for key in third if key not in first]
+        assert("as20r9" in new)
+        assert(third["as20r9"] not in first.values())
+
+        # AS20 outgrows its /29 loopback block: the block is kept, and
+        # another added for the new routers
+        blocks = anm['ipv4'].data.loopback_blocks
+        assert([str(block) for block in blocks[20]] == ["192.168.0.32/29"])
+        for label in ["as20r5", "as20r6", "as20r7", "as20r8"]:
+            graph.add_node(label, dict(graph.node["as20r1"], label=label))
+            graph.add_edge(label, "as20r1")
+        anm = build_network.build(graph)
+        fourth = addresses(anm)
+        assert(all(fourth[key] == value for (key, value) in third.items()))
+        grown = anm['ipv4'].data.loopback_blocks[20]
+        assert(grown[0] == blocks[20][0] and len(grown) == 2)
+        loopbacks = [fourth[label] for label
+                     in ["as20r5", "as20r6", "as20r7", "as20r8"]]
+        assert(len(set(loopbacks)) == 4)
+        assert(not set(loopbacks) & set(third.values()))
+    finally:
+        settings['ledger'] = False
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
+
+
+def test_ip_slack():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    def load(hub_members, new_routers=()):
+        """small_internet with a hub joining hub_members in AS300"""
+        graph = build_network.load(input_string)
+        for label in new_routers:
+            graph.add_node(label, dict(graph.node["as300r1"], label=label))
+            graph.add_edge(label, "as300r1")
+        graph.add_node("hub1", dict(graph.node["as300r1"], label="hub1",
+                                    device_type="hub"))
+        for label in hub_members:
+            graph.add_edge("hub1", label, type="physical")
+        return graph
+
+    def prefixes(g_ip):
+        """Returns the loopback group and collision domain prefixes"""
+        result = dict((asn, [str(block) for block in blocks]) for
+                      (asn, blocks) in g_ip.data.loopback_blocks.items())
+        result.update((cd.node_id, str(cd.subnet))
+                      for cd in g_ip.nodes("broadcast_domain"))
+        return result
+
+    cwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    os.chdir(tmp_dir)
+    settings = config.settings['IP Addressing']
+    try:
+        settings['ledger'] = True
+        settings['group_slack'] = 100
+        settings['cd_slack'] = 100
+        anm = build_network.build(load(["as300r1", "as300r2"]))
+        g_ip = anm['ipv4']
+        first = addresses(anm)
+        first_prefixes = prefixes(g_ip)
+        blocks = g_ip.data.loopback_blocks
+        # point-to-point links have room for two more hosts
+        assert(all(cd.subnet.prefixlen <= 29
+                   for cd in g_ip.nodes("broadcast_domain")))
+        utilisation = g_ip.data.loopback_utilisation[300]
+        assert(utilisation['used'] == 4)
+        assert(utilisation['capacity'] == blocks[300][0].size)
+
+        # new routers and hub members use the slack: the loopback group
+        # and collision domain prefixes are unchanged
+        anm = build_network.build(load(
+            ["as300r1", "as300r2", "as300r3", "as300r5"],
+            new_routers=["as300r5", "as300r6"]))
+        g_ip = anm['ipv4']
+        third = addresses(anm)
+        assert(all(third[key] == value for (key, value) in first.items()))
+        third_prefixes = prefixes(g_ip)
+        assert(all(third_prefixes[key] == value
+                   for (key, value) in first_prefixes.items()))
+        assert(g_ip.data.loopback_blocks == blocks)
+        assert(g_ip.data.loopback_utilisation[300]['used'] == 6)
+        assert(g_ip.node("hub1").degree() == 4)
+        assert(("hub1", "as300r5") in third)
+    finally:
+        settings['ledger'] = False
+        settings['group_slack'] = 0
+        settings['cd_slack'] = 0
+        os.chdir(cwd)
+        shutil.rmtree(tmp_dir)
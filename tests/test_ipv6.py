@@ -0,0 +1,30 @@
+import os
+
+import autonetkit.build_network as build_network
+import autonetkit.plugins.ipv6 as ipv6
+import netaddr
+
+
+def test_secondary_loopbacks():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        graph = build_network.load(fh.read())
+    graph.graph["address_family"] = "dual_stack"
+    anm = build_network.build(graph)
+
+    g_ipv6 = anm['ipv6']
+    interfaces = [g_ipv6.node(label).add_loopback(description="vrf")
+                  for label in ["as20r1", "as20r2", "as100r1", "as300r1"]]
+    block = netaddr.IPNetwork("2001:db8:3::/48")
+    ipv6.allocate_secondary_loopbacks(g_ipv6, block)
+
+    # a /80 block per asn, so no two asns share an address
+    loopbacks = [interface.loopback for interface in interfaces]
+    assert(len(set(loopbacks)) == len(loopbacks))
+    blocks = dict((interface.node.asn, netaddr.IPNetwork(
+        "%s/80" % interface.loopback).cidr) for interface in interfaces)
+    assert(len(set(blocks.values())) == 3)
+    assert(all(loopback in block for loopback in loopbacks))
+    assert(all(interface.subnet.prefixlen == 128
+               for interface in interfaces))
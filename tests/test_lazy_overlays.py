@@ -0,0 +1,28 @@
+import os
+
+import autonetkit.ank_validate as ank_validate
+import autonetkit.build_network as build_network
+import autonetkit.workflow as workflow
+
+
+def test_unused_igp_overlays():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    # default build: OSPF, compiled for netkit (quagga), and validated
+    anm = build_network.build(build_network.load(input_string))
+    ank_validate.validate(anm)
+    workflow.compile_network(anm)
+
+    pending = anm.pending_overlays()
+    for overlay_id in ["isis", "eigrp", "rip"]:
+        assert(overlay_id in pending)
+        assert(not anm.has_overlay(overlay_id))
+    assert(anm.has_overlay("ospf"))
+    assert(len(anm['igp']) == len(anm['ospf']))
+
+    # still built if requested directly
+    assert(len(anm['isis']) == 0)
+    assert("isis" not in anm.pending_overlays())
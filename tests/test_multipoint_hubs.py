@@ -0,0 +1,35 @@
+import os
+
+
+def test_multipoint_hubs():
+    import autonetkit.build_network as build_network
+    import autonetkit.config as config
+
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    def edge_set(overlay):
+        return sorted(sorted((str(e.src), str(e.dst)))
+                      for e in overlay.edges())
+
+    settings = config.settings['General']
+    built = []
+    try:
+        for hubs in (False, True):
+            settings['multipoint_hubs'] = hubs
+            built.append(build_network.build(build_network.load(input_string)))
+    finally:
+        settings['multipoint_hubs'] = False
+    exploded, hubbed = built
+
+    # hubs are kept in the conn overlays, but queried as the full mesh
+    g_l2_conn = hubbed['layer2_conn']
+    assert(any(n.multipoint_hub for n in g_l2_conn))
+    assert(edge_set(g_l2_conn) == edge_set(exploded['layer2_conn']))
+
+    # and don't leak into the overlays built from them
+    for overlay_id in ("layer3", "ipv4", "ospf", "ebgp"):
+        assert(edge_set(hubbed[overlay_id]) ==
+               edge_set(exploded[overlay_id]))
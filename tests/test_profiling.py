@@ -0,0 +1,36 @@
+import os
+
+import autonetkit.build_network as build_network
+import autonetkit.profiling as profiling
+
+
+def test_build_stages():
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    profiling.reset()
+    anm = build_network.build(build_network.load(input_string))
+    report = profiling.report()
+
+    names = [record['name'] for record in report['stages']]
+    for name in ["initialise", "build_phy", "build_layer1", "build_layer2",
+                 "build_layer3", "build_ip", "build_ipv4", "build_igp",
+                 "build_bgp"]:
+        assert(name in names)
+    assert(all(record['wall_time'] >= 0 for record in report['stages']))
+
+    # nested stages name their parent, as their time is also in it
+    parents = dict((record['name'], record['parent'])
+                   for record in report['stages'])
+    assert(parents['build_ospf'] == "build_igp")
+    assert(parents['build_igp'] is None)
+    assert(all(record['peak_rss_increase'] is None
+               or record['peak_rss_increase'] >= 0
+               for record in report['stages']))
+
+    counts = report['overlays']['layer3']
+    assert(counts['stage'] == "build_layer3")
+    assert(counts['nodes'] == len(anm['layer3']))
+    assert(counts['edges'] == len(anm['layer3'].edges()))
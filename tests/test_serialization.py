@@ -43,3 +43,27 @@ def test():
 
     # cleanup
     shutil.rmtree("versions")
+
+
+def test_overlay_storage():
+    import autonetkit.ank_json as ank_json
+    import autonetkit.build_network as build_network
+    import autonetkit.config as config
+
+    dirname, filename = os.path.split(os.path.abspath(__file__))
+    input_file = os.path.join(dirname, "small_internet.graphml")
+    with open(input_file, "r") as fh:
+        input_string = fh.read()
+
+    settings = config.settings['General']
+    saved = []
+    try:
+        for storage in ("dict", "columnar"):
+            settings['overlay_storage'] = storage
+            anm = build_network.build(build_network.load(input_string))
+            saved.append(ank_json.jsonify_anm(anm))
+    finally:
+        settings['overlay_storage'] = "dict"
+
+    # same saved ANM from either backend
+    assert(saved[0] == saved[1])